@@ -0,0 +1,477 @@
+"""
+    benchmark.py
+    ------------
+    Implements micro-benchmarks for the performance critical parts of Grid Control.
+
+    The Grid is emulated on a pseudo-terminal (Linux), see "emulator.py".
+
+    Run "python benchmark.py" to run all benchmarks.
+"""
+
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import time
+
+import serial
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+import datalog
+import emulator
+import grid
+import history
+import linuxhwmon
+import openhwmon
+import rollup
+import sensors
+import telemetry
+import transport
+
+
+def open_emulator(**kwargs):
+    """Start a Grid emulator and open its serial port the same way as Grid Control does.
+
+    Returns:
+        - A tuple (emulator, serial device, lock)
+    """
+
+    grid_emulator = emulator.GridEmulator(**kwargs)
+    grid_emulator.start()
+
+    ser = serial.Serial()
+    lock = threading.Lock()
+    grid.setup_serial(ser, grid_emulator.port, lock)
+    grid.open_serial(ser, lock)
+
+    return grid_emulator, ser, lock
+
+def close_emulator(grid_emulator, ser):
+    """Close the serial port and stop the emulator."""
+
+    ser.close()
+    grid_emulator.stop()
+
+
+def timed(function, repeat):
+    """Return the average wall time (s) of "function" over "repeat" calls."""
+
+    # Suppress status messages printed by the Grid functions
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            function()
+        return (time.perf_counter() - start) / repeat
+
+
+def benchmark_telemetry(repeat=5):
+    """Compare one full poll using sequential rpm/voltage reads with the pipelined telemetry read."""
+
+    grid_emulator, ser, lock = open_emulator()
+
+    sequential = timed(lambda: (grid.read_fan_rpm(ser, lock), grid.read_fan_voltage(ser, lock)), repeat)
+    pipelined = timed(lambda: grid.read_all_telemetry(ser, lock), repeat)
+
+    print("Telemetry poll (6 fans, rpm + voltage)")
+    print("  sequential read_fan_rpm/read_fan_voltage: %7.1f ms" % (sequential * 1000))
+    print("  pipelined read_all_telemetry:             %7.1f ms" % (pipelined * 1000))
+    print("  saved per poll:                           %7.1f ms" % ((sequential - pipelined) * 1000))
+
+    close_emulator(grid_emulator, ser)
+
+
+def benchmark_command_latency(repeat=20):
+    """Compare the latency of single Grid commands with the previous fixed WAIT_GRID delay."""
+
+    grid_emulator, ser, lock = open_emulator()
+    byte_time = transport.byte_time(ser)
+
+    print("Command latency (fixed delay = wire time + %.0f ms)" % (grid.WAIT_GRID * 1000))
+    for name, function, wire_bytes in [("initialize_grid", lambda: grid.initialize_grid(ser, lock), 2),
+                                       ("set_fan", lambda: grid.set_fan(ser, 1, 7.5, lock), 8)]:
+        latency = timed(function, repeat)
+        fixed = wire_bytes * byte_time + grid.WAIT_GRID
+        print("  %-16s fixed delay: %6.1f ms, response driven: %6.1f ms" % (name, fixed * 1000, latency * 1000))
+
+    close_emulator(grid_emulator, ser)
+
+
+def benchmark_set_all_fans(repeat=5):
+    """Compare setting all six fans with six set_fan calls and with one set_all_fans call."""
+
+    grid_emulator, ser, lock = open_emulator()
+    voltages = {fan: 7.5 for fan in grid.FANS}
+
+    separate = timed(lambda: [grid.set_fan(ser, fan, voltage, lock) for fan, voltage in voltages.items()], repeat)
+    bulk = timed(lambda: grid.set_all_fans(ser, voltages, lock), repeat)
+
+    print("Set voltage of 6 fans")
+    print("  6 x set_fan:    %7.1f ms" % (separate * 1000))
+    print("  set_all_fans:   %7.1f ms" % (bulk * 1000))
+
+    close_emulator(grid_emulator, ser)
+
+
+def calculate_voltage_if_chain(percent):
+    """Previous implementation of grid.calculate_voltage(), for comparison."""
+
+    if percent < 33:
+        return 0.0
+    elif percent >= 33 and percent < 36:
+        return 4.0
+    elif percent >= 36 and percent < 40:
+        return 4.5
+    elif percent >= 40 and percent < 44:
+        return 5.0
+    elif percent >= 44 and percent < 48:
+        return 5.5
+    elif percent >= 48 and percent < 52:
+        return 6.0
+    elif percent >= 52 and percent < 56:
+        return 6.5
+    elif percent >= 56 and percent < 60:
+        return 7.0
+    elif percent >= 60 and percent < 64:
+        return 7.5
+    elif percent >= 64 and percent < 68:
+        return 8.0
+    elif percent >= 68 and percent < 72:
+        return 8.5
+    elif percent >= 72 and percent < 76:
+        return 9.0
+    elif percent >= 76 and percent < 80:
+        return 9.5
+    elif percent >= 80 and percent < 84:
+        return 10.0
+    elif percent >= 84 and percent < 88:
+        return 10.5
+    elif percent >= 88 and percent < 93:
+        return 11.0
+    elif percent >= 93 and percent < 98:
+        return 11.5
+    else:
+        return 12.0
+
+def build_frame_from_dicts(fan, voltage):
+    """Previous way of building a "set fan voltage" request in grid.set_fan(), for comparison."""
+
+    speed_data = dict(grid.SPEED_DATA)
+    fan_data = dict(grid.FAN_DATA)
+    serial_data = [0x44, fan_data[fan], 0xC0, 0x00, 0x00, speed_data[voltage][0], speed_data[voltage][1]]
+    return serial.to_bytes(serial_data)
+
+def benchmark_voltage_encoding(repeat=100000):
+    """Compare converting a fan speed (percent) to a "set fan voltage" request with the previous code."""
+
+    percents = [percent % 101 for percent in range(repeat)]
+
+    start = time.perf_counter()
+    for percent in percents:
+        build_frame_from_dicts(1, calculate_voltage_if_chain(percent))
+    previous = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for percent in percents:
+        grid.VOLTAGE_FRAMES[1][grid.calculate_voltage(percent)]
+    table = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    [calculate_voltage_if_chain(percent) for percent in percents]
+    previous_all = time.perf_counter() - start
+
+    start = time.perf_counter()
+    grid.calculate_voltages(percents)
+    table_all = time.perf_counter() - start
+
+    print("Voltage encoding (percent to set fan voltage request)")
+    print("  if/elif chain + dicts + to_bytes: %7.3f us" % (previous * 1e6))
+    print("  calculate_voltage + frame table:  %7.3f us" % (table * 1e6))
+    print("  %d voltages, if/elif chain:   %7.2f ms" % (repeat, previous_all * 1000))
+    print("  %d voltages, calculate_voltages: %4.2f ms" % (repeat, table_all * 1000))
+
+
+class Sensor:
+    """Temperature sensor with the attributes used from the WMI sensor objects."""
+
+    def __init__(self, identifier, value):
+        self.Identifier = identifier
+        self.Value = value
+
+def calculate_temp_nested(temperature_sensors, sensor_ids, calc):
+    """Previous implementation of PollingThread.calculate_temp() for one sensor group, for comparison."""
+
+    temps = []
+    for id in sensor_ids:
+        for sensor in temperature_sensors:
+            if id == sensor.Identifier:
+                temps.append(sensor.Value)
+    temps_float = [float(i) for i in temps]
+
+    if temps_float:
+        if calc == "Max":
+            return max(temps_float)
+        elif calc == "Avg":
+            return sum(temps_float) / len(temps_float)
+    return 0
+
+def benchmark_calculate_temp(repeat=1000):
+    """Compare the CPU and GPU temperature calculation with nested loops and with the sensor index."""
+
+    print("CPU (8 sensors, max) and GPU (2 sensors, avg) temperature calculation")
+    for count in (10, 100, 1000):
+        sensors = [Sensor("/hardware/%d/temperature/%d" % (index // 10, index % 10), 30 + index % 50)
+                   for index in range(count)]
+        cpu_ids = [sensor.Identifier for sensor in sensors[:8]]
+        gpu_ids = [sensor.Identifier for sensor in sensors[-2:]]
+
+        nested = timed(lambda: (calculate_temp_nested(sensors, cpu_ids, "Max"),
+                                calculate_temp_nested(sensors, gpu_ids, "Avg")), repeat)
+
+        def indexed():
+            sensor_values = {sensor.Identifier: sensor.Value for sensor in sensors}
+            return (telemetry.aggregate_temperature(sensor_values, cpu_ids, "Max"),
+                    telemetry.aggregate_temperature(sensor_values, gpu_ids, "Avg"))
+
+        print("  %4d sensors, nested loops: %8.1f us, index: %8.1f us" %
+              (count, nested * 1e6, timed(indexed, repeat) * 1e6))
+
+
+def benchmark_history(repeat=100000):
+    """Measure appending a sample to the history and the statistics of a window of samples."""
+
+    rpm = [1200, 1100, None, 900, 1000, 1300]
+    voltage = [7.5, 7.0, None, 6.5, 7.0, 8.0]
+
+    print("History (%d samples)" % history.DEFAULT_CAPACITY)
+    for use_numpy in (True, False):
+        if use_numpy and history.numpy is None:
+            continue
+        samples = history.TelemetryHistory(use_numpy=use_numpy)
+        append = timed(lambda: samples.append(time.monotonic(), 45.0, 60.0, rpm, voltage), repeat)
+        statistics = timed(lambda: samples.statistics("rpm1", 3000), 100)
+        print("  %-6s append: %6.2f us, statistics of 3000 samples: %8.1f us" %
+              ("numpy" if use_numpy else "array", append * 1e6, statistics * 1e6))
+
+def benchmark_data_log(repeat=100000):
+    """Measure appending samples to the on-disk log and querying one hour out of the log."""
+
+    rpm = [1200, 1100, None, 900, 1000, 1300]
+    voltage = [7.5, 7.0, None, 6.5, 7.0, 8.0]
+
+    with tempfile.TemporaryDirectory() as directory:
+        log = datalog.DataLog(directory)
+
+        start_cpu = time.process_time()
+        append = timed(lambda: log.append(45.0, 60.0, rpm, voltage) and log.flush(), repeat)
+        cpu = (time.process_time() - start_cpu) / repeat
+        log.close()
+
+        # Query the middle hour of a log of one day at 100 ms sampling, with the sparse index and by scanning
+        log = datalog.DataLog(directory)
+        first = time.time()
+        records = bytearray()
+        for index in range(24 * 36000):
+            records += datalog.RECORD.pack(first + index * 0.1, 45.0, 60.0, *rpm[:2], 0, *rpm[3:], *voltage[:2], 0,
+                                          *voltage[3:])
+
+        # Written as one batch, with timestamps 100 ms apart
+        with log.write_lock:
+            log._write(records)
+        log.close()
+
+        start, end = first + 12 * 3600, first + 13 * 3600
+        log = datalog.DataLog(directory)
+        query = timed(lambda: log.query(start, end), 10)
+
+        def scan():
+            samples = []
+            for path, _, _ in datalog.list_segments(directory):
+                segment = datalog.Segment.open(path)
+                samples.extend(record for record in segment.records(0, segment.count) if start <= record[0] <= end)
+                segment.close()
+            return samples
+
+        scanned = timed(scan, 2)
+        print("Data log (%d bytes per sample, batches of %d)" % (datalog.RECORD.size, datalog.BATCH_RECORDS))
+        print("  append: %5.2f us (%.2f us CPU), %.3f %% CPU at 100 ms sampling" %
+              (append * 1e6, cpu * 1e6, cpu / 0.1 * 100))
+        print("  query 1 hour of 24 hours: sparse index %7.1f ms, full scan %7.1f ms, %d samples" %
+              (query * 1000, scanned * 1000, len(log.query(start, end))))
+        log.close()
+
+def benchmark_rollups(repeat=100000):
+    """Measure adding a sample to the rollups, and querying 30 days of rollups."""
+
+    rpm = [1200, 1100, None, 900, 1000, 1300]
+    voltage = [7.5, 7.0, None, 6.5, 7.0, 8.0]
+
+    # 30 days of samples every 500 ms
+    rollups = rollup.Rollups()
+    first = time.time() - 30 * 86400
+    for index in range(30 * 86400 * 2):
+        rollups.append(first + index * 0.5, 45.0, 60.0, rpm, voltage)
+
+    now = first + 30 * 86400
+    append = timed(lambda: rollups.append(now, 45.0, 60.0, rpm, voltage), repeat)
+
+    print("Rollups (%s s)" % ", ".join(str(resolution) for resolution, capacity in rollup.RESOLUTIONS))
+    print("  append: %5.2f us" % (append * 1e6))
+    for span, points in ((3600, 300), (86400, 500), (30 * 86400, 500)):
+        resolution, buckets = rollups.query("rpm1", now - span, now, points)
+        query = timed(lambda: rollups.query("rpm1", now - span, now, points), 100)
+        print("  query %7d s, %d points: %6.1f us, %d buckets of %d s" %
+              (span, points, query * 1e6, len(buckets), resolution))
+
+def create_hwmon_tree(root, devices, sensors):
+    """Create a directory tree like /sys/class/hwmon, with "sensors" temperature inputs per device."""
+
+    for device in range(devices):
+        path = os.path.join(root, "hwmon%d" % device)
+        os.mkdir(path)
+        with open(os.path.join(path, "name"), "w") as file:
+            file.write("chip%d\n" % device)
+        for index in range(1, sensors + 1):
+            with open(os.path.join(path, "temp%d_input" % index), "w") as file:
+                file.write("%d\n" % (30000 + device * 100 + index))
+            with open(os.path.join(path, "temp%d_label" % index), "w") as file:
+                file.write("Core %d\n" % index)
+
+def read_hwmon_by_path(paths):
+    """Read temperature inputs by opening each file, for comparison."""
+
+    values = {}
+    for identifier, path in paths:
+        with open(path) as file:
+            values[identifier] = int(file.read()) / 1000
+    return values
+
+def benchmark_linux_hwmon(repeat=1000):
+    """Compare reading hwmon temperature inputs with pread() on open files and by opening each file."""
+
+    print("Linux hwmon temperature inputs")
+    with tempfile.TemporaryDirectory() as root:
+        create_hwmon_tree(root, 50, 8)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            hwmon = linuxhwmon.SysfsHwmon(root)
+        paths = [(sensor.identifier, os.path.join(root, "hwmon%d" % device, "temp%d_input" % index))
+                 for device in range(50) for index, sensor in enumerate(hwmon.sensors[device * 8:device * 8 + 8], 1)]
+
+        pread = timed(hwmon.read, repeat)
+        by_path = timed(lambda: read_hwmon_by_path(paths), repeat // 10)
+        print("  %d sensors, pread: %7.1f us, open and read: %7.1f us" % (len(hwmon.sensors), pread * 1e6,
+                                                                         by_path * 1e6))
+        hwmon.close()
+
+    if os.path.isdir(linuxhwmon.HWMON_ROOT):
+        with contextlib.redirect_stdout(io.StringIO()):
+            hwmon = linuxhwmon.SysfsHwmon()
+        print("  %d sensors in %s, pread: %7.1f us" % (len(hwmon.sensors), linuxhwmon.HWMON_ROOT,
+                                                       timed(hwmon.read, repeat) * 1e6))
+        hwmon.close()
+
+def benchmark_wmi(repeat=100):
+    """Compare reading the OpenHardwareMonitor temperatures with WMI objects and with the values query (Windows)."""
+
+    if openhwmon.wmi is None:
+        return
+
+    source = openhwmon.WmiSource()
+    source.open()
+    source.discover()
+    selection = [sensor.identifier for sensor in source.metadata()[1][:2]]
+
+    def read_objects():
+        sensors = source.hwmon.Sensor(["Name", "Parent", "Value", "Identifier"], SensorType="Temperature")
+        return {sensor.Identifier: float(sensor.Value) for sensor in sensors}
+
+    print("OpenHardwareMonitor temperatures (%d sensors)" % len(source.metadata()[1]))
+    print("  WMI objects (Name, Parent, Value, Identifier): %7.2f ms" % (timed(read_objects, repeat) * 1000))
+    print("  values query, all sensors:                    %7.2f ms" % (timed(source.read_batch, repeat) * 1000))
+    print("  values query, %d selected sensors:             %7.2f ms" %
+          (len(selection), timed(lambda: source.read_batch(selection), repeat) * 1000))
+    source.close()
+
+def populate_tree_nested(hardwares, temperature_sensors, values, treeWidget):
+    """Previous implementation of the tree construction in openhwmon.populate_tree(), for comparison."""
+
+    def get_hardware_name(id, hardwares):
+        for hardware in hardwares:
+            if hardware.identifier == id:
+                return hardware.name
+
+    hardware_nodes = {}
+    for hardware in hardwares:
+        if hardware.parent == "":
+            hardware_nodes[hardware.identifier] = [hardware.identifier]
+    for hardware in hardwares:
+        if hardware.parent != "":
+            hardware_nodes[hardware.parent].append(hardware.identifier)
+
+    for key, nodelist in hardware_nodes.items():
+        item_list = []
+        for index, node in enumerate(nodelist):
+            parent = treeWidget if index == 0 else item_list[index-1]
+            item = QtWidgets.QTreeWidgetItem(parent)
+            item.setText(0, get_hardware_name(nodelist[index], hardwares))
+            item.setText(1, nodelist[index])
+            item.setFlags(QtCore.Qt.ItemIsEnabled)
+            item_list.append(item)
+
+            for sensor in temperature_sensors:
+                if sensor.parent == nodelist[index]:
+                    item = QtWidgets.QTreeWidgetItem(item_list[-1])
+                    item.setText(0, sensor.name)
+                    item.setText(1, sensor.identifier)
+                    item.setText(2, str(values.get(sensor.identifier)))
+                    item.setForeground(0, QtGui.QBrush(QtCore.Qt.blue))
+                    item.setForeground(2, QtGui.QBrush(QtCore.Qt.blue))
+
+def benchmark_populate_tree(repeat=5):
+    """Compare building the "Sensor Config" tree with the previous nested loops and with the indexes."""
+
+    application = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+    # 50 hardware nodes (10 top nodes with 4 child nodes each) and 2000 sensors, 40 per node
+    hardwares = []
+    for top in range(10):
+        hardwares.append(sensors.HardwareInfo("/hardware/%d" % top, "Hardware %d" % top))
+        hardwares.extend(sensors.HardwareInfo("/hardware/%d/%d" % (top, child), "Hardware %d.%d" % (top, child),
+                                              "/hardware/%d" % top) for child in range(4))
+    temperature_sensors = [sensors.SensorInfo("%s/temperature/%d" % (hardware.identifier, index),
+                                              "Temperature %d" % index, hardware.identifier)
+                           for hardware in hardwares for index in range(40)]
+    values = {sensor.identifier: 40.0 for sensor in temperature_sensors}
+
+    treeWidget = QtWidgets.QTreeWidget()
+    treeWidget.setColumnCount(3)
+    treeWidget.show()
+
+    def build(populate):
+        treeWidget.clear()
+        populate()
+        application.processEvents()
+
+    nested = timed(lambda: build(lambda: populate_tree_nested(hardwares, temperature_sensors, values, treeWidget)),
+                   repeat)
+    indexed = timed(lambda: build(lambda: openhwmon.fill_tree(treeWidget, hardwares, temperature_sensors, values)),
+                    repeat)
+
+    print("Sensor Config tree (%d hardware nodes, %d sensors)" % (len(hardwares), len(temperature_sensors)))
+    print("  nested loops, items added one by one: %7.1f ms" % (nested * 1000))
+    print("  indexes, items added in bulk:         %7.1f ms" % (indexed * 1000))
+
+
+if __name__ == "__main__":
+    benchmark_telemetry()
+    benchmark_command_latency()
+    benchmark_set_all_fans()
+    benchmark_voltage_encoding()
+    benchmark_calculate_temp()
+    benchmark_history()
+    benchmark_data_log()
+    benchmark_rollups()
+    benchmark_linux_hwmon()
+    benchmark_wmi()
+    benchmark_populate_tree()
@@ -0,0 +1,88 @@
+"""
+    control.py
+    ----------
+    Implements the automatic fan control: fan speed curves and the configuration used by the polling thread.
+    The configuration is created in the UI when a setting is edited and replaced as a whole in the polling thread,
+    so the fan speeds are calculated without accessing any widgets.
+"""
+
+
+class FanCurve:
+    """Fan speed (percent) as a function of temperature, defined by three points.
+
+    The speed is constant up to "start_temp", then increases linearly to "intermediate_speed" at "intermediate_temp"
+    and to "max_speed" at "max_temp", and is constant above "max_temp".
+    """
+
+    __slots__ = ("min_speed", "start_temp", "intermediate_speed", "intermediate_temp", "max_speed", "max_temp",
+                 "use_cpu")
+
+    def __init__(self, min_speed, start_temp, intermediate_speed, intermediate_temp, max_speed, max_temp, use_cpu):
+        """Constructor for the fan curve, "use_cpu" selects the CPU (True) or GPU (False) temperature."""
+
+        self.min_speed = min_speed
+        self.start_temp = start_temp
+        self.intermediate_speed = intermediate_speed
+        self.intermediate_temp = intermediate_temp
+        self.max_speed = max_speed
+        self.max_temp = max_temp
+        self.use_cpu = use_cpu
+
+    def speed(self, temperature):
+        """Return the fan speed (percent, not rounded) for a temperature."""
+
+        # Set fan to minimum fan speed (constant value)
+        if temperature <= self.start_temp:
+            return self.min_speed
+
+        # Linear equation, y = k*x + m with k = (y2 - y1) / (x2 - x1)
+        # From "Start increase speed at" to "Intermediate fan speed at" (temperature on x-axis)
+        if temperature <= self.intermediate_temp:
+            k = (self.intermediate_speed - self.min_speed) / (self.intermediate_temp - self.start_temp)
+            return k * temperature + (self.min_speed - k * self.start_temp)
+
+        # From "Intermediate fan speed at" to "Maximum fan speed at" (temperature on x-axis)
+        if temperature <= self.max_temp:
+            k = (self.max_speed - self.intermediate_speed) / (self.max_temp - self.intermediate_temp)
+            return k * temperature + (self.intermediate_speed - k * self.intermediate_temp)
+
+        # Set fan to maximum fan speed (constant value)
+        return self.max_speed
+
+
+class ControlConfig:
+    """Fan control settings from the UI, not modified after creation.
+
+    automatic       True for automatic fan control, False for manual control with the sliders
+    curves          Dictionary {fan: FanCurve} for fans 1 - 6
+    simulated_temps Tuple (CPU temperature, GPU temperature) used instead of the polled temperatures, None if
+                    temperatures are not simulated
+    """
+
+    def __init__(self, automatic, curves, simulated_temps=None):
+        """Constructor for the fan control settings."""
+
+        self.automatic = automatic
+        self.curves = curves
+        self.simulated_temps = simulated_temps
+
+    def breakpoints(self, use_cpu):
+        """Return the temperatures where a fan curve changes slope, for the fans using the CPU (True) or GPU (False)
+        temperature. No breakpoints are returned in manual mode."""
+
+        if not self.automatic:
+            return []
+        return sorted({temperature for curve in self.curves.values() if curve.use_cpu == use_cpu
+                       for temperature in (curve.start_temp, curve.intermediate_temp, curve.max_temp)})
+
+    def fan_speeds(self, cpu_temp, gpu_temp):
+        """Return the fan speeds (whole percent) for the temperatures, as a dictionary {fan: speed}.
+
+        Simulated temperatures replace "cpu_temp" and "gpu_temp".
+        """
+
+        if self.simulated_temps is not None:
+            cpu_temp, gpu_temp = self.simulated_temps
+
+        return {fan: round(curve.speed(cpu_temp if curve.use_cpu else gpu_temp))
+                for fan, curve in self.curves.items()}
@@ -0,0 +1,407 @@
+"""
+    datalog.py
+    ----------
+    Implements an append-only on-disk log of the polled values, kept across restarts.
+
+    Samples are fixed size records in segment files, written through a memory map in batches.
+    A new segment is started when the current one is full or older than a maximum age, and the oldest
+    segments are deleted when the log grows beyond a maximum size.
+    Segment file names start with a sequence number, so segments are kept in the order they were written
+    even when the clock has been set back.
+    Each segment holds a sparse index of the timestamps of every INDEX_INTERVAL-th record,
+    so a range query finds its first record with a binary search instead of reading all records.
+
+    Segment file layout (little-endian):
+        - Header (HEADER_SIZE bytes): magic, version, record size, capacity, record count, first timestamp
+        - Sparse index: capacity / INDEX_INTERVAL entries (timestamp, record number)
+        - Records: capacity records of RECORD (timestamp, CPU and GPU temperature, rpm and voltage of fans 1 - 6)
+"""
+
+import errno
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+MAGIC = b"GRIDLOG1"
+VERSION = 1
+
+# Header, padded to HEADER_SIZE bytes
+HEADER = struct.Struct("<8sHHIQd")
+HEADER_SIZE = 64
+
+# Record, "timestamp" is time.time() (s), missing values (e.g. no response from the Grid) are stored as NaN
+# Same columns as history.COLUMNS, 64 bytes per record
+RECORD = struct.Struct("<d14f")
+
+# Sparse index entry (timestamp, record number), one for every INDEX_INTERVAL records
+INDEX_ENTRY = struct.Struct("<dQ")
+INDEX_INTERVAL = 256
+
+# Records per segment (16 MB of records), and maximum time (s) covered by a segment
+SEGMENT_RECORDS = 262144
+SEGMENT_MAX_AGE = 24 * 3600
+
+# Maximum total size (bytes) of the segments, the oldest segments are deleted above that
+MAX_SIZE = 1024 * 1024 * 1024
+
+# Records are written to the segment when BATCH_RECORDS are buffered, or FLUSH_INTERVAL (s) after the last write
+BATCH_RECORDS = 64
+FLUSH_INTERVAL = 5.0
+
+SEGMENT_PREFIX = "telemetry-"
+SEGMENT_SUFFIX = ".seg"
+
+
+def segment_name(sequence, first_timestamp):
+    """Return the file name of a segment, from its sequence number and the timestamp of its first record
+    (names sort in sequence order)."""
+
+    return "%s%010d-%013d%s" % (SEGMENT_PREFIX, sequence, int(first_timestamp * 1000), SEGMENT_SUFFIX)
+
+def parse_segment_name(name):
+    """Return (sequence number, first timestamp rounded down to ms) of a segment file name, None if not a segment."""
+
+    if not name.startswith(SEGMENT_PREFIX) or not name.endswith(SEGMENT_SUFFIX):
+        return None
+
+    sequence, _, milliseconds = name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)].partition("-")
+    if not sequence.isdigit() or not milliseconds.isdigit():
+        return None
+    return int(sequence), int(milliseconds) / 1000
+
+def list_segments(directory):
+    """Return the segments in a directory as a list of (path, sequence number, first timestamp), oldest first."""
+
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+
+    segments = []
+    for name in names:
+        parsed = parse_segment_name(name)
+        if parsed is not None:
+            segments.append((os.path.join(directory, name), *parsed))
+    return sorted(segments, key=lambda segment: segment[1])
+
+
+class Segment:
+    """One segment file, mapped in memory."""
+
+    def __init__(self, file, memory, capacity, count, first_timestamp):
+        """Constructor for a segment, use create() or open()."""
+
+        self.file = file
+        self.memory = memory
+        self.capacity = capacity
+        self.count = count
+        self.first_timestamp = first_timestamp
+
+        self.index_offset = HEADER_SIZE
+        self.records_offset = HEADER_SIZE + (capacity // INDEX_INTERVAL) * INDEX_ENTRY.size
+
+    @staticmethod
+    def size(capacity):
+        """Return the file size (bytes) of a segment holding "capacity" records."""
+
+        return HEADER_SIZE + (capacity // INDEX_INTERVAL) * INDEX_ENTRY.size + capacity * RECORD.size
+
+    @classmethod
+    def create(cls, path, capacity, first_timestamp):
+        """Create a segment file for writing, with space for "capacity" records (a multiple of INDEX_INTERVAL).
+
+        Raises:
+            - FileExistsError if the file exists, an existing segment is never overwritten
+        """
+
+        file = open(path, "x+b")
+        try:
+            size = cls.size(capacity)
+            file.truncate(size)
+
+            # Allocate the disk space now where possible, so a full disk is an error here and not when writing
+            if hasattr(os, "posix_fallocate"):
+                try:
+                    os.posix_fallocate(file.fileno(), 0, size)
+                except OSError as e:
+                    if e.errno not in (errno.EINVAL, errno.EOPNOTSUPP):
+                        raise
+
+            memory = mmap.mmap(file.fileno(), size)
+        except OSError:
+            file.close()
+            raise
+
+        segment = cls(file, memory, capacity, 0, first_timestamp)
+        segment.write_header()
+        return segment
+
+    @classmethod
+    def open(cls, path):
+        """Open a segment file for reading.
+
+        Returns:
+            - The segment
+            - None if the file is not a valid segment
+        """
+
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_size < HEADER_SIZE:
+                return None
+            memory = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, record_size, capacity, count, first_timestamp = HEADER.unpack_from(memory, 0)
+        segment = cls(None, memory, capacity, count, first_timestamp)
+
+        if (magic != MAGIC or version != VERSION or record_size != RECORD.size or
+                len(memory) < segment.records_offset + count * RECORD.size):
+            memory.close()
+            return None
+        return segment
+
+    def close(self):
+        """Unmap the segment. A segment opened for writing is truncated to the records written."""
+
+        self.memory.close()
+        if self.file is not None:
+            self.file.truncate(self.records_offset + self.count * RECORD.size)
+            self.file.close()
+
+    def write_header(self):
+        """Write the header, with the current record count."""
+
+        HEADER.pack_into(self.memory, 0, MAGIC, VERSION, RECORD.size, self.capacity, self.count, self.first_timestamp)
+
+    def write(self, records):
+        """Append packed records (bytes, a multiple of RECORD.size), at most the free space of the segment."""
+
+        count = len(records) // RECORD.size
+        offset = self.records_offset + self.count * RECORD.size
+        self.memory[offset:offset + len(records)] = records
+
+        # Index entries of the records at a multiple of INDEX_INTERVAL
+        first = -(-self.count // INDEX_INTERVAL) * INDEX_INTERVAL
+        for number in range(first, self.count + count, INDEX_INTERVAL):
+            timestamp, = struct.unpack_from("<d", records, (number - self.count) * RECORD.size)
+            INDEX_ENTRY.pack_into(self.memory, self.index_offset + (number // INDEX_INTERVAL) * INDEX_ENTRY.size,
+                                  timestamp, number)
+
+        # The count is updated last, so readers never see records not written yet
+        self.count += count
+        self.write_header()
+
+    def last_timestamp(self):
+        """Return the timestamp of the last record, None if the segment is empty."""
+
+        return self.timestamp(self.count - 1) if self.count else None
+
+    def timestamp(self, number):
+        """Return the timestamp of a record."""
+
+        return struct.unpack_from("<d", self.memory, self.records_offset + number * RECORD.size)[0]
+
+    def find(self, timestamp, after=False):
+        """Return the number of the first record at or after "timestamp" (after "timestamp" if "after" is True),
+        "count" if there is none."""
+
+        def before(value):
+            return value <= timestamp if after else value < timestamp
+
+        # Binary search in the sparse index, for the first indexed record not before "timestamp"
+        low, high = 0, -(-self.count // INDEX_INTERVAL)
+        while low < high:
+            middle = (low + high) // 2
+            indexed, number = INDEX_ENTRY.unpack_from(self.memory, self.index_offset + middle * INDEX_ENTRY.size)
+            if before(indexed):
+                low = middle + 1
+            else:
+                high = middle
+
+        # Binary search in the records since the previous index entry
+        low, high = max(0, (low - 1) * INDEX_INTERVAL), min(self.count, low * INDEX_INTERVAL)
+        while low < high:
+            middle = (low + high) // 2
+            if before(self.timestamp(middle)):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def records(self, start, stop):
+        """Return records "start" to "stop" (not included) as tuples."""
+
+        offset = self.records_offset
+        return list(RECORD.iter_unpack(self.memory[offset + start * RECORD.size:offset + stop * RECORD.size]))
+
+
+class DataLog:
+    """Append-only log of samples in a directory of segment files.
+
+    Samples are appended by the polling thread and buffered, append() only packs the sample.
+    The buffered samples are written in batches by flush(), so the caller can write them without holding
+    its own locks. Timestamps are kept in increasing order, a sample taken after the clock has been set back
+    gets the timestamp of the previous sample.
+    """
+
+    def __init__(self, directory, segment_records=SEGMENT_RECORDS, segment_max_age=SEGMENT_MAX_AGE,
+                 max_size=MAX_SIZE):
+        """Constructor for the log, the directory is created if needed. A new segment is started for each log."""
+
+        os.makedirs(directory, exist_ok=True)
+
+        self.directory = directory
+        self.segment_records = -(-segment_records // INDEX_INTERVAL) * INDEX_INTERVAL
+        self.segment_max_age = segment_max_age
+        self.max_size = max_size
+
+        # Segment being written, created at the first write, and the sequence number of the next segment
+        self.segment = None
+        self.sequence = self.next_sequence()
+
+        # Packed records not written yet, and time (time.monotonic()) the buffer was last written
+        self.buffer = bytearray()
+        self.last_write = time.monotonic()
+        self.last_timestamp = 0.0
+
+        # "lock" protects the buffer, "write_lock" the segments, the buffer is never locked during disk I/O
+        # Samples are appended by the polling thread, queries come from the UI
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+
+    def next_sequence(self):
+        """Return the sequence number following the last segment in the directory."""
+
+        segments = list_segments(self.directory)
+        return segments[-1][1] + 1 if segments else 0
+
+    def append(self, cpu_temp, gpu_temp, fans_rpm, fans_voltage):
+        """Buffer a sample taken now, "fans_rpm" and "fans_voltage" are lists for fans 1 - 6, None for missing values.
+
+        Returns:
+            - True if a batch of samples is due to be written with flush()
+        """
+
+        timestamp = time.time()
+
+        with self.lock:
+            timestamp = max(timestamp, self.last_timestamp)
+            self.last_timestamp = timestamp
+
+            self.buffer += RECORD.pack(timestamp, cpu_temp, gpu_temp,
+                                       *[math.nan if value is None else value for value in fans_rpm],
+                                       *[math.nan if value is None else value for value in fans_voltage])
+
+            return (len(self.buffer) >= BATCH_RECORDS * RECORD.size or
+                    time.monotonic() - self.last_write >= FLUSH_INTERVAL)
+
+    def flush(self):
+        """Write the buffered samples to the segment."""
+
+        # The buffer is taken with the write lock held, so batches are written in the order they were buffered
+        with self.write_lock:
+            with self.lock:
+                records = self.buffer
+                self.buffer = bytearray()
+                self.last_write = time.monotonic()
+
+            self._write(records)
+
+    def close(self):
+        """Write the buffered samples and close the segment."""
+
+        self.flush()
+
+        with self.write_lock:
+            if self.segment is not None:
+                self.segment.close()
+                self.segment = None
+
+    def _write(self, records):
+        """Write packed records, starting new segments as needed. The write lock must be held.
+
+        Logging errors (e.g. a full disk) do not stop polling, the samples are dropped and
+        a new segment is started at the next write.
+        """
+
+        try:
+            while records:
+                first_timestamp, = struct.unpack_from("<d", records, 0)
+
+                # Start a new segment when the current one is full or too old
+                if self.segment is not None and (self.segment.count == self.segment.capacity or
+                                                 first_timestamp - self.segment.first_timestamp >=
+                                                 self.segment_max_age):
+                    self.segment.close()
+                    self.segment = None
+
+                if self.segment is None:
+                    # Segments written by another instance in the meantime are never overwritten
+                    self.sequence = max(self.sequence, self.next_sequence())
+                    path = os.path.join(self.directory, segment_name(self.sequence, first_timestamp))
+                    self.segment = Segment.create(path, self.segment_records, first_timestamp)
+                    self.sequence += 1
+                    self.remove_old_segments()
+
+                length = min(len(records), (self.segment.capacity - self.segment.count) * RECORD.size)
+                self.segment.write(records[:length])
+                records = records[length:]
+
+        except OSError as e:
+            print("Could not write the data log: " + str(e))
+            if self.segment is not None:
+                try:
+                    self.segment.close()
+                except (OSError, ValueError):
+                    pass
+                self.segment = None
+
+    def remove_old_segments(self):
+        """Delete the oldest segments while the total size is above "max_size", the current segment is kept."""
+
+        paths = [path for path, _, _ in list_segments(self.directory)]
+        sizes = [os.path.getsize(path) for path in paths]
+        total = sum(sizes)
+
+        for path, size in zip(paths[:-1], sizes):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError as e:
+                print("Could not remove " + path + ": " + str(e))
+                break
+
+    def query(self, start, end):
+        """Return the samples taken from "start" to "end" (time.time(), both included), in the order written
+        (oldest first, unless the clock has been set back between two segments).
+
+        Returns:
+            - A list of tuples (timestamp, CPU temperature, GPU temperature, rpm of fans 1 - 6, voltage of fans 1 - 6),
+              NaN for missing values
+        """
+
+        # Buffered samples are written first, so they are included
+        self.flush()
+
+        samples = []
+        for path, _, first_timestamp in list_segments(self.directory):
+            # Segments starting after the range are skipped from the file name (timestamp rounded down to ms),
+            # the timestamps of the records in a segment are increasing
+            if first_timestamp > end:
+                continue
+
+            segment = Segment.open(path)
+            if segment is None:
+                continue
+            try:
+                last_timestamp = segment.last_timestamp()
+                if last_timestamp is not None and last_timestamp >= start:
+                    samples.extend(segment.records(segment.find(start), segment.find(end, after=True)))
+            finally:
+                segment.close()
+
+        return samples
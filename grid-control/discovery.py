@@ -0,0 +1,93 @@
+"""
+    discovery.py
+    ------------
+    Implements automatic discovery of the serial port connected to the Grid.
+    All serial ports are probed concurrently by sending the "initialize" request (0xC0), the Grid answers 0x21.
+    USB ports are identified by VID:PID and serial number, so a known Grid can be found again without probing,
+    even if the port name has changed (e.g. "COM3" to "COM4").
+"""
+
+import concurrent.futures
+import time
+
+import serial
+from serial.tools import list_ports
+
+import protocol
+import transport
+
+# Maximum time (s) for probing all serial ports
+PROBE_TIMEOUT = 0.5
+
+
+def usb_id(port_info):
+    """Return "VID:PID:serial number" for a USB serial port, None for other ports."""
+
+    if port_info.vid is None:
+        return None
+    return "%04X:%04X:%s" % (port_info.vid, port_info.pid, port_info.serial_number or "")
+
+def get_usb_id(port):
+    """Return the USB id of a serial port (e.g. "COM3"), None if not found or not a USB port."""
+
+    for port_info in list_ports.comports():
+        if port_info.device == port:
+            return usb_id(port_info)
+    return None
+
+def find_port(grid_usb_id):
+    """Return the serial port with the USB id, None if not found."""
+
+    if grid_usb_id:
+        for port_info in list_ports.comports():
+            if usb_id(port_info) == grid_usb_id:
+                return port_info.device
+    return None
+
+def probe_port(port, deadline):
+    """Send the "initialize" request on a serial port.
+
+    Returns:
+        - True if a Grid responded before "deadline" (time.monotonic())
+        - False otherwise, including if the port could not be opened
+    """
+
+    try:
+        with serial.Serial(port, baudrate=4800, bytesize=serial.EIGHTBITS, stopbits=serial.STOPBITS_ONE,
+                           parity=serial.PARITY_NONE, timeout=0, write_timeout=0.1) as ser:
+            ser.reset_input_buffer()
+            ser.write(serial.to_bytes([0xC0]))
+            response = transport.read_bytes(ser, 1, deadline)
+            return response == bytes([protocol.RESPONSE_INIT])
+
+    except (serial.SerialException, OSError, ValueError):
+        return False
+
+def discover(ports, timeout=PROBE_TIMEOUT):
+    """Probe all serial ports concurrently.
+
+    Returns:
+        - The first serial port where a Grid responded within "timeout" (s)
+        - None if no Grid was found
+    """
+
+    if not ports:
+        return None
+
+    deadline = time.monotonic() + timeout
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(ports))
+
+    try:
+        futures = {executor.submit(probe_port, port, deadline): port for port in ports}
+        for future in concurrent.futures.as_completed(futures, timeout=timeout + 0.1):
+            if future.result():
+                return futures[future]
+
+    except concurrent.futures.TimeoutError:
+        pass
+
+    finally:
+        # Probes still running end at the deadline, no need to wait for them
+        executor.shutdown(wait=False)
+
+    return None
@@ -0,0 +1,203 @@
+"""
+    emulator.py
+    -----------
+    Implements a virtual Grid+ V2 on a Linux pseudo-terminal, used for benchmarks and testing without a Grid.
+    The emulator answers "initialize", "set fan voltage", "read fan rpm" and "read fan voltage" requests.
+    Fan rpm follows the configured voltage with inertia, and the response latency, jitter and byte drop rate
+    can be configured.
+
+    Run "python emulator.py" to start an emulator, the serial port to use is printed at startup.
+"""
+
+import argparse
+import math
+import os
+import random
+import select
+import threading
+import time
+import tty
+
+# Request lengths (bytes), indexed by the first byte of the request
+REQUEST_LENGTHS = {0xC0: 1,  # Initialize
+                   0x44: 7,  # Set fan voltage
+                   0x8A: 2,  # Read fan rpm
+                   0x84: 2}  # Read fan voltage
+
+
+class EmulatedFan:
+    """A fan whose rpm follows the voltage as a first order system."""
+
+    def __init__(self, max_rpm, inertia):
+        # Rpm at 12V and time constant (s) of the rpm response
+        self.max_rpm = max_rpm
+        self.inertia = inertia
+
+        self.voltage = 0.0
+        self.rpm = 0.0
+        self.updated = time.monotonic()
+
+    def set_voltage(self, voltage):
+        self.update()
+        self.voltage = voltage
+
+    def update(self):
+        """Move the rpm towards the target rpm for the current voltage."""
+
+        now = time.monotonic()
+
+        # Fans are stopped below 4V
+        target = self.max_rpm * self.voltage / 12 if self.voltage >= 4 else 0.0
+
+        if self.inertia > 0:
+            self.rpm += (target - self.rpm) * (1 - math.exp(-(now - self.updated) / self.inertia))
+        else:
+            self.rpm = target
+        self.updated = now
+
+    def read_rpm(self):
+        self.update()
+        return int(round(self.rpm))
+
+
+class GridEmulator(threading.Thread):
+    """Thread emulating a Grid+ V2 on the slave side ("port") of a pseudo-terminal."""
+
+    def __init__(self, latency=0.005, jitter=0.0, drop_rate=0.0, baudrate=4800, max_rpm=1500, inertia=2.0,
+                 seed=None):
+        """Constructor for the emulator.
+
+        latency     Response delay (s) after a request has been received
+        jitter      Maximum additional random response delay (s)
+        drop_rate   Probability for each response byte to be lost
+        baudrate    Baud rate used to model the time on the wire
+        max_rpm     Fan rpm at 12V
+        inertia     Time constant (s) of the fan rpm response to a voltage change
+        """
+
+        super().__init__(daemon=True)
+
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.byte_time = 10 / baudrate
+        self.random = random.Random(seed)
+
+        self.fans = {fan: EmulatedFan(max_rpm, inertia) for fan in range(1, 7)}
+
+        # The Grid serial port is the slave side of the pseudo-terminal
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+        self.keep_running = False
+
+        # Number of requests answered and response bytes dropped
+        self.requests = 0
+        self.dropped = 0
+
+    def stop(self):
+        """Stop the emulator and close the pseudo-terminal."""
+
+        self.keep_running = False
+        self.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def respond(self, request):
+        """Return the response to a complete request."""
+
+        command = request[0]
+
+        if command == 0xC0:
+            return bytes([0x21])
+
+        fan = self.fans.get(request[1])
+        if fan is None:
+            return b""
+
+        if command == 0x44:
+            # Voltage as integer and decimal part, the decimal part is sent as two hex digits (e.g. 0x50 = .50)
+            fan.set_voltage(request[5] + int("%02x" % request[6]) / 100)
+            return bytes([0x01])
+
+        if command == 0x8A:
+            rpm = fan.read_rpm()
+            return bytes([0xC0, 0x00, 0x00, rpm >> 8 & 0xFF, rpm & 0xFF])
+
+        # Voltage as integer and decimal part, e.g. 0x0B 0x32 = 11.50 volt
+        integer = int(fan.voltage)
+        return bytes([0xC0, 0x00, 0x00, integer, int(round((fan.voltage - integer) * 100))])
+
+    def run(self):
+        """Main emulator loop, requests are handled one at a time in the order received.
+
+        The line is full duplex, the next request is received while a response is being sent.
+        """
+
+        self.keep_running = True
+        received = bytearray()
+
+        # Time when the last received request was completely on the wire, and when the line is free for sending
+        rx_clock = tx_clock = time.monotonic()
+
+        while self.keep_running:
+            readable, _, _ = select.select([self.master], [], [], 0.05)
+            if not readable:
+                continue
+
+            arrival = time.monotonic()
+            try:
+                received += os.read(self.master, 1024)
+            except OSError:
+                break
+
+            while received:
+                length = REQUEST_LENGTHS.get(received[0])
+
+                # Unknown data is discarded, one byte at a time
+                if length is None:
+                    del received[0]
+                    continue
+
+                if len(received) < length:
+                    break
+
+                request = bytes(received[:length])
+                del received[:length]
+
+                rx_clock = max(rx_clock, arrival) + length * self.byte_time
+                response = self.respond(request)
+                self.requests += 1
+
+                tx_clock = (max(tx_clock, rx_clock + self.latency + self.random.uniform(0, self.jitter)) +
+                            len(response) * self.byte_time)
+                time.sleep(max(0.0, tx_clock - time.monotonic()))
+
+                # Lose bytes at the configured drop rate
+                if self.drop_rate:
+                    kept = bytes(byte for byte in response if self.random.random() >= self.drop_rate)
+                    self.dropped += len(response) - len(kept)
+                    response = kept
+
+                os.write(self.master, response)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Virtual Grid+ V2 on a pseudo-terminal")
+    parser.add_argument("--latency", type=float, default=5, help="response latency (ms)")
+    parser.add_argument("--jitter", type=float, default=0, help="maximum additional random latency (ms)")
+    parser.add_argument("--drop-rate", type=float, default=0, help="probability for a response byte to be lost")
+    parser.add_argument("--inertia", type=float, default=2, help="time constant of the fan rpm response (s)")
+    args = parser.parse_args()
+
+    emulator = GridEmulator(latency=args.latency / 1000, jitter=args.jitter / 1000, drop_rate=args.drop_rate,
+                            inertia=args.inertia)
+    emulator.start()
+    print("Grid emulator running on " + emulator.port + ", press Ctrl+C to stop")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        emulator.stop()
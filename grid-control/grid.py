@@ -5,23 +5,90 @@
     e.g. "initalization", "set fan voltage", "read fan voltage", "read fan rpm".
 """
 
-import sys
-import time
+import math
 
 import serial
 from serial.tools import list_ports
 
-import helper
+import protocol
+import transport
+
+# NumPy is optional, used by calculate_voltages()
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Initial time (s) to wait for the Grid to respond to a request, adapted to the measured response time
+WAIT_GRID = transport.INITIAL_RTO
+
+# Fan id's supported by the Grid
+FANS = [0x01, 0x02, 0x03, 0x04, 0x05, 0x06]
+
+# Valid voltages and corresponding data (two bytes)
+SPEED_DATA = {0:    [0x00, 0x00],  # 0%     (Values below 4V is not supported by the Grid, fans will be stopped)
+              4.0:  [0x04, 0x00],  # 33.3%  (4.0V)
+              4.5:  [0x04, 0x50],  # 37.5%  (4.5V)
+              5.0:  [0x05, 0x00],  # 41.7%  (5V)
+              5.5:  [0x05, 0x50],  # 45.8%  (5.5V)
+              6.0:  [0x06, 0x00],  # 50.0%  (6V)
+              6.5:  [0x06, 0x50],  # 54.2%  (6.5V)
+              7.0:  [0x07, 0x00],  # 58.3%  (7V)
+              7.5:  [0x07, 0x50],  # 62.5%  (7.5V)
+              8.0:  [0x08, 0x00],  # 66.7%  (8V)
+              8.5:  [0x08, 0x50],  # 70.1%  (8.5V)
+              9.0:  [0x09, 0x00],  # 75.0%  (9.0V)
+              9.5:  [0x09, 0x50],  # 79.2%  (9.5V)
+              10.0: [0x0A, 0x00],  # 83.3%  (10.0V)
+              10.5: [0x0A, 0x50],  # 87.5%  (10.5V)
+              11.0: [0x0B, 0x00],  # 91.7%  (11.0V)
+              11.5: [0x0B, 0x50],  # 95.8%  (11.5V)
+              12.0: [0x0C, 0x00]}  # 100.0% (12.0V)
+
+FAN_DATA = {1: 0x01,  # Fan 1
+            2: 0x02,  # Fan 2
+            3: 0x03,  # Fan 3
+            4: 0x04,  # Fan 4
+            5: 0x05,  # Fan 5
+            6: 0x06}  # Fan 6
+
+# Lowest fan speed (percent) for each valid voltage, fan speeds below 33% will stop the fan
+VOLTAGE_STEPS = [(0, 0.0), (33, 4.0), (36, 4.5), (40, 5.0), (44, 5.5), (48, 6.0), (52, 6.5), (56, 7.0), (60, 7.5),
+                 (64, 8.0), (68, 8.5), (72, 9.0), (76, 9.5), (80, 10.0), (84, 10.5), (88, 11.0), (93, 11.5), (98, 12.0)]
+
+# Voltage for each fan speed in percent (0-100), built once at import
+VOLTAGE_TABLE = tuple(max(voltage for lowest, voltage in VOLTAGE_STEPS if lowest <= percent) for percent in range(101))
+VOLTAGE_ARRAY = numpy.array(VOLTAGE_TABLE) if numpy is not None else None
+
+# Ready-made "set fan voltage" requests, seven bytes:
+# 44 <fan id> C0 00 00 <voltage integer> <voltage decimal>
+#
+# Example configuring "7.5V" for fan "1":
+# 44 01 C0 00 00 07 50
+#
+# VOLTAGE_FRAMES[fan][voltage]
+VOLTAGE_FRAMES = {fan: {voltage: bytes([0x44, FAN_DATA[fan], 0xC0, 0x00, 0x00, data[0], data[1]])
+                        for voltage, data in SPEED_DATA.items()}
+                  for fan in FANS}
+
+# Expected response from the Grid for each "set fan voltage" request
+ACK_SET_FAN = protocol.RESPONSE_ACK
+
+
+class GridError(Exception):
+    """Communication with the Grid failed, e.g. the serial port was disconnected."""
 
-# Time (s) to wait until reading data from Grid after a request (s)
-WAIT_GRID = 0.04
 
 def get_serial_ports():
     """Returns a list of all serial ports found, e.g. 'COM1' in Windows"""
     return sorted([port.device for port in list_ports.comports()])
 
 def setup_serial(ser, port, lock):
-    """Setup all parameters for the serial communication"""
+    """Setup all parameters for the serial communication
+
+    Raises:
+        - GridError if the serial port cannot be configured
+    """
     try:
         with lock:
             ser.baudrate = 4800
@@ -32,29 +99,31 @@ def setup_serial(ser, port, lock):
             ser.timeout = 0.1  # Read timeout in seconds
             ser.write_timeout = 0.1  # Write timeout in seconds
     except Exception as e:
-        helper.show_error("Problem initializing serial port " + port + ".\n\n"
-                          "Exception:\n" + str(e) + "\n\n"
-                          "The application will now exit.")
-        sys.exit(0)
+        raise GridError("Problem initializing serial port " + port + ".\n\n"
+                        "Exception:\n" + str(e)) from e
 
 def open_serial(ser, lock):
-    """Open the serial port"""
+    """Open the serial port
+
+    Raises:
+        - GridError if the serial port cannot be opened
+    """
     try:
         with lock:
             ser.open()
     except Exception as e:
-        helper.show_error("Could not open serial port " + ser.port + ".\n\n"
-                          "Is another instance of Grid Control running?\n\n"
-                          "Exception:\n" + str(e) + "\n\n"
-                          "The application will now exit.")
-        sys.exit(0)
+        raise GridError("Could not open serial port " + str(ser.port) + ".\n\n"
+                        "Is another instance of Grid Control running?\n\n"
+                        "Exception:\n" + str(e)) from e
 
 def initialize_grid(ser, lock):
     """Initialize the Grid by sending "0xC0", expected response is "0x21"
 
     Returns:
         - True for successful initialization
-        - False otherwise
+
+    Raises:
+        - GridError if the Grid does not respond as expected, or the serial communication fails
     """
 
     try:
@@ -64,40 +133,27 @@ def initialize_grid(ser, lock):
             ser.reset_output_buffer()
 
             # Write data to serial port to initialize the Grid
-            bytes_written = ser.write(serial.to_bytes([0xC0]))
-
-            # Wait before checking response
-            time.sleep(WAIT_GRID)
-
             # Read response, one byte = 0x21 is expected for a successful initialization
-            response = ser.read(size=1)
+            response = transport.transaction(ser, serial.to_bytes([0xC0]), 1)
 
-            # Check if the Grid responded with any data
-            if response:
-                # Check for correct response (should be 0x21)
-                if response[0] == int("0x21", 16):
-                    print("Grid initialized")
-                    return True
+    except Exception as e:
+        raise GridError("Problem initializing the Grid unit.\n\n"
+                        "Exception:\n" + str(e)) from e
 
-                # Incorrect response received from the grid
-                else:
-                    helper.show_error("Problem initializing the Grid unit.\n\n"
-                                      "Response 0x21 expected, got " + hex(ord(response)) + ".\n\n"
-                                      "Please check serial port " + ser.port +".\n")
-                    return False
-
-            # In case no response (0 bytes) from the Grid
-            else:
-                helper.show_error("Problem initializing the Grid unit.\n\n"
-                                  "Response 0x21 expected, no response received.\n\n"
-                                   "Please check serial port " + ser.port +".\n")
-                return False
+    # In case no response (0 bytes) from the Grid
+    if not response:
+        raise GridError("Problem initializing the Grid unit.\n\n"
+                        "Response 0x21 expected, no response received.\n\n"
+                        "Please check serial port " + str(ser.port) + ".\n")
 
-    except Exception as e:
-            helper.show_error("Problem initializing the Grid unit.\n\n"
-                              "Exception:\n" + str(e) + "\n\n"
-                              "The application will now exit.")
-            sys.exit(0)
+    # Incorrect response received from the grid (should be 0x21)
+    if response[0] != protocol.RESPONSE_INIT:
+        raise GridError("Problem initializing the Grid unit.\n\n"
+                        "Response 0x21 expected, got " + hex(response[0]) + ".\n\n"
+                        "Please check serial port " + str(ser.port) + ".\n")
+
+    print("Grid initialized")
+    return True
 
 
 def set_fan(ser, fan, voltage, lock):
@@ -105,64 +161,82 @@ def set_fan(ser, fan, voltage, lock):
     Note:
         The Grid only supports voltages between 4.0V and 12.0V in 0.5V steps (e.g. 4.0, 7.5. 12.0)
         Configuring "0V" stops a fan.
+
+    Returns:
+        - True if the fan acknowledged the new voltage
+        - False otherwise
+
+    Raises:
+        - GridError if the serial communication fails
     """
 
-    # Valid voltages and corresponding data (two bytes)
-    speed_data = {0:    [0x00, 0x00],  # 0%     (Values below 4V is not supported by the Grid, fans will be stopped)
-                  4.0:  [0x04, 0x00],  # 33.3%  (4.0V)
-                  4.5:  [0x04, 0x50],  # 37.5%  (4.5V)
-                  5.0:  [0x05, 0x00],  # 41.7%  (5V)
-                  5.5:  [0x05, 0x50],  # 45.8%  (5.5V)
-                  6.0:  [0x06, 0x00],  # 50.0%  (6V)
-                  6.5:  [0x06, 0x50],  # 54.2%  (6.5V)
-                  7.0:  [0x07, 0x00],  # 58.3%  (7V)
-                  7.5:  [0x07, 0x50],  # 62.5%  (7.5V)
-                  8.0:  [0x08, 0x00],  # 66.7%  (8V)
-                  8.5:  [0x08, 0x50],  # 70.1%  (8.5V)
-                  9.0:  [0x09, 0x00],  # 75.0%  (9.0V)
-                  9.5:  [0x09, 0x50],  # 79.2%  (9.5V)
-                  10.0: [0x0A, 0x00],  # 83.3%  (10.0V)
-                  10.5: [0x0A, 0x50],  # 87.5%  (10.5V)
-                  11.0: [0x0B, 0x00],  # 91.7%  (11.0V)
-                  11.5: [0x0B, 0x50],  # 95.8%  (11.5V)
-                  12.0: [0x0C, 0x00]}  # 100.0% (12.0V)
-
-    fan_data = {1: 0x01,  # Fan 1
-                2: 0x02,  # Fan 2
-                3: 0x03,  # Fan 3
-                4: 0x04,  # Fan 4
-                5: 0x05,  # Fan 5
-                6: 0x06}  # Fan 6
-
-    # Define bytes to be sent to the Grid for configuring a specific fan's voltage
-    # Format is seven bytes:
-    # 44 <fan id> C0 00 00 <voltage integer> <voltage decimal>
-    #
-    # Example configuring "7.5V" for fan "1":
-    # 44 01 C0 00 00 07 50
-    serial_data = [0x44, fan_data[fan], 0xC0, 0x00, 0x00, speed_data[voltage][0], speed_data[voltage][1]]
+    # Ready-made seven byte request for configuring a specific fan's voltage
+    serial_data = VOLTAGE_FRAMES[fan][voltage]
 
-    try:
-        with lock:
-            bytes_written = ser.write(serial.to_bytes(serial_data))
-            time.sleep(WAIT_GRID)
+    with lock:
+        try:
+            # Expected response is one acknowledgement byte
+            parser = protocol.ResponseParser()
+            parser.expect_byte(ACK_SET_FAN)
+            parser.feed(transport.transaction(ser, serial_data, 1))
+        except Exception as e:
+            raise GridError("Could not set speed for fan " + str(fan) + ".\n\n"
+                            "Please check settings for serial port " + str(ser.port) + ".\n\n"
+                            "Exception:\n" + str(e)) from e
+
+    # Check that the fan responded with an acknowledgement
+    parser.finish()
+    if not parser.errors:
+        print("Fan " + str(fan) + " updated")
+        return True
+    else:
+        print("Error setting voltage for fan " + str(fan) + ": " + ", ".join(parser.errors))
+        return False
 
-            # TODO: Check reponse
-            # Expected response is one byte
-            response = ser.read(size=1)
-            print("Fan " + str(fan) + " updated")
-    except Exception as e:
-        helper.show_error("Could not set speed for fan " + str(fan) + ".\n\n"
-                          "Please check settings for serial port " + str(ser.port) + ".\n\n"
-                          "Exception:\n" + str(e) + "\n\n"
-                          "The application will now exit.")
-        sys.exit(0)
+def set_all_fans(ser, voltages, lock):
+    """Sets voltage of several fans in one transaction.
+
+    "voltages" is a dictionary with fan id as key and voltage as value, e.g. {1: 7.5, 2: 12.0}.
+    All requests are written at once, followed by one acknowledgement byte per fan.
+
+    Returns:
+        - True if all fans acknowledged the new voltage
+        - False otherwise
+
+    Raises:
+        - GridError if the serial communication fails
+    """
+
+    # Join the ready-made seven byte requests into one buffer
+    serial_data = b"".join([VOLTAGE_FRAMES[fan][voltage] for fan, voltage in voltages.items()])
+
+    with lock:
+        try:
+            # Expected response is one byte per fan
+            parser = protocol.ResponseParser()
+            parser.expect_byte(ACK_SET_FAN, count=len(voltages))
+            parser.feed(transport.transaction(ser, serial_data, len(voltages), requests=len(voltages)))
+        except Exception as e:
+            raise GridError("Could not set speed for fans " + ", ".join(str(fan) for fan in voltages) + ".\n\n"
+                            "Please check settings for serial port " + str(ser.port) + ".\n\n"
+                            "Exception:\n" + str(e)) from e
+
+    # Check that all fans responded with an acknowledgement
+    parser.finish()
+    if not parser.errors:
+        print("Fans " + ", ".join(str(fan) for fan in voltages) + " updated")
+        return True
+    else:
+        print("Error setting fan voltages: " + ", ".join(parser.errors))
+        return False
 
 def read_fan_rpm(ser, lock):
     """Reads the current rpm of each fan.
     Returns:
-        - If success: A list with rpm data for each fan
-        - If failure to read data: An empty list
+        - A list with rpm data for each fan, None for a fan if no valid response was received
+
+    Raises:
+        - GridError if the serial communication fails
     """
 
     # List to hold fan rpm data to be returned
@@ -176,40 +250,28 @@ def read_fan_rpm(ser, lock):
                 # 8A <fan id>
                 serial_data = [0x8A, fan]
 
+                # Discard any late response to a previous request
+                ser.reset_input_buffer()
                 ser.reset_output_buffer()
-                # TODO: Check bytes written
-                bytes_written = ser.write(serial.to_bytes(serial_data))
-
-                # Wait before checking response
-                time.sleep(WAIT_GRID)
 
                 # Expected response is 5 bytes
                 # Example response: C0 00 00 03 00 = 0x0300 = 768 rpm (two bytes unsigned)
-                response = ser.read(size=5)
-
-                # Check if the Grid responded with any data
-                if response:
-                    # Check for correct response, first three bytes should be C0 00 00
-                    if response[0] == int("0xC0", 16) and response[1] == response[2] == int("0x00", 16):
-                        # Convert rpm from 2-bytes unsigned value to decimal
-                        rpm = response[3] * 256 + response[4]
-                        fans.append(rpm)
-
-                    # An incorrect response was received, return an empty list
-                    else:
-                        return []
-
-                # In case no response (0 bytes) received, return an empty list
+                parser = protocol.ResponseParser()
+                parser.expect_frames(1)
+                parser.feed(transport.transaction(ser, serial.to_bytes(serial_data), 5))
+                frame, = parser.finish()
+
+                # Check for correct response, an incorrect or missing response only affects this fan
+                if frame is not None:
+                    fans.append(decode_rpm(frame))
                 else:
-                    return []
+                    print("Error reading rpm for fan " + str(fan) + ": " + ", ".join(parser.errors))
+                    fans.append(None)
 
             except Exception as e:
-                helper.show_error("Could not read rpm for fan " + str(fan) + ".\n\n"
-                                  "Please check serial port settings.\n\n"
-                                  "Exception:\n" + str(e) + "\n\n"
-                                  "The application will now exit.")
-                print(str(e))
-                sys.exit(0)
+                raise GridError("Could not read rpm for fan " + str(fan) + ".\n\n"
+                                "Please check serial port settings.\n\n"
+                                "Exception:\n" + str(e)) from e
 
         # Fan
         return fans
@@ -218,8 +280,10 @@ def read_fan_voltage(ser, lock):
     """Reads the current voltage of each fan.
 
     Returns:
-        - If success: a list with voltage data for each fan
-        - If failure to read data: An empty list
+        - A list with voltage data for each fan, None for a fan if no valid response was received
+
+    Raises:
+        - GridError if the serial communication fails
     """
 
     # List to hold fan voltage data to be returned
@@ -232,85 +296,121 @@ def read_fan_voltage(ser, lock):
                 # Format is two bytes, e.g. [0x84, <fan id>]
                 serial_data = [0x84, fan]
 
+                # Discard any late response to a previous request
+                ser.reset_input_buffer()
                 ser.reset_output_buffer()
-                bytes_written = ser.write(serial.to_bytes(serial_data))
-
-                # Wait before checking response
-                time.sleep(WAIT_GRID)
 
                 # Expected response is 5 bytes
-                # Example response: 00 00 00 0B 01 = 0x0B 0x01 = 11.01 volt
-                response = ser.read(size=5)
-
-                # Check if the Grid responded with any data
-                if response:
-                    # Check for correct response (first three bytes should be 0x00)
-                    if response[0] == int("0xC0", 16) and response[1] == response[2] == int("0x00", 16):
-                        # Convert last two bytes to a decimal float value
-                        voltage = float(str(response[3]) + "." + str(response[4]))
-                        # Add the voltage for the current fan to the list
-                        fans.append(voltage)
-
-                    # An incorrect response was received
-                    else:
-                        print("Error reading fan voltage, incorrect response")
-                        return []
-
-                # In case no response (0 bytes) is returned from the Grid
+                # Example response: C0 00 00 0B 01 = 0x0B 0x01 = 11.01 volt
+                parser = protocol.ResponseParser()
+                parser.expect_frames(1)
+                parser.feed(transport.transaction(ser, serial.to_bytes(serial_data), 5))
+                frame, = parser.finish()
+
+                # Check for correct response, an incorrect or missing response only affects this fan
+                if frame is not None:
+                    fans.append(decode_voltage(frame))
                 else:
-                    print("Error reading fan voltage, no data returned")
-                    return []
+                    print("Error reading voltage for fan " + str(fan) + ": " + ", ".join(parser.errors))
+                    fans.append(None)
 
             except Exception as e:
-                helper.show_error("Could not read fan voltage.\n\n"
-                                  "Please check serial port " + ser.port + ".\n\n"
-                                  "Exception:\n" + str(e) + "\n\n"
-                                  "The application will now exit.")
-                print(str(e))
-                sys.exit(0)
+                raise GridError("Could not read fan voltage.\n\n"
+                                "Please check serial port " + str(ser.port) + ".\n\n"
+                                "Exception:\n" + str(e)) from e
 
         return fans
 
 
+def read_all_telemetry(ser, lock, read_voltage=True, fans=FANS):
+    """Reads the current rpm and voltage of each fan in "fans" in one pipelined transaction.
+
+    All requests ("8A <fan id>" for each fan, followed by "84 <fan id>" for each fan) are written at once,
+    the 5-byte responses are then decoded from one continuous stream.
+    If "read_voltage" is False, only the rpm requests are sent.
+
+    Returns:
+        - A tuple (rpm list, voltage list) with data for each fan in "fans", None for each value without a valid
+          response (the voltage list is None if "read_voltage" is False)
+
+    Raises:
+        - GridError if the serial communication fails
+    """
+
+    # Define bytes to be sent to the Grid, rpm requests followed by voltage requests
+    # Format is two bytes per request, e.g. [0x8A, <fan id>] and [0x84, <fan id>]
+    serial_data = [byte for fan in fans for byte in (0x8A, fan)]
+    if read_voltage:
+        serial_data += [byte for fan in fans for byte in (0x84, fan)]
+
+    # Expected response is 5 bytes per request
+    requests = len(serial_data) // 2
+    parser = protocol.ResponseParser()
+    parser.expect_frames(requests)
+
+    with lock:
+        try:
+            ser.reset_input_buffer()
+            ser.reset_output_buffer()
+
+            # Returns as soon as all responses are received
+            parser.feed(transport.transaction(ser, serial.to_bytes(serial_data), parser.bytes_needed(),
+                                              requests=requests))
+
+            # Stray bytes in the stream push the end of the last responses out of the transaction
+            if parser.errors and parser.bytes_needed():
+                parser.feed(transport.read_more(ser, parser.bytes_needed()))
+
+        except Exception as e:
+            raise GridError("Could not read fan telemetry.\n\n"
+                            "Please check serial port " + str(ser.port) + ".\n\n"
+                            "Exception:\n" + str(e)) from e
+
+    frames = parser.finish()
+
+    # Incorrect or missing responses only affect the corresponding value
+    if parser.errors:
+        print("Error reading fan telemetry: " + ", ".join(parser.errors))
+
+    # First responses are rpm, followed by the voltage responses
+    fans_rpm = [decode_rpm(frame) if frame is not None else None for frame in frames[:len(fans)]]
+    fans_voltage = None
+    if read_voltage:
+        fans_voltage = [decode_voltage(frame) if frame is not None else None for frame in frames[len(fans):]]
+
+    return fans_rpm, fans_voltage
+
+def decode_rpm(frame):
+    """Convert rpm from 2-bytes unsigned value to decimal."""
+
+    return frame[0] * 256 + frame[1]
+
+def decode_voltage(frame):
+    """Convert voltage integer and decimal part to a float value, e.g. 0x0B 0x01 = 11.01 volt."""
+
+    return float(str(frame[0]) + "." + str(frame[1]))
+
+
 def calculate_voltage(percent):
     """Convert fan speed in percent (0-100) to nearest valid voltage (4.0V to 12.0V in steps of 0.5V).
-    Values below 33% will be defined as "0V" (fan will be stopped).
+    Values below 33% will be defined as "0V" (fan will be stopped), values above 100% and NaN as "12V".
     """
 
-    if percent < 33:
-        return 0.0
-    elif percent >= 33 and percent < 36:
-        return 4.0
-    elif percent >= 36 and percent < 40:
-        return 4.5
-    elif percent >= 40 and percent < 44:
-        return 5.0
-    elif percent >= 44 and percent < 48:
-        return 5.5
-    elif percent >= 48 and percent < 52:
-        return 6.0
-    elif percent >= 52 and percent < 56:
-        return 6.5
-    elif percent >= 56 and percent < 60:
-        return 7.0
-    elif percent >= 60 and percent < 64:
-        return 7.5
-    elif percent >= 64 and percent < 68:
-        return 8.0
-    elif percent >= 68 and percent < 72:
-        return 8.5
-    elif percent >= 72 and percent < 76:
-        return 9.0
-    elif percent >= 76 and percent < 80:
-        return 9.5
-    elif percent >= 80 and percent < 84:
-        return 10.0
-    elif percent >= 84 and percent < 88:
-        return 10.5
-    elif percent >= 88 and percent < 93:
-        return 11.0
-    elif percent >= 93 and percent < 98:
-        return 11.5
-    else:
-        return 12.0
+    if math.isnan(percent) or percent >= 100:
+        return VOLTAGE_TABLE[100]
+    if percent < 0:
+        return VOLTAGE_TABLE[0]
+    return VOLTAGE_TABLE[int(percent)]
+
+def calculate_voltages(percents):
+    """Convert a sequence of fan speeds in percent (0-100) to valid voltages, see calculate_voltage().
+
+    Returns:
+        - A NumPy array, computed with one index into the voltage table, or a list if NumPy is not installed
+    """
+
+    if numpy is None:
+        return [calculate_voltage(percent) for percent in percents]
 
+    percents = numpy.nan_to_num(numpy.asarray(percents, dtype=float), nan=100.0, posinf=100.0, neginf=0.0)
+    return VOLTAGE_ARRAY[numpy.clip(percents, 0, 100).astype(int)]
@@ -4,15 +4,22 @@
     This is the main module of Grid Control. Implements the UI and business logic.
 """
 
+import os
 import sys
-import threading
 
+import control
+import datalog
+import discovery
 import grid
 import helper
+import history
 import openhwmon
 import polling
-import serial
+import scheduler
+import sensors
+import serialworker
 import settings
+import telemetry
 from PyQt5 import QtCore, QtWidgets, QtGui
 from ui.mainwindow import Ui_MainWindow
 
@@ -44,48 +51,104 @@ class GridControl(QtWidgets.QMainWindow):
 
 
 
-        # Object for locking the serial port while sending/receiving data
-        self.lock = threading.Lock()
-
-        # Serial communication object
-        self.ser = serial.Serial()
-
-        # Initialize WMI communication with OpenHardwareMonitor
-        # "initialize_hwmon()" returns a WMI object
-        self.hwmon = openhwmon.initialize_hwmon()
-
         # QSettings object for storing the UI configuration in the OS native repository (Registry for Windows, ini-file for Linux)
         # In Windows, parameters will be stored at HKEY_CURRENT_USER/SOFTWARE/GridControl/App
         self.config = QtCore.QSettings('GridControl', 'App')
 
+        # Temperature sensor sources, stored as "sensor_sources" in the configuration
+        # (e.g. "openhardwaremonitor", "hwmon" or "file:<path>"), read in parallel by the polling thread
+        # A single source is stored as a string
+        sensor_sources = self.config.value("sensor_sources", sensors.DEFAULT_SOURCES)
+        self.sensor_sources = sensors.SensorGroup([sensor_sources] if isinstance(sensor_sources, str)
+                                                  else sensor_sources)
+        errors = self.sensor_sources.start()
+        if not self.sensor_sources.sources:
+            helper.show_error("\n\n".join(errors + ["The application will now exit."]))
+            sys.exit(0)
+        elif errors:
+            helper.show_error("\n\n".join(errors))
+
         # Get a list of available serial ports (e.g. "COM1" in Windows)
         self.serial_ports = grid.get_serial_ports()
 
+        # Serial port of a Grid emulator, stored as "emulator_port" in the configuration (e.g. "/dev/pts/3")
+        # Pseudo-terminals are not listed as serial ports, so the port is added to the available ports
+        emulator_port = self.config.value("emulator_port", "", type=str)
+        if emulator_port and emulator_port not in self.serial_ports:
+            self.serial_ports.append(emulator_port)
+
         # Populate the "COM port" combo box with available serial ports
         self.ui.comboBoxComPorts.addItems(self.serial_ports)
 
+        # Add adaptive polling to the "Polling interval" combo box (before the saved value is selected)
+        self.ui.comboBoxPolling.addItem(polling.ADAPTIVE)
+
         # Read saved UI configuration
-        settings.read_settings(self.config, self.ui, self.hwmon)
+        settings.read_settings(self.config, self.ui, self.sensor_sources)
+
+        # Serial ports of additional Grid units, stored as "extra_ports" in the configuration (not shown in the UI)
+        # A single port is stored as a string
+        extra_ports = self.config.value("extra_ports", [])
+        self.extra_ports = [port for port in ([extra_ports] if isinstance(extra_ports, str) else extra_ports)
+                            if port in self.serial_ports]
 
+        # Handling of polls taking longer than the polling interval ("skip", "catch-up" or "stretch"),
+        # stored as "polling_policy" in the configuration
+        self.polling_policy = self.config.value("polling_policy", scheduler.POLICY_SKIP, type=str)
+        if self.polling_policy not in scheduler.POLICIES:
+            self.polling_policy = scheduler.POLICY_SKIP
 
+        # Number of samples kept in the history of polled values, stored as "history_size" in the configuration
+        self.history_size = max(1, self.config.value("history_size", history.DEFAULT_CAPACITY, type=int))
 
-        # Populates the tree widget on tab "Sensor Config" with values from OpenHardwareMonitor
-        openhwmon.populate_tree(self.hwmon, self.ui.treeWidgetHWMonData, self.ui.checkBoxStartSilently.isChecked())
+        # On-disk log of the polled values, kept across restarts, enabled by "data_log" in the configuration (off by default)
+        # Stored in "data_log_directory", the oldest samples are deleted above "data_log_max_size" (MB)
+        self.data_log = None
+        if self.config.value("data_log", False, type=bool):
+            directory = self.config.value("data_log_directory", os.path.join(
+                QtCore.QStandardPaths.writableLocation(QtCore.QStandardPaths.GenericDataLocation), "GridControl", "log"),
+                type=str)
+            max_size = self.config.value("data_log_max_size", datalog.MAX_SIZE // (1024 * 1024), type=int)
+            try:
+                self.data_log = datalog.DataLog(directory, max_size=max_size * 1024 * 1024)
+            except OSError as e:
+                print("Data log disabled, could not create " + directory + ": " + str(e))
+
+        # Select the serial port connected to the Grid, if it can be found automatically
+        self.auto_select_port()
+
+
+
+        # Populates the tree widget on tab "Sensor Config" with values from the sensor sources
+        openhwmon.populate_tree(self.sensor_sources, self.ui.treeWidgetHWMonData, self.ui.checkBoxStartSilently.isChecked())
 
         # System tray icon
         self.trayIcon = SystemTrayIcon(QtGui.QIcon(QtGui.QPixmap(":/icons/grid.png")), self)
         self.trayIcon.show()
 
 
+        # Grid units, each with a serial port and a QThread object that executes all Grid commands
+        # The first unit uses the serial port selected in the UI
+        # Additional units use the serial ports stored as "extra_ports" in the configuration,
+        # their fans are set to the same voltage as the corresponding fan on the first unit
+        # (there is no fan configuration per unit, and only the fans of the first unit are shown in the UI)
+        self.devices = [serialworker.GridDevice()]
+
+        # Set when a Grid command has failed, the application exits after showing the error message
+        self.grid_failed = False
+
         # Create a QThread object that will poll the Grid for fan rpm and voltage and HWMon for temperatures
-        # The lock is needed in all operations with the serial port
-        self.thread = polling.PollingThread(polling_interval=int(self.ui.comboBoxPolling.currentText()),
-                                            ser=self.ser,
-                                            lock=self.lock,
+        self.thread = polling.PollingThread(polling_interval=self.get_polling_interval(),
+                                            devices=self.devices,
+                                            sensor_sources=self.sensor_sources,
                                             cpu_sensor_ids=self.get_cpu_sensor_ids(),
                                             gpu_sensor_ids=self.get_gpu_sensor_ids(),
                                             cpu_calc="Max" if self.ui.radioButtonCPUMax.isChecked() else "Avg",
-                                            gpu_calc="Max" if self.ui.radioButtonGPUMax.isChecked() else "Avg")
+                                            gpu_calc="Max" if self.ui.radioButtonGPUMax.isChecked() else "Avg",
+                                            control_config=self.get_control_config(),
+                                            polling_policy=self.polling_policy,
+                                            history_capacity=self.history_size,
+                                            data_log=self.data_log)
 
         # Connect signals and slots
         self.setup_ui_logic()
@@ -177,30 +240,36 @@ class GridControl(QtWidgets.QMainWindow):
         # Connect event from changed serial port combo box
         self.ui.comboBoxComPorts.currentIndexChanged.connect(self.init_communication)
 
-        # Connect event from changed polling interval combo box
-        self.ui.comboBoxPolling.currentIndexChanged.connect(self.init_communication)
+        # Connect event from changed polling interval combo box, the polling thread is not restarted
+        self.ui.comboBoxPolling.currentIndexChanged.connect(self.update_polling_interval)
+
+        # Connect "Maximum/Average" temperature radio buttons, used by the polling thread from the next poll
+        self.ui.radioButtonCPUMax.toggled.connect(self.update_temp_calc)
+        self.ui.radioButtonGPUMax.toggled.connect(self.update_temp_calc)
 
         # Update fan voltage (speed) based on changes to the horizontal sliders
         #
         # "grid.calculate_voltage" converts the percent value to valid voltages supported by the Grid
-        # "lambda" is needed to send four arguments (serial object, fan id, fan voltage and lock object)
+        # The write is queued in the serial worker, the UI never waits for the serial port
+        # Writes that don't change the fan voltage are dropped by the coalescer
+        # "lambda" is needed to send two arguments (fan id and fan voltage)
         self.ui.horizontalSliderFan1.valueChanged.connect(
-            lambda: grid.set_fan(ser=self.ser, fan=1, voltage=grid.calculate_voltage(self.ui.lcdNumberFan1.value()) ,lock=self.lock))
+            lambda: self.set_fan(fan=1, voltage=grid.calculate_voltage(self.ui.lcdNumberFan1.value())))
 
         self.ui.horizontalSliderFan2.valueChanged.connect(
-            lambda: grid.set_fan(ser=self.ser, fan=2, voltage=grid.calculate_voltage(self.ui.lcdNumberFan2.value()), lock=self.lock))
+            lambda: self.set_fan(fan=2, voltage=grid.calculate_voltage(self.ui.lcdNumberFan2.value())))
 
         self.ui.horizontalSliderFan3.valueChanged.connect(
-            lambda: grid.set_fan(ser=self.ser, fan=3, voltage=grid.calculate_voltage(self.ui.lcdNumberFan3.value()), lock=self.lock))
+            lambda: self.set_fan(fan=3, voltage=grid.calculate_voltage(self.ui.lcdNumberFan3.value())))
 
         self.ui.horizontalSliderFan4.valueChanged.connect(
-            lambda: grid.set_fan(ser=self.ser, fan=4, voltage=grid.calculate_voltage(self.ui.lcdNumberFan4.value()), lock=self.lock))
+            lambda: self.set_fan(fan=4, voltage=grid.calculate_voltage(self.ui.lcdNumberFan4.value())))
 
         self.ui.horizontalSliderFan5.valueChanged.connect(
-            lambda: grid.set_fan(ser=self.ser, fan=5, voltage=grid.calculate_voltage(self.ui.lcdNumberFan5.value()), lock=self.lock))
+            lambda: self.set_fan(fan=5, voltage=grid.calculate_voltage(self.ui.lcdNumberFan5.value())))
 
         self.ui.horizontalSliderFan6.valueChanged.connect(
-            lambda: grid.set_fan(ser=self.ser, fan=6, voltage=grid.calculate_voltage(self.ui.lcdNumberFan6.value()), lock=self.lock))
+            lambda: self.set_fan(fan=6, voltage=grid.calculate_voltage(self.ui.lcdNumberFan6.value())))
 
         # Connect "Change value" events from "Fan config" tab (all "spin boxes") to verify that the values are valid
         for fan in range(1, 7):
@@ -211,44 +280,28 @@ class GridControl(QtWidgets.QMainWindow):
             getattr(self.ui, "spinBoxIntermediateTempFan" + str(fan)).valueChanged.connect(self.validate_fan_config)
             getattr(self.ui, "spinBoxMaxTempFan" + str(fan)).valueChanged.connect(self.validate_fan_config)
 
-        # Connect fan rpm signal (from polling thread) to fan rpm label
-        self.thread.rpm_signal_fan1.connect(self.ui.labelRPMFan1.setText)
-        self.thread.rpm_signal_fan2.connect(self.ui.labelRPMFan2.setText)
-        self.thread.rpm_signal_fan3.connect(self.ui.labelRPMFan3.setText)
-        self.thread.rpm_signal_fan4.connect(self.ui.labelRPMFan4.setText)
-        self.thread.rpm_signal_fan5.connect(self.ui.labelRPMFan5.setText)
-        self.thread.rpm_signal_fan6.connect(self.ui.labelRPMFan6.setText)
-
-        # Connect fan voltage signal (from polling thread) to fan voltage value
-        self.thread.voltage_signal_fan1.connect(self.ui.labelVFan1.setText)
-        self.thread.voltage_signal_fan2.connect(self.ui.labelVFan2.setText)
-        self.thread.voltage_signal_fan3.connect(self.ui.labelVFan3.setText)
-        self.thread.voltage_signal_fan4.connect(self.ui.labelVFan4.setText)
-        self.thread.voltage_signal_fan5.connect(self.ui.labelVFan5.setText)
-        self.thread.voltage_signal_fan6.connect(self.ui.labelVFan6.setText)
-
-        # Connect pixmap signal (from polling thread) for updating the fan status icon
-        # "lambda" is needed to transmit two arguments, "icon resource name" from the signal (x) and fan id
-        self.thread.pixmap_signal_fan1.connect(lambda x: self.change_fan_icon(x, 1))
-        self.thread.pixmap_signal_fan2.connect(lambda x: self.change_fan_icon(x, 2))
-        self.thread.pixmap_signal_fan3.connect(lambda x: self.change_fan_icon(x, 3))
-        self.thread.pixmap_signal_fan4.connect(lambda x: self.change_fan_icon(x, 4))
-        self.thread.pixmap_signal_fan5.connect(lambda x: self.change_fan_icon(x, 5))
-        self.thread.pixmap_signal_fan6.connect(lambda x: self.change_fan_icon(x, 6))
-
-        # Connect CPU and GPU temperature signals (from polling thread) to GPU and CPU LCD values
-        self.thread.cpu_temp_signal.connect(self.ui.lcdNumberCurrentCPU.display)
-        self.thread.gpu_temp_signal.connect(self.ui.lcdNumberCurrentGPU.display)
-
-        # Connect update signal to fan update function
-        self.thread.update_signal.connect(self.update_fan_speed)
-
-        # Connect CPU and GPU temperature signals (from polling thread) to function for updating HWMon status
-        self.thread.hwmon_status_signal.connect(self.ui.labelHWMonStatus.setText)
+        # Send the fan control settings to the polling thread when they are changed
+        # The spin boxes are connected after "validate_fan_config", so only valid values are sent
+        for fan in range(1, 7):
+            getattr(self.ui, "spinBoxMinSpeedFan" + str(fan)).valueChanged.connect(self.update_control_config)
+            getattr(self.ui, "spinBoxStartIncreaseSpeedFan" + str(fan)).valueChanged.connect(self.update_control_config)
+            getattr(self.ui, "spinBoxIntermediateSpeedFan" + str(fan)).valueChanged.connect(self.update_control_config)
+            getattr(self.ui, "spinBoxMaxSpeedFan" + str(fan)).valueChanged.connect(self.update_control_config)
+            getattr(self.ui, "spinBoxIntermediateTempFan" + str(fan)).valueChanged.connect(self.update_control_config)
+            getattr(self.ui, "spinBoxMaxTempFan" + str(fan)).valueChanged.connect(self.update_control_config)
+            getattr(self.ui, "radioButtonCPUFan" + str(fan)).toggled.connect(self.update_control_config)
+        self.ui.checkBoxSimulateTemp.stateChanged.connect(self.update_control_config)
+        self.ui.horizontalSliderCPUTemp.valueChanged.connect(self.update_control_config)
+        self.ui.horizontalSliderGPUTemp.valueChanged.connect(self.update_control_config)
+
+        # Connect snapshot signal (from polling thread) to update the UI with the polled values
+        self.thread.snapshot_signal.connect(self.show_snapshot)
 
         # Connect exception signal to show exception message from running thread
         # This is needed as it's not possible to show a message box widget from the QThread directly
         self.thread.exception_signal.connect(self.thread_exception_handling)
+        self.devices[0].worker.exception_signal.connect(self.grid_exception_handling)
+
 
     def validate_fan_config(self):
         """Validate fan configuration values, prevent incorrect/invalid values."""
@@ -346,29 +399,29 @@ class GridControl(QtWidgets.QMainWindow):
 
         Called at:
         - Start of application
-        - When the "Serial port" or "Polling interval" combo box is changed
+        - When the "Serial port" combo box is changed
         - When "Restart Communication" button is clicked
+
+        The polling interval is changed without calling this, see update_polling_interval().
         """
 
-        # If the polling thread is running, stop it to be able to update port/polling interval and reset fans
+        # If the polling thread is running, stop it to be able to update the serial port and reset fans
         if self.thread.isRunning():
             self.thread.stop()
 
         # Reset fan and temperature data (set rpm and voltage to "---" and temp to "0")
         self.reset_data()
 
-        # If the serial port is open, close it
-        with self.lock:
-            if self.ser.isOpen():
-                self.ser.close()
+        # Close the serial port of the first Grid unit (after queued fan updates have been written)
+        self.devices[0].close()
+
+        # Stop additional Grid units, they are added again below
+        for device in self.devices[1:]:
+            device.stop()
+        del self.devices[1:]
 
         # Check if a serial port is selected
         if self.ui.comboBoxComPorts.currentText() != "<Select port>":
-            # Setup serial device using selected serial port
-            grid.setup_serial(self.ser, self.ui.comboBoxComPorts.currentText(), self.lock)
-
-            # Open serial device
-            grid.open_serial(self.ser, self.lock)
 
             # If manual mode is selected, enable horizontal sliders (they are disabled if no serial port is selected)
             if self.ui.radioButtonManual.isChecked():
@@ -387,13 +440,35 @@ class GridControl(QtWidgets.QMainWindow):
                 self.ui.horizontalSliderCPUTemp.setEnabled(True)
                 self.ui.horizontalSliderGPUTemp.setEnabled(True)
 
-            # Initialize the Grid+ V2 device
-            if grid.initialize_grid(self.ser, self.lock):
+            # Setup and open the serial device using selected serial port, and initialize the Grid+ V2 device
+            try:
+                initialized = self.devices[0].open(self.ui.comboBoxComPorts.currentText())
+            except grid.GridError as e:
+                helper.show_error(str(e))
+                initialized = False
+
+            if initialized:
+                # Remember the USB id of the Grid, to find it without probing at next startup
+                self.config.setValue("grid_usb_id", discovery.get_usb_id(self.ui.comboBoxComPorts.currentText()) or "")
+
+                # Add additional Grid units, units that cannot be initialized are skipped
+                for port in self.extra_ports:
+                    if port != self.ui.comboBoxComPorts.currentText():
+                        device = serialworker.GridDevice()
+                        try:
+                            device.open(port)
+                        except grid.GridError as e:
+                            print("Skipping Grid at " + port + ": " + " ".join(str(e).split()))
+                            device.stop()
+                            continue
+                        device.worker.exception_signal.connect(self.grid_exception_handling)
+                        self.devices.append(device)
+
                 # Set the initial fan speeds based on UI values
                 self.initialize_fans()
 
                 # Update the polling interval (ms) based on UI value
-                self.thread.update_polling_interval(new_polling_interval=int(self.ui.comboBoxPolling.currentText()))
+                self.thread.update_polling_interval(new_polling_interval=self.get_polling_interval())
 
                 # Update temperature calculation (Maximum or Average) based on UI settings on "Sensor Config" tab
                 self.thread.set_temp_calc(cpu_calc="Max" if self.ui.radioButtonCPUMax.isChecked() else "Avg",
@@ -430,6 +505,23 @@ class GridControl(QtWidgets.QMainWindow):
             self.ui.horizontalSliderCPUTemp.setValue(0)
             self.ui.horizontalSliderGPUTemp.setValue(0)
 
+    def auto_select_port(self):
+        """Select the serial port connected to the Grid in the "COM port" combo box.
+
+        - A Grid used before is found by its USB id, even if the name of the serial port has changed
+        - Otherwise, if no serial port is selected, all serial ports are probed concurrently
+        """
+
+        port = discovery.find_port(self.config.value("grid_usb_id", "", type=str))
+
+        if port is None and self.ui.comboBoxComPorts.currentText() == "<Select port>":
+            port = discovery.discover([port for port in self.serial_ports if port not in self.extra_ports])
+            if port is not None:
+                print("Grid found at " + port)
+
+        if port is not None:
+            self.ui.comboBoxComPorts.setCurrentIndex(self.ui.comboBoxComPorts.findText(port))
+
     def reset_data(self):
         """Reset fan rpm and voltage to "---" and activate the red status icon.
         Reset CPU and GPU temperature to "0"."""
@@ -469,17 +561,33 @@ class GridControl(QtWidgets.QMainWindow):
     def initialize_fans(self):
         """Initialize fans to the initial slider values."""
 
-        grid.set_fan(ser=self.ser, fan=1, voltage=grid.calculate_voltage(self.ui.lcdNumberFan1.value()), lock=self.lock)
-        grid.set_fan(ser=self.ser, fan=2, voltage=grid.calculate_voltage(self.ui.lcdNumberFan2.value()), lock=self.lock)
-        grid.set_fan(ser=self.ser, fan=3, voltage=grid.calculate_voltage(self.ui.lcdNumberFan3.value()), lock=self.lock)
-        grid.set_fan(ser=self.ser, fan=4, voltage=grid.calculate_voltage(self.ui.lcdNumberFan4.value()), lock=self.lock)
-        grid.set_fan(ser=self.ser, fan=5, voltage=grid.calculate_voltage(self.ui.lcdNumberFan5.value()), lock=self.lock)
-        grid.set_fan(ser=self.ser, fan=6, voltage=grid.calculate_voltage(self.ui.lcdNumberFan6.value()), lock=self.lock)
+        # The Grid has just been initialized, write all fans even if the voltage is unchanged
+        for device in self.devices:
+            device.coalescer.reset()
+
+        # All fans are written in one transaction per Grid unit
+        self.set_fans({fan: grid.calculate_voltage(getattr(self.ui, "lcdNumberFan" + str(fan)).value())
+                       for fan in range(1, 7)})
+
+    def set_fan(self, fan, voltage):
+        """Set voltage of a fan, on all Grid units."""
+
+        self.set_fans({fan: voltage})
+
+    def set_fans(self, voltages):
+        """Set voltages ({fan: voltage}) of several fans, on all Grid units."""
+
+        serialworker.set_fans(self.devices, {(device, fan): voltage
+                                             for device in range(len(self.devices))
+                                             for fan, voltage in voltages.items()})
 
     def disable_enable_sliders(self):
         """Disables the horizontal sliders if "Automatic" mode is selected.
         When changing from automatic to manual mode, restore manual values."""
 
+        # Start or stop the automatic fan control before the manual values are saved or restored
+        self.update_control_config()
+
         # If "Automatic" radio button was clicked (i.e. it's "Checked")
         if self.ui.radioButtonAutomatic.isChecked():
             # Save current manual values
@@ -523,80 +631,32 @@ class GridControl(QtWidgets.QMainWindow):
             self.ui.groupBoxSimulateTemperatures.setEnabled(False)
             self.ui.checkBoxSimulateTemp.setChecked(False)
 
-    def update_fan_speed(self):
-        """Update fan speed based on CPU and GPU temperatures."""
-
-        # If automatic mode is selected
-        if self.ui.radioButtonAutomatic.isChecked():
-            # For each fan (1 ... 6)
-            for fan in range(1, 7):
-                # Linear equation calculation
-                # y = k*x + m
-                # k = (y2 - y1) / (x2 - x1)
-
-                # First equation (a):
-                # From "Start increase speed at" to "Intermediate fan speed at" (temperature on x-axis)
-
-                # Temperatures (x-axis)
-                x1_a = int(getattr(self.ui, "spinBoxStartIncreaseSpeedFan" + str(fan)).value())
-                x2_a = int(getattr(self.ui, "spinBoxIntermediateTempFan" + str(fan)).value())
-
-                # Speed in percent (y-axis)
-                y1_a = int(getattr(self.ui, "spinBoxMinSpeedFan" + str(fan)).value())
-                y2_a = int(getattr(self.ui, "spinBoxIntermediateSpeedFan" + str(fan)).value())
-
-                # Calculate "k" and "m"
-                k_a = (y2_a - y1_a) / (x2_a - x1_a)
-                m_a = y1_a - k_a * x1_a
-
-                # Second equation (b)
-                # From "Intermediate fan speed at" to "Maximum fan speed at" (temperature on x-axis)
-
-                # Temperatures (x-axis)
-                x1_b = int(getattr(self.ui, "spinBoxIntermediateTempFan" + str(fan)).value())
-                x2_b = int(getattr(self.ui, "spinBoxMaxTempFan" + str(fan)).value())
-
-                # Speed in percent (y-axis)
-                y1_b = int(getattr(self.ui, "spinBoxIntermediateSpeedFan" + str(fan)).value())
-                y2_b = int(getattr(self.ui, "spinBoxMaxSpeedFan" + str(fan)).value())
-
-                # Calculate "k" and "m"
-                k_b = (y2_b - y1_b) / (x2_b - x1_b)
-                m_b = y1_b - k_b * x1_b
-
-
-                min_temperature = int(getattr(self.ui, "spinBoxStartIncreaseSpeedFan" + str(fan)).value())
-
-                intermediate_temperature = int(getattr(self.ui, "spinBoxIntermediateTempFan" + str(fan)).value())
-
-                max_temperature = int(getattr(self.ui, "spinBoxMaxTempFan" + str(fan)).value())
-
-                # If "Use CPU temperature" is selected, use current CPU temperature (from LCD widget in UI)
-                if getattr(self.ui, "radioButtonCPUFan" + str(fan)).isChecked():
-                    current_temperature = self.ui.lcdNumberCurrentCPU.value()
-
-                # Else, use current GPU temperature (from LCD widget i UI)
-                else:
-                    current_temperature = self.ui.lcdNumberCurrentGPU.value()
+    def get_control_config(self):
+        """Return the fan control settings from the UI (control.ControlConfig)."""
 
-                if current_temperature <= min_temperature:
-                    # Set fan to minimum fan speed (constant value)
-                    fan_speed = int(getattr(self.ui, "spinBoxMinSpeedFan" + str(fan)).value())
-
-                elif current_temperature <= intermediate_temperature:
-                    # Calculate temperature according to first linear equation
-                    fan_speed = k_a * current_temperature + m_a
+        curves = {}
+        for fan in range(1, 7):
+            curves[fan] = control.FanCurve(
+                min_speed=int(getattr(self.ui, "spinBoxMinSpeedFan" + str(fan)).value()),
+                start_temp=int(getattr(self.ui, "spinBoxStartIncreaseSpeedFan" + str(fan)).value()),
+                intermediate_speed=int(getattr(self.ui, "spinBoxIntermediateSpeedFan" + str(fan)).value()),
+                intermediate_temp=int(getattr(self.ui, "spinBoxIntermediateTempFan" + str(fan)).value()),
+                max_speed=int(getattr(self.ui, "spinBoxMaxSpeedFan" + str(fan)).value()),
+                max_temp=int(getattr(self.ui, "spinBoxMaxTempFan" + str(fan)).value()),
+                use_cpu=getattr(self.ui, "radioButtonCPUFan" + str(fan)).isChecked())
+
+        # Simulated temperatures replace the polled temperatures
+        simulated_temps = None
+        if self.ui.checkBoxSimulateTemp.isChecked():
+            simulated_temps = (self.ui.horizontalSliderCPUTemp.value(), self.ui.horizontalSliderGPUTemp.value())
 
-                elif current_temperature <= max_temperature:
-                    # Calculate temperature according to second linear equation
-                    fan_speed = k_b * current_temperature + m_b
+        return control.ControlConfig(automatic=self.ui.radioButtonAutomatic.isChecked(), curves=curves,
+                                     simulated_temps=simulated_temps)
 
-                else:
-                    # Set fan to maximum fan speed (constant value)
-                    fan_speed = int(getattr(self.ui, "spinBoxMaxSpeedFan" + str(fan)).value())
+    def update_control_config(self):
+        """Send the fan control settings to the polling thread, called when a setting is changed in the UI."""
 
-                # Update horizontal slider value
-                getattr(self.ui, "horizontalSliderFan" + str(fan)).setValue(round(fan_speed))
+        self.thread.update_control_config(self.get_control_config())
 
     def simulate_temperatures(self):
         """Simulate CPU and GPU temperatures, used for verifying the functionality of the fan control system."""
@@ -611,10 +671,6 @@ class GridControl(QtWidgets.QMainWindow):
             self.ui.lcdNumberCurrentCPU.display(self.ui.horizontalSliderCPUTemp.value())
             self.ui.lcdNumberCurrentGPU.display(self.ui.horizontalSliderGPUTemp.value())
 
-            # Disconnect temperature signals from polling thread
-            self.thread.cpu_temp_signal.disconnect(self.ui.lcdNumberCurrentCPU.display)
-            self.thread.gpu_temp_signal.disconnect(self.ui.lcdNumberCurrentGPU.display)
-
             # Connect the horizontal sliders to the "CPU" and "GPU" LCD widget
             self.ui.horizontalSliderCPUTemp.valueChanged.connect(self.ui.lcdNumberCurrentCPU.display)
             self.ui.horizontalSliderGPUTemp.valueChanged.connect(self.ui.lcdNumberCurrentGPU.display)
@@ -629,25 +685,51 @@ class GridControl(QtWidgets.QMainWindow):
             self.ui.horizontalSliderCPUTemp.setEnabled(False)
             self.ui.horizontalSliderGPUTemp.setEnabled(False)
 
-            # Reconnect signals from polling thread
-            self.thread.cpu_temp_signal.connect(self.ui.lcdNumberCurrentCPU.display)
-            self.thread.gpu_temp_signal.connect(self.ui.lcdNumberCurrentGPU.display)
+            # Show the latest polled temperatures, rounded to whole degrees
+            self.ui.lcdNumberCurrentCPU.display(round(self.thread.store.get("cpu_temp", 0)))
+            self.ui.lcdNumberCurrentGPU.display(round(self.thread.store.get("gpu_temp", 0)))
 
             # Reset headers in UI
             self.ui.groupBoxCurrentCPUTemp.setTitle("Current CPU temp")
             self.ui.groupBoxCurrentGPUTemp.setTitle("Current GPU temp")
 
     def restart(self):
-        """Update 'Selected CPU and GPU sensors' and restart application"""
+        """Update 'Selected CPU and GPU sensors' and restart communication."""
 
-        # TODO: Add apply button
-        self.thread.update_sensors(self.get_cpu_sensor_ids(), self.get_gpu_sensor_ids())
+        self.update_sensors()
         self.init_communication()
 
+    def update_sensors(self):
+        """Send the selected CPU and GPU sensors to the polling thread, used from the next temperature poll."""
+
+        self.thread.update_sensors(self.get_cpu_sensor_ids(), self.get_gpu_sensor_ids())
+
+    def update_temp_calc(self):
+        """Send the temperature calculation (Maximum or Average) to the polling thread, used from the next poll."""
+
+        self.thread.set_temp_calc(cpu_calc="Max" if self.ui.radioButtonCPUMax.isChecked() else "Avg",
+                                  gpu_calc="Max" if self.ui.radioButtonGPUMax.isChecked() else "Avg")
+
+    def update_polling_interval(self):
+        """Send the polling interval to the polling thread, a running thread continues with the new interval."""
+
+        self.thread.update_polling_interval(new_polling_interval=self.get_polling_interval())
+
+    def get_polling_interval(self):
+        """Return the polling interval (ms) selected in the UI, None for adaptive polling."""
+
+        if self.ui.comboBoxPolling.currentText() == polling.ADAPTIVE:
+            return None
+        return int(self.ui.comboBoxPolling.currentText())
+
     def thread_exception_handling(self, msg):
         """Display an error message with details about the exception and reset the "serial port value" to <Select port>.
         Called when an exception occurs in the polling thread."""
 
+        # A failed Grid command stops the polling thread too, the error message has already been shown
+        if self.grid_failed:
+            return
+
         # Show error message
         helper.show_error(msg)
 
@@ -655,6 +737,18 @@ class GridControl(QtWidgets.QMainWindow):
         index = self.ui.comboBoxComPorts.findText("<Select port>")
         self.ui.comboBoxComPorts.setCurrentIndex(index)
 
+    def grid_exception_handling(self, msg):
+        """Display an error message about a failed Grid command, then exit the application.
+        Called when a command fails in a serial worker thread."""
+
+        # Only the first failure is shown, e.g. queued commands fail too after the serial port has been disconnected
+        if self.grid_failed:
+            return
+        self.grid_failed = True
+
+        helper.show_error(msg + "\n\nThe application will now exit.")
+        sys.exit(0)
+
     def add_cpu_sensors(self):
         """Add selected temperature sensor(s) to the "Selected CPU sensor(s)" three widget."""
 
@@ -672,6 +766,8 @@ class GridControl(QtWidgets.QMainWindow):
         # Deselect all items in the HWMon tree widget after they have been added
         self.ui.treeWidgetHWMonData.clearSelection()
 
+        self.update_sensors()
+
     def add_gpu_sensors(self):
         """Add selected temperature sensor(s) to the "Selected GPU sensor(s)" three widget."""
         items = [item for item in self.ui.treeWidgetHWMonData.selectedItems()]
@@ -688,6 +784,8 @@ class GridControl(QtWidgets.QMainWindow):
         # Deselect all items in the HWMon tree widget after they have been added
         self.ui.treeWidgetHWMonData.clearSelection()
 
+        self.update_sensors()
+
     def remove_cpu_sensors(self):
         """Remove selected CPU sensors."""
 
@@ -695,6 +793,8 @@ class GridControl(QtWidgets.QMainWindow):
         for item in self.ui.treeWidgetSelectedCPUSensors.selectedItems():
             root.removeChild(item)
 
+        self.update_sensors()
+
     def remove_gpu_sensors(self):
         """Remove selected GPU sensors."""
 
@@ -702,6 +802,8 @@ class GridControl(QtWidgets.QMainWindow):
         for item in self.ui.treeWidgetSelectedGPUSensors.selectedItems():
             root.removeChild(item)
 
+        self.update_sensors()
+
     def get_cpu_sensor_ids(self):
         """Get id's for each sensor in the "Selected CPU sensors" tree."""
 
@@ -724,6 +826,82 @@ class GridControl(QtWidgets.QMainWindow):
             gpu_sensor_ids.append(item.text(1))  # Second column is the id
         return gpu_sensor_ids
 
+    def show_snapshot(self, sample):
+        """Update the UI with a sample from the polling thread, only widgets for changed values are updated."""
+
+        changed = sample.changed
+
+        # Polled temperatures are not shown when simulating temperatures, and are rounded to whole degrees
+        if not self.ui.checkBoxSimulateTemp.isChecked():
+            if changed & telemetry.CHANGED_CPU_TEMP:
+                self.ui.lcdNumberCurrentCPU.display(round(sample.cpu_temp))
+            if changed & telemetry.CHANGED_GPU_TEMP:
+                self.ui.lcdNumberCurrentGPU.display(round(sample.gpu_temp))
+
+        if changed & telemetry.CHANGED_HWMON_STATUS:
+            self.ui.labelHWMonStatus.setText('<b><font color="green">Connected</font></b>' if sample.hwmon_connected
+                                             else '<b><font color="red">---</font></b>')
+
+        # If no valid data is available for a value, show "---" as value
+        for fan in range(1, 7):
+            if changed & telemetry.CHANGED_RPM[fan - 1]:
+                rpm = sample.rpm[fan - 1]
+                getattr(self.ui, "labelRPMFan" + str(fan)).setText(
+                    str(rpm) if rpm is not None else '<b><font color="red">---</font></b>')
+
+            if changed & telemetry.CHANGED_VOLTAGE[fan - 1]:
+                voltage = sample.voltage[fan - 1]
+                getattr(self.ui, "labelVFan" + str(fan)).setText(
+                    str(voltage) if voltage is not None else '<b><font color="red">---</font></b>')
+
+            # Red icon if fan rpm or voltage is 0 or not available, otherwise green icon
+            if changed & telemetry.CHANGED_STATUS[fan - 1]:
+                self.change_fan_icon(ICON_GREEN_LED if sample.status[fan - 1] else ICON_RED_LED, fan)
+
+        if changed & telemetry.CHANGED_TELEMETRY:
+            self.show_device_telemetry(sample.telemetry)
+
+        if changed & telemetry.CHANGED_STATISTICS and sample.statistics is not None:
+            self.show_polling_statistics(sample.statistics)
+
+        # Show the fan speeds set by the automatic fan control
+        # Slider signals are blocked, the fan voltages have already been set by the polling thread
+        if self.ui.radioButtonAutomatic.isChecked():
+            for fan in range(1, 7):
+                speed = sample.speed[fan - 1]
+                if changed & telemetry.CHANGED_SPEED[fan - 1] and speed is not None:
+                    slider = getattr(self.ui, "horizontalSliderFan" + str(fan))
+                    slider.blockSignals(True)
+                    slider.setValue(speed)
+                    slider.blockSignals(False)
+                    getattr(self.ui, "lcdNumberFan" + str(fan)).display(slider.value())
+
+    def show_device_telemetry(self, snapshot):
+        """Show rpm and voltage of each fan on all Grid units as tool tips, when more than one unit is used."""
+
+        for fan in range(1, 7):
+            if len(self.devices) > 1:
+                tool_tip = "\n".join("Grid " + str(device + 1) + ": " + str(snapshot[(device, fan)][0]) + " rpm, " +
+                                      str(snapshot[(device, fan)][1]) + " V"
+                                      for device in range(len(self.devices)) if (device, fan) in snapshot)
+            else:
+                tool_tip = ""
+            getattr(self.ui, "labelRPMFan" + str(fan)).setToolTip(tool_tip)
+
+    def show_polling_statistics(self, statistics):
+        """Show the achieved polling interval and jitter as tool tip of the polling interval combo box."""
+
+        if statistics["period"] is None:
+            tool_tip = ""
+        else:
+            tool_tip = ("Achieved interval: %.0f ms (std dev %.1f ms)\n"
+                        "Jitter: %.1f ms average, %.1f ms maximum\n"
+                        "Overruns: %d, skipped polls: %d (%s)" %
+                        (statistics["period"] * 1000, statistics["period_stdev"] * 1000,
+                         statistics["jitter"] * 1000, statistics["jitter_max"] * 1000,
+                         statistics["overruns"], statistics["skipped"], self.polling_policy))
+        self.ui.comboBoxPolling.setToolTip(tool_tip)
+
     def change_fan_icon(self, icon, fan):
         """Update the fan status icon."""
 
@@ -750,6 +928,19 @@ class GridControl(QtWidgets.QMainWindow):
             self.thread.stop()
             print("Thread stopped")
 
+        # Close the temperature sensor sources
+        self.sensor_sources.stop()
+
+        # Write the remaining samples of the data log
+        if self.data_log is not None:
+            self.data_log.close()
+
+        # Stop the serial worker threads, after queued fan updates have been written
+        for device in self.devices:
+            device.stop()
+            print("Fan voltage frames sent to " + str(device.ser.port) + ": " + str(device.coalescer.frames_sent) +
+                  ", avoided: " + str(device.coalescer.frames_avoided))
+
         # Save UI settings
         settings.save_settings(self.config, self.ui)
         print("Settings saved")
@@ -770,6 +961,20 @@ class GridControl(QtWidgets.QMainWindow):
                     self.show()
                     event.accept()
 
+    def export_history(self):
+        """Export the history of polled values to a CSV file selected by the user."""
+
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Export history", "grid-control-history.csv",
+                                                        "CSV files (*.csv)")
+        if not path:
+            return
+
+        try:
+            self.thread.history.export_csv(path)
+            print("History exported to " + path)
+        except OSError as e:
+            helper.show_error("Could not export the history:\n" + str(e))
+
     def toggle_visibility(self):
         if self.isVisible():
             self.minimize_to_tray()
@@ -797,6 +1002,8 @@ class SystemTrayIcon(QtWidgets.QSystemTrayIcon):
         menu = QtWidgets.QMenu()
         showAction = menu.addAction("Hide/Show")
         showAction.triggered.connect(parent.toggle_visibility)
+        exportAction = menu.addAction("Export history...")
+        exportAction.triggered.connect(parent.export_history)
         menu.addSeparator()
         exitAction = menu.addAction("Exit")
         exitAction.triggered.connect(parent.close)
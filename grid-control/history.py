@@ -0,0 +1,202 @@
+"""
+    history.py
+    ----------
+    Implements a fixed size in-memory history of the polled values (temperatures, fan rpm and voltage).
+    Values are stored column by column in preallocated ring buffers, NumPy arrays if NumPy is installed,
+    otherwise arrays from the "array" module. The memory used is fixed by the capacity, regardless of uptime.
+"""
+
+import array
+import csv
+import math
+import threading
+import time
+
+# NumPy is optional
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Default number of samples kept, about one hour at five samples per second (~2 MB)
+DEFAULT_CAPACITY = 18000
+
+# Column names, "time" is time.monotonic() when the sample was taken (converted to time.time() in CSV exports)
+# Missing values (e.g. no response from the Grid) are stored as NaN
+COLUMNS = (("time", "cpu_temp", "gpu_temp") +
+           tuple("rpm" + str(fan) for fan in range(1, 7)) +
+           tuple("voltage" + str(fan) for fan in range(1, 7)))
+
+
+class TelemetryHistory:
+    """Ring buffer with one column of float values for each name in COLUMNS.
+
+    Samples are appended in time order, the oldest sample is overwritten when the buffer is full.
+    Windows of samples are returned as views of the buffer (no copy), at most two views per column
+    (the part before and after the wrap around point), oldest samples first.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, use_numpy=True):
+        """Constructor for the history, "capacity" is the maximum number of samples kept."""
+
+        self.capacity = capacity
+        self.use_numpy = use_numpy and numpy is not None
+
+        # Preallocated columns
+        if self.use_numpy:
+            self.columns = {name: numpy.full(capacity, math.nan) for name in COLUMNS}
+        else:
+            self.columns = {name: array.array("d", [math.nan]) * capacity for name in COLUMNS}
+
+        # Index of the next sample to write and number of samples stored
+        self.position = 0
+        self.count = 0
+
+        # Samples are appended by the polling thread and read by the UI
+        self.lock = threading.Lock()
+
+        # Offset from time.monotonic() to time.time(), captured once so exported times do not jump
+        # when the clock is set
+        self.wall_clock_offset = time.time() - time.monotonic()
+
+    def clear(self):
+        """Remove all samples."""
+
+        with self.lock:
+            self.position = 0
+            self.count = 0
+
+    def append(self, timestamp, cpu_temp, gpu_temp, fans_rpm, fans_voltage):
+        """Append a sample, "fans_rpm" and "fans_voltage" are lists for fans 1 - 6, None for missing values."""
+
+        with self.lock:
+            position = self.position
+            columns = self.columns
+
+            columns["time"][position] = timestamp
+            columns["cpu_temp"][position] = cpu_temp
+            columns["gpu_temp"][position] = gpu_temp
+            for fan in range(1, 7):
+                rpm = fans_rpm[fan - 1]
+                voltage = fans_voltage[fan - 1]
+                columns["rpm" + str(fan)][position] = rpm if rpm is not None else math.nan
+                columns["voltage" + str(fan)][position] = voltage if voltage is not None else math.nan
+
+            self.position = (position + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    def __len__(self):
+        return self.count
+
+    def _segments(self, count):
+        """Return the buffer index ranges [(start, end), ...] of the newest "count" samples, oldest first."""
+
+        count = min(count, self.count)
+        start = self.position - count
+
+        if count == 0:
+            return []
+        if start >= 0:
+            return [(start, self.position)]
+        return [(start + self.capacity, self.capacity), (0, self.position)]
+
+    def _view(self, name, start, end):
+        """Return a view (no copy) of buffer indexes start - end of a column."""
+
+        if self.use_numpy:
+            return self.columns[name][start:end]
+        return memoryview(self.columns[name])[start:end]
+
+    def latest(self, name, count):
+        """Return the newest "count" samples of a column, as a list of views (oldest first).
+
+        The views refer to the buffer, they are overwritten by new samples once the buffer has wrapped around.
+        """
+
+        with self.lock:
+            return [self._view(name, start, end) for start, end in self._segments(count)]
+
+    def _count_since(self, timestamp):
+        """Return the number of samples taken at or after "timestamp", the lock must be held."""
+
+        times = self.columns["time"]
+        oldest = self.position - self.count
+
+        # Binary search for the first sample at or after "timestamp", on the sample order (oldest first)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if times[(oldest + middle) % self.capacity] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+
+        return self.count - low
+
+    def count_since(self, timestamp):
+        """Return the number of samples taken at or after "timestamp" (time.monotonic())."""
+
+        with self.lock:
+            return self._count_since(timestamp)
+
+    def since(self, name, timestamp):
+        """Return the samples of a column taken at or after "timestamp", as a list of views (oldest first)."""
+
+        with self.lock:
+            return [self._view(name, start, end) for start, end in self._segments(self._count_since(timestamp))]
+
+    def _copy(self, name, segments):
+        """Return a copy of the buffer index ranges of a column, the lock must be held."""
+
+        views = [self._view(name, start, end) for start, end in segments]
+        if self.use_numpy:
+            return numpy.concatenate(views) if views else numpy.empty(0)
+        return [value for view in views for value in view]
+
+    def values(self, name, count=None):
+        """Return a copy of the newest "count" samples (all samples if None) of a column, oldest first.
+
+        Returns:
+            - A NumPy array, or a list if NumPy is not used
+        """
+
+        with self.lock:
+            return self._copy(name, self._segments(self.capacity if count is None else count))
+
+    def statistics(self, name, count=None):
+        """Return (minimum, maximum, average) of the newest "count" samples of a column, missing values are ignored.
+
+        Returns:
+            - A tuple (minimum, maximum, average), None if there are no values
+        """
+
+        if self.use_numpy:
+            values = self.values(name, count)
+            values = values[~numpy.isnan(values)]
+            if not len(values):
+                return None
+            return float(values.min()), float(values.max()), float(values.mean())
+
+        values = [value for value in self.values(name, count) if not math.isnan(value)]
+        if not values:
+            return None
+        return min(values), max(values), sum(values) / len(values)
+
+    def export_csv(self, path):
+        """Write all samples to a CSV file, one row per sample with a header row (COLUMNS).
+
+        The "time" column is written as wall clock time (time.time(), s since the epoch), as in the data log
+        and the rollups.
+        """
+
+        # All columns are copied at once, so that the rows are complete samples
+        with self.lock:
+            segments = self._segments(self.capacity)
+            columns = [self._copy(name, segments) for name in COLUMNS]
+
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(COLUMNS)
+            for timestamp, *values in zip(*columns):
+                writer.writerow([timestamp + self.wall_clock_offset] +
+                                ["" if math.isnan(value) else value for value in values])
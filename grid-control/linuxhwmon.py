@@ -0,0 +1,165 @@
+"""
+    linuxhwmon.py
+    -------------
+    Implements reading temperature sensors from the Linux hwmon sysfs interface (/sys/class/hwmon).
+
+    The sensors are enumerated once, the "temp*_input" files are kept open and re-read from offset 0
+    with os.pread() at each poll, so no paths are looked up and no files are opened while polling.
+    Registered as the "hwmon" sensor source.
+"""
+
+import os
+import re
+
+import sensors
+
+HWMON_ROOT = "/sys/class/hwmon"
+
+# Maximum length of a sysfs value, e.g. "-12345\n" (millidegrees Celsius)
+VALUE_SIZE = 16
+
+TEMPERATURE_INPUT = re.compile(r"^temp(\d+)_input$")
+
+
+def read_text(path, default=None):
+    """Return the stripped content of a small sysfs file, "default" if it can not be read."""
+
+    try:
+        with open(path) as file:
+            return file.read().strip()
+    except (OSError, UnicodeDecodeError):
+        return default
+
+def device_id(path):
+    """Return an identifier of a hwmon device that does not change between boots (unlike "hwmonN").
+
+    The name of the underlying device (e.g. "coretemp.0" or "0000:01:00.0") is used if available,
+    otherwise the driver name from the "name" file, then "hwmonN".
+    """
+
+    device = os.path.join(path, "device")
+    if os.path.exists(device):
+        return os.path.basename(os.path.realpath(device))
+    return read_text(os.path.join(path, "name"), os.path.basename(path))
+
+
+class SysfsHwmon:
+    """Temperature sensors of all hwmon devices, with open file descriptors.
+
+    "hardware" and "sensors" hold the sensors.HardwareInfo and sensors.SensorInfo of the devices and sensors.
+    Identifiers are "/hwmon/<device>" for hardware nodes and "/hwmon/<device>/temperature/<n>" for sensors.
+    """
+
+    def __init__(self, root=HWMON_ROOT):
+        """Constructor, enumerates the hwmon devices and opens all temperature inputs."""
+
+        self.root = root
+        self.hardware = []
+        self.sensors = []
+
+        # Open "temp*_input" file of each sensor, in the same order as "sensors"
+        self._fds = []
+
+        self.enumerate()
+
+    def enumerate(self):
+        """Find all hwmon devices and temperature inputs, and open the inputs. Sensors already open are closed."""
+
+        self.close()
+
+        try:
+            # "hwmon2" before "hwmon10"
+            names = sorted(os.listdir(self.root), key=lambda name: (len(name), name))
+        except OSError:
+            names = []
+
+        for name in names:
+            path = os.path.join(self.root, name)
+            identifier = "/hwmon/" + device_id(path)
+
+            # Several hwmon devices for the same device (e.g. with different drivers) get a suffix
+            if any(hardware.identifier == identifier for hardware in self.hardware):
+                identifier += "/" + name
+
+            try:
+                inputs = sorted((int(match.group(1)), match.group(0))
+                                for match in map(TEMPERATURE_INPUT.match, os.listdir(path)) if match)
+            except OSError:
+                continue
+            if not inputs:
+                continue
+
+            self.hardware.append(sensors.HardwareInfo(identifier, read_text(os.path.join(path, "name"), name)))
+
+            for index, input_name in inputs:
+                try:
+                    fd = os.open(os.path.join(path, input_name), os.O_RDONLY)
+                except OSError:
+                    continue
+
+                label = read_text(os.path.join(path, "temp%d_label" % index), "Temperature %d" % index)
+                self.sensors.append(sensors.SensorInfo(identifier + "/temperature/" + str(index), label, identifier))
+                self._fds.append(fd)
+
+        print("hwmon: %d temperature sensors found in %s" % (len(self.sensors), self.root))
+
+    def close(self):
+        """Close the open temperature inputs."""
+
+        for fd in self._fds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self.hardware = []
+        self.sensors = []
+        self._fds = []
+
+    def read(self):
+        """Read all temperature inputs.
+
+        Returns:
+            - A dictionary with the sensor identifier as key and the temperature (degrees Celsius) as value,
+              sensors that could not be read (e.g. a device in a power saving state) are left out
+        """
+
+        values = {}
+        for sensor, fd in zip(self.sensors, self._fds):
+            try:
+                values[sensor.identifier] = int(os.pread(fd, VALUE_SIZE, 0)) / 1000
+            except (OSError, ValueError):
+                pass
+        return values
+
+
+@sensors.register("hwmon")
+class HwmonSource(sensors.SensorSource):
+    """Temperature sensors of the Linux hwmon devices, "root" is the sysfs directory of the devices."""
+
+    def __init__(self, root=HWMON_ROOT):
+        """Constructor for the source."""
+
+        self.root = root
+        self.hwmon = None
+
+    def open(self):
+        if not os.path.isdir(self.root):
+            raise sensors.SourceError("Linux hwmon sensors not found in " + self.root)
+        self.hwmon = SysfsHwmon(self.root)
+
+    def close(self):
+        if self.hwmon is not None:
+            self.hwmon.close()
+            self.hwmon = None
+
+    def discover(self):
+        """Enumerate the hwmon devices again, e.g. after a driver has been loaded."""
+
+        self.hwmon.enumerate()
+        return len(self.hwmon.sensors)
+
+    def metadata(self):
+        return list(self.hwmon.hardware), list(self.hwmon.sensors)
+
+    def read_batch(self, identifiers=None):
+        return self.hwmon.read()
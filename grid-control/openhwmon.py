@@ -1,41 +1,146 @@
 """
     openhwmon.py
     ------------
-    Implements communication with OpenHardwareMonitor using WMI.
+    Implements communication with OpenHardwareMonitor using WMI, as the "openhardwaremonitor" sensor source.
     The module also provides functions for populating the QT Tree Widget with hardware nodes and temperature sensors.
 """
 
-import sys
+import time
 
-import wmi
 from PyQt5 import QtCore, QtWidgets, QtGui
 
 import helper
-import time
+import sensors
 
+# WMI is only available on Windows
+try:
+    import pythoncom
+    import win32com.client
+    import wmi
+except ImportError:
+    pythoncom = win32com = wmi = None
 
-def initialize_hwmon():
-    """Create a WMI object and verify that OpenHardwareMonitor is installed."""
+# WMI namespace of OpenHardwareMonitor
+NAMESPACE = "root\\OpenHardwareMonitor"
 
-    # Access the OpenHWMon WMI interface
-    try:
-        hwmon = wmi.WMI(namespace="root\OpenHardwareMonitor")
-        return hwmon
+# WQL query for the values of all temperature sensors, only the properties needed in each poll
+VALUES_QUERY = "SELECT Identifier, Value FROM Sensor WHERE SensorType = 'Temperature'"
+
+# wbemFlagReturnImmediately | wbemFlagForwardOnly, the results are enumerated once while they arrive
+WBEM_FLAGS = 0x10 | 0x20
+
+
+def values_query(identifiers):
+    """Return the WQL query for the values of the temperature sensors "identifiers"."""
 
-    # WMI exception (e.g. no namespace "root\OpenHardwareMonitor" indicates OpenHWMon is not installed
-    except:
-        helper.show_error("OpenHardwareMonitor WMI data not found.\n\n"
-                          "Please make sure that OpenHardwareMonitor is installed.\n\n"
-                          "Latest version is available at:\n\n"
-                          "http://openhardwaremonitor.org\n\n"
-                          "The application will now exit.")
-        sys.exit(0)
+    conditions = " OR ".join("Identifier = '%s'" % identifier.replace("\\", "\\\\").replace("'", "\\'")
+                             for identifier in identifiers)
+    return VALUES_QUERY + " AND (" + conditions + ")"
 
 
-def populate_tree(hwmon, treeWidget, start_silently):
-    """Read sensor data from OpenHardwareMonitor using the available WMI interface,
+@sensors.register("openhardwaremonitor")
+class WmiSource(sensors.SensorSource):
+    """Temperature sensors of OpenHardwareMonitor, read with WMI.
+
+    The WMI objects are only used in the thread of the source, values are returned as floats.
+    """
+
+    def __init__(self):
+        """Constructor for the source."""
+
+        self.hwmon = None
+
+        # WMI services object (SWbemServices) for the prepared value queries, None to use the WMI object API
+        self.services = None
+
+        self.hardware = []
+        self.sensors = []
+
+        # Sensors of the last read, and the query for them
+        self.selection = None
+        self.selection_query = None
+
+    def open(self):
+        """Create a WMI object and verify that OpenHardwareMonitor is installed."""
+
+        if wmi is None:
+            raise sensors.SourceError("OpenHardwareMonitor WMI data not found.\n\n"
+                                      "WMI is not available on this system.")
+
+        # CoInitialise() is needed when accessing WMI in a thread
+        pythoncom.CoInitialize()
+
+        # Access the OpenHWMon WMI interface
+        try:
+            self.hwmon = wmi.WMI(namespace=NAMESPACE)
+
+        # WMI exception (e.g. no namespace "root\OpenHardwareMonitor" indicates OpenHWMon is not installed
+        except Exception:
+            pythoncom.CoUninitialize()
+            raise sensors.SourceError("OpenHardwareMonitor WMI data not found.\n\n"
+                                      "Please make sure that OpenHardwareMonitor is installed.\n\n"
+                                      "Latest version is available at:\n\n"
+                                      "http://openhardwaremonitor.org")
+
+        # The values are read with the services object directly, without the wrappers of the "wmi" package
+        try:
+            self.services = win32com.client.GetObject("winmgmts:{impersonationLevel=impersonate}!\\\\.\\" + NAMESPACE)
+        except Exception as e:
+            print("OpenHardwareMonitor values are read with the WMI object API: " + str(e))
+
+    def close(self):
+        """Release the WMI objects, and uninitialize COM in the thread of the source."""
+
+        if self.hwmon is not None:
+            self.hwmon = None
+            self.services = None
+            pythoncom.CoUninitialize()
+
+    def discover(self):
+        """Read the hardware nodes and temperature sensors from OpenHardwareMonitor."""
+
+        # Get a list of temperature sensor nodes (filtered to optimize WMI performance)
+        self.sensors = [sensors.SensorInfo(sensor.Identifier, sensor.Name, sensor.Parent)
+                        for sensor in self.hwmon.Sensor(["Name", "Parent", "Identifier"], SensorType="Temperature")]
+        self.hardware = [sensors.HardwareInfo(hardware.Identifier, hardware.Name, hardware.Parent)
+                         for hardware in self.hwmon.Hardware()]
+        return len(self.sensors)
+
+    def metadata(self):
+        return self.hardware, self.sensors
+
+    def read_batch(self, identifiers=None):
+        """Return the values of the temperature sensors "identifiers" (all temperature sensors if None)."""
+
+        if identifiers is None:
+            query = VALUES_QUERY
+        elif not identifiers:
+            return {}
+        else:
+            # The query for the selected sensors is only built again when the selection changes
+            if identifiers != self.selection:
+                self.selection = list(identifiers)
+                self.selection_query = values_query(identifiers)
+            query = self.selection_query
+
+        # Raw WMI objects with Identifier and Value only, enumerated forward only and converted at once
+        if self.services is not None:
+            try:
+                return {sensor.Identifier: float(sensor.Value)
+                        for sensor in self.services.ExecQuery(query, "WQL", WBEM_FLAGS)}
+            except Exception as e:
+                print("OpenHardwareMonitor values are read with the WMI object API: " + str(e))
+                self.services = None
+
+        return {sensor.Identifier: float(sensor.Value) for sensor in self.hwmon.query(query)}
+
+
+def populate_tree(sensor_sources, treeWidget, start_silently):
+    """Read the hardware nodes and temperature sensors of the sensor sources (sensors.SensorGroup),
     and populated the tree widget with the hardware nodes and sensors.
 
+    The nodes and sensors of OpenHardwareMonitor are read from WMI:
+
     Hardware nodes contains the following data, note that Parent = "" indicates a top node in the tree:
 
     Example:
@@ -79,12 +184,12 @@ def populate_tree(hwmon, treeWidget, start_silently):
 
 
 
-    # Get a list of temperature sensor nodes (filtered to optimize WMI performance)
-    sensors = hwmon.Sensor(["Name", "Parent", "Value", "Identifier"], SensorType="Temperature")
+    # Get the hardware nodes and temperature sensors, discovered at startup (e.g. by read_settings())
+    hardwares, temperature_sensors = sensor_sources.catalog.entries()
 
     # No sensor data (empty list) indicates OpenHWMon is not running
-    if not sensors:
-        print("OHM not running!")
+    if not temperature_sensors:
+        print("No temperature sensors found!")
 
         dialog = helper.CustomDialog()
         dialog.setWindowTitle("Grid Control")
@@ -92,7 +197,7 @@ def populate_tree(hwmon, treeWidget, start_silently):
         dialog.resize(400,100)
         dialog.layout = QtWidgets.QGridLayout(dialog)
         label = QtWidgets.QLabel()
-        label.setText("Waiting for OpenHardwareMonitor to start.\n\n" + "Retries: 30")
+        label.setText("Waiting for the temperature sensors (OpenHardwareMonitor) to start.\n\n" + "Retries: 30")
         label.setStyleSheet("font: 12pt;")
         dialog.layout.addWidget(label)
 
@@ -104,11 +209,12 @@ def populate_tree(hwmon, treeWidget, start_silently):
             print("Sleeping...")
             QtCore.QCoreApplication.processEvents()
             time.sleep(1)
-            label.setText("Waiting for OpenHardwareMonitor to start.\n\n" + "Retries: " + str(retries))
+            label.setText("Waiting for the temperature sensors (OpenHardwareMonitor) to start.\n\n" + "Retries: " + str(retries))
             print("Retrying...", retries)
 
-            sensors = hwmon.Sensor(["Name", "Parent", "Value", "Identifier"], SensorType="Temperature")
-            if sensors:
+            sensor_sources.catalog.refresh()
+            hardwares, temperature_sensors = sensor_sources.catalog.entries()
+            if temperature_sensors:
                 break
             else:
                 retries -= 1
@@ -116,95 +222,59 @@ def populate_tree(hwmon, treeWidget, start_silently):
         #helper.show_notification("No data from OpenHardwareMonitor found.\n\n"
         #                         "Please make sure OpenHardwareMonitor is running.\n\n")
 
-    # Get a list of hardware nodes
-    hardwares = hwmon.Hardware()
+    # Current temperatures, shown in the tree
+    values = sensor_sources.read()
 
-    # The "hardware_nodes" dictionary will hold all hardware nodes and children
-    # key = top node identifier
-    # value = list of all node identifiers (including the top node)
-    hardware_nodes = {}
+    fill_tree(treeWidget, hardwares, temperature_sensors, values)
 
-    # Add the top hardware nodes to the dictionary
-    for hardware in hardwares:
-        # No parent indicates it's a top node
-        if hardware.Parent == "":
-            hardware_nodes[hardware.Identifier] = [hardware.Identifier]
+def fill_tree(treeWidget, hardwares, temperature_sensors, values):
+    """Add the hardware nodes and sensors to the tree widget."""
 
-    # Add remaining hardware nodes to the dictionary, under the corresponding top node (dictionary key)
-    for hardware in hardwares:
-        # If the node has a parent, it's a child node
-        if hardware.Parent != "":
-            hardware_nodes[hardware.Parent].append(hardware.Identifier)
-
-    # Add hardware nodes and temperature sensors to the three widget
-    for key, nodelist in hardware_nodes.items():
-        item_list = []
-        for index, node in enumerate(nodelist):
-            # First item in the list is the top node, parent should be the "treeWidget" itself
-            if index == 0:
-                parent = treeWidget
-                item = QtWidgets.QTreeWidgetItem(parent)
-                item.setText(0, get_hardware_name(nodelist[index], hardwares))  # First column, name of the node
-                item.setText(1, nodelist[index])  # Second column, node id
-                item.setFlags(QtCore.Qt.ItemIsEnabled)  # Make hardware nodes "not selectable" in the UI
-
-                # Add the item to a list used when adding child nodes
-                item_list.append(item)
-
-            # Following items in the list are children, parent is the previous item in "item_list"
-            else:
-                parent = item_list[index-1]
-                item = QtWidgets.QTreeWidgetItem(parent)
-                item.setText(0, get_hardware_name(nodelist[index], hardwares))  # First column, name of the node
-                item.setText(1, nodelist[index])  # Second column, node id
-                item.setFlags(QtCore.Qt.ItemIsEnabled)  # Make hardware nodes "not selectable" in the UI
-                item_list.append(item)
-
-            for sensor in sensors:
-                # If the sensor belongs to the current hardware node, add it as a child node
-                if sensor.Parent == nodelist[index]:
-                    sensor_parent = item_list[-1]  # Last item (QTreeWidgetItem) in the list is the parent
-                    item = QtWidgets.QTreeWidgetItem(sensor_parent)
-
-                    item.setText(0, sensor.Name)  # First column, name
-                    item.setText(1, sensor.Identifier)  # Second column, id
-                    item.setText(2, str(sensor.Value))  # Third column, temperature value
-
-                    # Set node name and temperature value to blue
-                    item.setForeground(0, QtGui.QBrush(QtCore.Qt.blue))
-                    item.setForeground(2, QtGui.QBrush(QtCore.Qt.blue))
-
-def get_temperature_sensors(hwmon):
-    """Return all temperature sensors"""
-
-    # Get a list of temperature sensor nodes (filtered to optimize WMI performance)
-    sensors = hwmon.Sensor(["Name", "Parent", "Value", "Identifier"], SensorType="Temperature")
-    return sensors
-
-def get_temp(hwmon, id):
-    """Return the temperature value for the sensor id."""
-
-    # Get a list of temperature sensor nodes (filtered to optimize WMI performance)
-    sensors = hwmon.Sensor(["Name", "Parent", "Value", "Identifier"], SensorType="Temperature")
-    for sensor in sensors:
-        if sensor.Identifier == id:
-            return sensor.Value
-
-def get_sensor_name(hwmon, id):
-    """Return the name for a specific sensor id."""
-
-    # Get a list of temperature sensor nodes (filtered to optimize WMI performance)
-    sensors = hwmon.Sensor(["Name", "Parent", "Value", "Identifier"], SensorType="Temperature")
-    for sensor in sensors:
-        if sensor.Identifier == id:
-            return sensor.Name
-
-def get_hardware_name(id, hardwares):
-    """Return the name for a specific node id in the list of hardware nodes."""
+    # Build all items first and add them in one call, without repainting the tree for each item
+    treeWidget.setUpdatesEnabled(False)
+    try:
+        treeWidget.addTopLevelItems(build_tree_items(hardwares, temperature_sensors, values))
+    finally:
+        treeWidget.setUpdatesEnabled(True)
+
+def build_tree_items(hardwares, temperature_sensors, values):
+    """Return the tree widget items of the top hardware nodes, with their child nodes and sensors.
+
+    "values" is a dictionary {sensor identifier: temperature}, shown for each sensor.
+    """
 
+    # Index the child nodes by parent node, and the sensors by hardware node, in one pass each
+    # A node whose parent is not found is shown as a top node
+    identifiers = {hardware.identifier for hardware in hardwares}
+    children = {}
     for hardware in hardwares:
-        if hardware.Identifier == id:
-            return hardware.Name
+        parent = hardware.parent if hardware.parent in identifiers else ""
+        children.setdefault(parent, []).append(hardware)
+
+    hardware_sensors = {}
+    for sensor in temperature_sensors:
+        hardware_sensors.setdefault(sensor.parent, []).append(sensor)
+
+    blue = QtGui.QBrush(QtCore.Qt.blue)
+
+    def create_item(hardware):
+        # First column, name of the node, second column, node id
+        item = QtWidgets.QTreeWidgetItem([hardware.name, hardware.identifier])
+        item.setFlags(QtCore.Qt.ItemIsEnabled)  # Make hardware nodes "not selectable" in the UI
+
+        # Sensors of the node (name, id and temperature value), then the child nodes
+        items = []
+        for sensor in hardware_sensors.get(hardware.identifier, []):
+            sensor_item = QtWidgets.QTreeWidgetItem([sensor.name, sensor.identifier,
+                                                     str(values.get(sensor.identifier))])
 
+            # Set node name and temperature value to blue
+            sensor_item.setForeground(0, blue)
+            sensor_item.setForeground(2, blue)
+            items.append(sensor_item)
+        items.extend(create_item(child) for child in children.get(hardware.identifier, []))
 
+        item.addChildren(items)
+        return item
 
+    return [create_item(hardware) for hardware in children.get("", [])]
@@ -2,67 +2,52 @@
     polling.py
     ----------
     Implements a QThread for polling the Grid unit for fan rpm and voltage data,
-    as well as CPU and GPU temperatures from OpenHardwareMonitor.
+    as well as CPU and GPU temperatures from the sensor sources (e.g. OpenHardwareMonitor).
+
+    Temperatures and fan data are acquired by two independently clocked stages, so the fan speed update
+    triggered by new temperatures does not wait for the serial communication with the Grid.
 """
 
 import sys
+import threading
 import time
 
-import pythoncom
-import wmi
 from PyQt5 import QtCore
 
 import grid
 import helper
-import openhwmon
+import history
+import rollup
+import scheduler
+import serialworker
+import telemetry
+
+# Temperature polling interval (ms), temperatures are polled at the fan polling interval if that is shorter
+TEMPERATURE_INTERVAL = 250
 
-# Define status icons (available in the resource file built with "pyrcc5"
-ICON_RED_LED = ":/icons/led-red-on.png"
-ICON_GREEN_LED = ":/icons/green-led-on.png"
+# Name of the adaptive polling interval in the UI
+# Polling intervals are then TEMPERATURE_INTERVAL and ADAPTIVE_FAN_INTERVAL (ms) when temperatures or fan rpm change,
+# and up to scheduler.ADAPTIVE_MAX_FACTOR times longer while they are stable
+ADAPTIVE = "Adaptive"
+ADAPTIVE_FAN_INTERVAL = 1000
 
 class PollingThread(QtCore.QThread):
     """QThread, performs the following:
-        - Get fan rpm from Grid
-        - Get fan voltage from Grid
-        - Get CPU and GPU temperatures from OpenHardwareMonitor"""
-
-    # Signals handling the fan rpm
-    rpm_signal_fan1 = QtCore.pyqtSignal(str)
-    rpm_signal_fan2 = QtCore.pyqtSignal(str)
-    rpm_signal_fan3 = QtCore.pyqtSignal(str)
-    rpm_signal_fan4 = QtCore.pyqtSignal(str)
-    rpm_signal_fan5 = QtCore.pyqtSignal(str)
-    rpm_signal_fan6 = QtCore.pyqtSignal(str)
-
-    # Signals handling the fan voltage
-    voltage_signal_fan1 = QtCore.pyqtSignal(str)
-    voltage_signal_fan2 = QtCore.pyqtSignal(str)
-    voltage_signal_fan3 = QtCore.pyqtSignal(str)
-    voltage_signal_fan4 = QtCore.pyqtSignal(str)
-    voltage_signal_fan5 = QtCore.pyqtSignal(str)
-    voltage_signal_fan6 = QtCore.pyqtSignal(str)
-
-    # Signals handling the pixmap icon (red or green led) indicating the fan status
-    pixmap_signal_fan1 = QtCore.pyqtSignal(str)
-    pixmap_signal_fan2 = QtCore.pyqtSignal(str)
-    pixmap_signal_fan3 = QtCore.pyqtSignal(str)
-    pixmap_signal_fan4 = QtCore.pyqtSignal(str)
-    pixmap_signal_fan5 = QtCore.pyqtSignal(str)
-    pixmap_signal_fan6 = QtCore.pyqtSignal(str)
-
-    # Signals handling CPU and GPU temperatures
-    cpu_temp_signal = QtCore.pyqtSignal(int)
-    gpu_temp_signal = QtCore.pyqtSignal(int)
-
-    hwmon_status_signal = QtCore.pyqtSignal(str)
-
-    # Signal to indicate fan speed should be updated
-    update_signal = QtCore.pyqtSignal()
+        - Get fan rpm from Grid (every polling interval)
+        - Get fan voltage from Grid (when fan voltages have been written, or requested)
+        - Get CPU and GPU temperatures from the sensor sources (every TEMPERATURE_INTERVAL)
+        - Set the fan speeds for new temperatures, when automatic fan control is enabled"""
+
+    # Signal handling all polled values (telemetry.Sample), emitted at each poll that changed any value
+    # The "changed" mask of the sample tells which values differ from the previous sample
+    snapshot_signal = QtCore.pyqtSignal(object)
 
     # Signal handling exceptions that may occur in the running thread
     exception_signal = QtCore.pyqtSignal(str)
 
-    def __init__(self, polling_interval, ser, lock, cpu_sensor_ids, gpu_sensor_ids, cpu_calc, gpu_calc):
+    def __init__(self, polling_interval, devices, sensor_sources, cpu_sensor_ids, gpu_sensor_ids, cpu_calc, gpu_calc,
+                 control_config=None, polling_policy=scheduler.POLICY_SKIP,
+                 history_capacity=history.DEFAULT_CAPACITY, data_log=None):
         """ Constructor for the polling thread."""
 
         super().__init__()
@@ -71,14 +56,50 @@ class PollingThread(QtCore.QThread):
         # Initial value is False as the thread is not started yet
         self.keep_running = False
 
-        # Polling interval (ms)
+        # Polling interval (ms), None for adaptive polling
         self.polling_interval = polling_interval
 
-        # Serial device
-        self.ser = ser
+        # Factor for the polling intervals in adaptive polling
+        self.adaptive_rate = scheduler.AdaptiveRate()
+
+        # Polls start at fixed deadlines, "polling_policy" defines how a poll longer than the interval is handled
+        fan_interval, temperature_interval = self.get_polling_intervals()
+        self.fan_scheduler = scheduler.DeadlineScheduler(period=fan_interval / 1000, policy=polling_policy)
+        self.temperature_scheduler = scheduler.DeadlineScheduler(period=temperature_interval / 1000,
+                                                                 policy=polling_policy)
+
+        # Latest temperatures ("cpu_temp", "gpu_temp") and fan data ("rpm", "voltage", {(device, fan): value})
+        self.store = telemetry.LatestValueStore()
+
+        # Set to read the fan voltages at the next fan poll
+        self.voltage_requested = threading.Event()
+
+        # Number of voltage frames written to the Grid units at the last voltage read
+        self.frames_sent = None
+
+        # Fan control settings (control.ControlConfig), replaced as a whole when changed in the UI
+        # The lock makes sure no fan speeds calculated with replaced settings are written after the replacement
+        self.control_config = control_config
+        self.control_lock = threading.Lock()
+
+        # Last sample emitted, both stages update it
+        self.sample = None
+        self.sample_lock = threading.Lock()
 
-        # Lock
-        self.lock = lock
+        # History of the emitted samples, kept when polling is restarted
+        self.history = history.TelemetryHistory(history_capacity)
+
+        # Statistics of the emitted samples at resolutions from 10 s to 1 day, kept when polling is restarted
+        self.rollups = rollup.Rollups()
+
+        # On-disk log of the emitted samples (datalog.DataLog), None if disabled
+        self.data_log = data_log
+
+        # Grid units, each with a serial worker thread owning the serial device
+        self.devices = devices
+
+        # Temperature sensor sources (sensors.SensorGroup), read in each temperature poll
+        self.sensor_sources = sensor_sources
 
         # List of CPU and GPU temperature sensors to use
         self.cpu_sensor_ids = cpu_sensor_ids
@@ -88,6 +109,9 @@ class PollingThread(QtCore.QThread):
         self.cpu_calc = cpu_calc
         self.gpu_calc = gpu_calc
 
+        # Lock for changing the sensors and calc parameters while polling, both temperatures use the same settings
+        self.sensor_lock = threading.Lock()
+
     def __del__(self):
         self.wait()
 
@@ -97,211 +121,271 @@ class PollingThread(QtCore.QThread):
         print("Stopping thread...")
         self.keep_running = False
 
-        # Wait for the thread to stop
+        # End the waits for the next polls at once
+        self.fan_scheduler.stop()
+        self.temperature_scheduler.stop()
+
+        # Wait for the thread to stop, after the polls in progress
         self.wait()
         print("Thread stopped")
 
-        # Uninitialize at thread stop (used for WMI in thread)
-        pythoncom.CoUninitialize()
-
     def set_temp_calc(self, cpu_calc, gpu_calc):
-        """Setter for cpu and gpu calc parameter."""
+        """Setter for cpu and gpu calc parameter, used from the next temperature poll."""
 
-        self.cpu_calc = cpu_calc
-        self.gpu_calc = gpu_calc
+        with self.sensor_lock:
+            self.cpu_calc = cpu_calc
+            self.gpu_calc = gpu_calc
 
     def update_polling_interval(self, new_polling_interval):
-        """Setter for polling interval value."""
+        """Setter for polling interval value (None for adaptive polling), the running thread continues with the new
+        polling interval."""
 
         self.polling_interval = new_polling_interval
+        self.adaptive_rate.reset()
+        self.apply_polling_intervals()
+
+    def get_polling_intervals(self):
+        """Return the current polling intervals (ms) as a tuple (fan polling interval, temperature polling interval)."""
+
+        if self.polling_interval is None:
+            factor = self.adaptive_rate.factor
+            return ADAPTIVE_FAN_INTERVAL * factor, TEMPERATURE_INTERVAL * factor
+
+        return self.polling_interval, min(self.polling_interval, TEMPERATURE_INTERVAL)
+
+    def apply_polling_intervals(self, reset_statistics=True):
+        """Update the schedulers with the current polling intervals."""
+
+        fan_interval, temperature_interval = self.get_polling_intervals()
+        self.fan_scheduler.set_period(fan_interval / 1000, reset_statistics)
+        self.temperature_scheduler.set_period(temperature_interval / 1000, reset_statistics)
+
+    def request_voltage_readback(self):
+        """Read the fan voltages at the next fan poll."""
+
+        self.voltage_requested.set()
+
+    def update_control_config(self, control_config):
+        """Setter for the fan control settings (control.ControlConfig).
+
+        When this returns, all fan speeds calculated with the previous settings have been queued for writing.
+        """
+
+        with self.control_lock:
+            self.control_config = control_config
+
+        # Poll fast after a settings change, e.g. a simulated temperature
+        if self.polling_interval is None:
+            self.adaptive_rate.reset()
+            self.apply_polling_intervals(reset_statistics=False)
 
     def update_sensors(self, cpu_sensor_ids, gpu_sensor_ids):
-        """Setter for CPU and GPU sensor id's."""
+        """Setter for CPU and GPU sensor id's, used from the next temperature poll."""
 
-        self.cpu_sensor_ids = cpu_sensor_ids
-        self.gpu_sensor_ids = gpu_sensor_ids
+        with self.sensor_lock:
+            self.cpu_sensor_ids = cpu_sensor_ids
+            self.gpu_sensor_ids = gpu_sensor_ids
 
-    def calculate_temp(self, temperature_sensors, type):
-        """Calculate CPU/GPU temperatures (maximum or average value)"""
+    def calculate_temps(self, sensor_values):
+        """Calculate CPU and GPU temperatures (maximum or average value) from the sensor values ({identifier: value}).
 
-        if type == "cpu":
-            cpu_temps = []
-
-            # Check if any sensors are configured
-            if self.cpu_sensor_ids:
-                for id in self.cpu_sensor_ids:
-                    for sensor in temperature_sensors:
-                        if id == sensor.Identifier:
-                            cpu_temps.append(sensor.Value)
-
-                # Convert to float
-                cpu_temps_float = [float(i) for i in cpu_temps]
-
-            else:
-                cpu_temps_float = [0]
-
-            # Check if temperature values are available
-            if cpu_temps_float:
-                # Use maximum value
-                if self.cpu_calc == "Max":
-                    return max(cpu_temps_float)
-                # Use average value
-                elif self.cpu_calc == "Avg":
-                    return (sum(cpu_temps_float) / len(cpu_temps_float))
-
-            # If no temperature values are available, return 0
-            else:
-                return 0
+        Returns:
+            - A tuple (CPU temperature, GPU temperature), 0 if no sensor values are available
+        """
+
+        with self.sensor_lock:
+            return self.calculate_temp(sensor_values, "cpu"), self.calculate_temp(sensor_values, "gpu")
+
+    def calculate_temp(self, sensor_values, type):
+        """Calculate CPU/GPU temperatures (maximum or average value) from the sensor values ({identifier: value})."""
 
+        if type == "cpu":
+            return telemetry.aggregate_temperature(sensor_values, self.cpu_sensor_ids, self.cpu_calc)
         elif type == "gpu":
-            gpu_temps = []
-
-            # Check if any sensors are configured
-            if self.gpu_sensor_ids:
-                for id in self.gpu_sensor_ids:
-                    for sensor in temperature_sensors:
-                        if id == sensor.Identifier:
-                            gpu_temps.append(sensor.Value)
-
-                # Convert to float
-                gpu_temps_float = [float(i) for i in gpu_temps]
-
-            else:
-                gpu_temps_float = [0]
-
-            # Check if temperature values are available
-            if gpu_temps_float:
-                # Use maximum value
-                if self.gpu_calc == "Max":
-                    return max(gpu_temps_float)
-                # Use average value
-                elif self.gpu_calc == "Avg":
-                    return (sum(gpu_temps_float) / len(gpu_temps_float))
-
-            # If no temperature values are available, return 0
-            else:
-                return 0
+            return telemetry.aggregate_temperature(sensor_values, self.gpu_sensor_ids, self.gpu_calc)
+
+    def emit_snapshot(self, **values):
+        """Emit a sample with "values" replacing the values of the last sample."""
+
+        with self.sample_lock:
+            sample = self.sample.copy() if self.sample is not None else telemetry.Sample()
+            for name, value in values.items():
+                setattr(sample, name, value)
+            sample.changed = sample.diff(self.sample)
+            self.sample = sample
+
+            self.history.append(time.monotonic(), sample.cpu_temp, sample.gpu_temp, sample.rpm, sample.voltage)
+            self.rollups.append(time.time(), sample.cpu_temp, sample.gpu_temp, sample.rpm, sample.voltage)
+            write_log = (self.data_log is not None and
+                         self.data_log.append(sample.cpu_temp, sample.gpu_temp, sample.rpm, sample.voltage))
+
+            # Emitted with the lock held, the samples of both stages are received in the order they were created
+            # Samples without any changed value are kept in the history, but not sent to the UI
+            if sample.changed:
+                self.snapshot_signal.emit(sample)
+
+        # The data log is written without the lock, so disk I/O does not delay the other stage
+        if write_log:
+            self.data_log.flush()
+
+    def poll_temperatures(self):
+        """Temperature stage:
+            - Poll the sensor sources for CPU and GPU temperatures
+            - Set the fan speeds, if automatic fan control is enabled
+            - Emit a sample with the temperatures and fan speeds
+        """
+
+        # Get current temperatures of the selected sensors from all sensor sources
+        with self.sensor_lock:
+            sensor_ids = self.cpu_sensor_ids + self.gpu_sensor_ids
+        sensor_values = self.sensor_sources.read(sensor_ids)
+
+        # A selected sensor is missing (e.g. hardware removed), the sensor names are discovered again when next needed
+        if any(id not in sensor_values for id in sensor_ids):
+            self.sensor_sources.catalog.invalidate()
+
+        # Calculate CPU and GPU temperatures, used unrounded for fan control (the UI shows whole degrees)
+        current_cpu_temp, current_gpu_temp = self.calculate_temps(sensor_values)
+        self.store.update("cpu_temp", current_cpu_temp)
+        self.store.update("gpu_temp", current_gpu_temp)
+
+        # Fan speeds are shown in the UI, None in manual mode
+        fans_speed = [None] * 6
+        breakpoints = ([], [])
+
+        with self.control_lock:
+            if self.control_config is not None:
+                breakpoints = (self.control_config.breakpoints(use_cpu=True),
+                               self.control_config.breakpoints(use_cpu=False))
+
+            if self.control_config is not None and self.control_config.automatic:
+                speeds = self.control_config.fan_speeds(current_cpu_temp, current_gpu_temp)
+                fans_speed = [speeds[fan] for fan in range(1, 7)]
+
+                # Set the fan voltages on all Grid units, writes that don't change the fan voltage are dropped
+                serialworker.set_fans(self.devices, {(device, fan): grid.calculate_voltage(speed)
+                                                     for device in range(len(self.devices))
+                                                     for fan, speed in speeds.items()})
+
+        # Adaptive polling is slowed down while temperatures are stable
+        if self.polling_interval is None:
+            if self.adaptive_rate.update_temperatures((current_cpu_temp, current_gpu_temp), breakpoints):
+                self.apply_polling_intervals(reset_statistics=False)
+
+        # If both CPU and GPU temp are 0, OpenHardwareMonitor is "Disconnected"
+        self.emit_snapshot(cpu_temp=current_cpu_temp, gpu_temp=current_gpu_temp,
+                           hwmon_connected=not current_cpu_temp == current_gpu_temp == 0, speed=fans_speed)
+
+    def poll_fans(self):
+        """Fan stage:
+            - Poll the Grid for fan rpm, and fan voltage if requested or written since the last read
+            - Emit a sample with the fan data and the polling statistics
+        """
+
+        # Voltages are read back after fan voltages have been written to any Grid unit
+        frames_sent = sum(device.coalescer.frames_sent for device in self.devices)
+        read_voltage = self.voltage_requested.is_set() or frames_sent != self.frames_sent
+        if read_voltage:
+            self.voltage_requested.clear()
+            self.frames_sent = frames_sent
+
+        # Read rpm (and voltage) for all fans on all Grid units, concurrently by the serial workers
+        snapshot = serialworker.read_all_telemetry(self.devices, read_voltage)
+        self.store.update("rpm", {key: rpm for key, (rpm, voltage) in snapshot.items()})
+
+        # Adaptive polling is fast while fan rpm is changing
+        if self.polling_interval is None:
+            if self.adaptive_rate.update_rpm([snapshot[key][0] for key in sorted(snapshot)]):
+                self.apply_polling_intervals(reset_statistics=False)
+        if read_voltage:
+            self.store.update("voltage", {key: voltage for key, (rpm, voltage) in snapshot.items()})
+
+        # Voltages not read in this poll are the last values read
+        fans_voltage = self.store.get("voltage", {})
+        snapshot = {key: (rpm, fans_voltage.get(key)) for key, (rpm, voltage) in snapshot.items()}
+
+        # The fans of the first Grid unit are shown in the UI, a fan is running if rpm and voltage are not 0
+        fans_rpm = [snapshot[(0, fan)][0] for fan in range(1, 7)]
+        fans_voltage = [snapshot[(0, fan)][1] for fan in range(1, 7)]
+
+        self.emit_snapshot(rpm=fans_rpm, voltage=fans_voltage,
+                           status=[bool(rpm and voltage) for rpm, voltage in zip(fans_rpm, fans_voltage)],
+                           telemetry=snapshot, statistics=self.fan_scheduler.statistics())
+
+    def run_fan_stage(self):
+        """Fan stage processing loop, runs in its own thread until the polling thread is stopped."""
+
+        try:
+            # The first poll starts now, the following polls every polling interval
+            self.fan_scheduler.start()
+
+            while self.keep_running:
+                self.poll_fans()
+
+                # Sleep until the next poll is due, the time spent polling is not added to the polling interval
+                self.fan_scheduler.wait()
+
+        # Stop polling at a failed Grid command, the serial worker has already reported it
+        except grid.GridError as e:
+            self.keep_running = False
+            print("Fan polling stopped at Grid error")
+
+            self.exception_signal.emit(str(e))
+
+        # Stop polling and report the exception, see run()
+        except Exception:
+            self.keep_running = False
+            print("Fan polling stopped at exception")
+
+            (type, value, traceback) = sys.exc_info()
+            self.exception_signal.emit(helper.exception_message_qthread(type, value, traceback))
 
     def run(self):
         """Main thread processing loop:
-            - Poll the Grid for fan rpm and voltage.
-            - Poll OpenHardwareMonitor for CPU and GPU temperatures
-            - Emit signals:
-                - Fan rpm's
-                - Fan voltages
-                - CPU temperature
-                - GPU temperature
-                - Update fans
+            - Start the fan stage in a separate thread, see poll_fans()
+            - Run the temperature stage, see poll_temperatures()
         """
 
         try:
             print("Starting thread...")
 
-            # CoInitialise() is needed when accessing WMI in a thread
-            # CoUninitialize() is called in the stop method
-            pythoncom.CoInitialize()
-
-            # A new WMI object is needed in the thread
-            hwmon_thread_wmi = wmi.WMI(namespace="root\OpenHardwareMonitor")
-
             # "keep_running" should be True before starting the while loop
             self.keep_running = True
 
-            # Start the main polling loop
-            while self.keep_running:
-                # Get current temperature sensors from OpenHardwareMonitor
-                temperature_sensors = openhwmon.get_temperature_sensors(hwmon_thread_wmi)
-
-                # Calculate CPU and GPU temperatures
-                current_cpu_temp = self.calculate_temp(temperature_sensors, "cpu")
-                current_gpu_temp = self.calculate_temp(temperature_sensors, "gpu")
-
-                # Emit temperature signals
-                self.cpu_temp_signal.emit(current_cpu_temp)
-                self.gpu_temp_signal.emit(current_gpu_temp)
-
-                # If both CPU and GPU temp are 0, set OpenHardwareMonitor status to "Disconnected"
-                if current_cpu_temp == current_gpu_temp == 0:
-                    self.hwmon_status_signal.emit('<b><font color="red">---</font></b>')
-                else:
-                    self.hwmon_status_signal.emit('<b><font color="green">Connected</font></b>')
-
-                # Read rpm for all fans
-                fans_rpm = grid.read_fan_rpm(self.ser, self.lock)
-
-                # Check if there is fan rpm data available
-                if fans_rpm:
-                    # Emit rpm signals with current rpm values
-                    self.rpm_signal_fan1.emit(str(fans_rpm[0]))
-                    self.rpm_signal_fan2.emit(str(fans_rpm[1]))
-                    self.rpm_signal_fan3.emit(str(fans_rpm[2]))
-                    self.rpm_signal_fan4.emit(str(fans_rpm[3]))
-                    self.rpm_signal_fan5.emit(str(fans_rpm[4]))
-                    self.rpm_signal_fan6.emit(str(fans_rpm[5]))
-
-                # If no rpm data is available, emit "---" as value
-                else:
-                    self.rpm_signal_fan1.emit('<b><font color="red">---</font></b>')
-                    self.rpm_signal_fan2.emit('<b><font color="red">---</font></b>')
-                    self.rpm_signal_fan3.emit('<b><font color="red">---</font></b>')
-                    self.rpm_signal_fan4.emit('<b><font color="red">---</font></b>')
-                    self.rpm_signal_fan5.emit('<b><font color="red">---</font></b>')
-                    self.rpm_signal_fan6.emit('<b><font color="red">---</font></b>')
-
-                # Read voltage for all fans
-                fans_voltage = grid.read_fan_voltage(self.ser, self.lock)
-
-                # Check if there is fan voltages data available
-                if fans_voltage:
-                    # Emit voltage signals with current voltages
-                    self.voltage_signal_fan1.emit(str(fans_voltage[0]))
-                    self.voltage_signal_fan2.emit(str(fans_voltage[1]))
-                    self.voltage_signal_fan3.emit(str(fans_voltage[2]))
-                    self.voltage_signal_fan4.emit(str(fans_voltage[3]))
-                    self.voltage_signal_fan5.emit(str(fans_voltage[4]))
-                    self.voltage_signal_fan6.emit(str(fans_voltage[5]))
-
-                # If no voltage data is available, emit "---" as value
-                else:
-                    self.voltage_signal_fan1.emit('<b><font color="red">---</font></b>')
-                    self.voltage_signal_fan2.emit('<b><font color="red">---</font></b>')
-                    self.voltage_signal_fan3.emit('<b><font color="red">---</font></b>')
-                    self.voltage_signal_fan4.emit('<b><font color="red">---</font></b>')
-                    self.voltage_signal_fan5.emit('<b><font color="red">---</font></b>')
-                    self.voltage_signal_fan6.emit('<b><font color="red">---</font></b>')
-
-                # Update status icons
-                # Check if rpm and voltage data is available
-                if fans_rpm and fans_voltage:
-                    # Emit pixmap icon signal (red icon if fan rpm or voltage is 0, otherwise green icon)
-                    self.pixmap_signal_fan1.emit(ICON_RED_LED if fans_rpm[0] == 0 or fans_voltage[0] == 0 else ICON_GREEN_LED)
-                    self.pixmap_signal_fan2.emit(ICON_RED_LED if fans_rpm[1] == 0 or fans_voltage[1] == 0 else ICON_GREEN_LED)
-                    self.pixmap_signal_fan3.emit(ICON_RED_LED if fans_rpm[2] == 0 or fans_voltage[2] == 0 else ICON_GREEN_LED)
-                    self.pixmap_signal_fan4.emit(ICON_RED_LED if fans_rpm[3] == 0 or fans_voltage[3] == 0 else ICON_GREEN_LED)
-                    self.pixmap_signal_fan5.emit(ICON_RED_LED if fans_rpm[4] == 0 or fans_voltage[4] == 0 else ICON_GREEN_LED)
-                    self.pixmap_signal_fan6.emit(ICON_RED_LED if fans_rpm[5] == 0 or fans_voltage[5] == 0 else ICON_GREEN_LED)
-
-                # If no fan rpm or voltage data is available, show the red status icon
-                else:
-                    self.pixmap_signal_fan1.emit(ICON_RED_LED)
-                    self.pixmap_signal_fan2.emit(ICON_RED_LED)
-                    self.pixmap_signal_fan3.emit(ICON_RED_LED)
-                    self.pixmap_signal_fan4.emit(ICON_RED_LED)
-                    self.pixmap_signal_fan5.emit(ICON_RED_LED)
-                    self.pixmap_signal_fan6.emit(ICON_RED_LED)
-
-                # Emit update signal
-                self.update_signal.emit()
-
-                #print("End of polling loop, sleeping for " + str(self.polling_interval) + " ms")
-
-                # Sleep for the set polling interval (ms)
-                time.sleep(self.polling_interval/1000)
+            # Values from a previous run are outdated, voltages are read at the first fan poll
+            # All values are changed in the first sample
+            self.store.clear()
+            self.sample = None
+            self.voltage_requested.set()
+
+            # The fan stage is clocked independently of the temperature stage
+            fan_stage = threading.Thread(target=self.run_fan_stage, daemon=True)
+            fan_stage.start()
+
+            try:
+                # The first poll starts now, the following polls every temperature polling interval
+                self.temperature_scheduler.start()
+
+                # Start the main polling loop
+                while self.keep_running:
+                    self.poll_temperatures()
+
+                    # Sleep until the next poll is due
+                    self.temperature_scheduler.wait()
+
+            finally:
+                # Stop the fan stage (if not already stopped) and wait for the poll in progress
+                self.keep_running = False
+                fan_stage.join()
+
+                # Write the samples still buffered by the data log
+                if self.data_log is not None:
+                    self.data_log.flush()
 
         # Emits a signal if an exception occurs in the running thread
         # The main application will then show an error message about the problem
         # This is needed because a new message box widget cannot be created/displayed in the thread
-        except Exception as e:
+        except Exception:
             # Stop the thread
             self.stop()
             print("Thread stopped at exception")
@@ -0,0 +1,165 @@
+"""
+    protocol.py
+    -----------
+    Implements an incremental parser for responses from the Grid.
+    Responses are decoded from a receive buffer as they arrive, and the parser resynchronizes on the next valid
+    frame header after corrupt or stray bytes, so a transmission error only costs the affected response.
+    Transmission errors are assumed to be lost bytes: a frame that lost bytes is recorded as corrupt,
+    so the following responses keep their positions.
+"""
+
+# Data responses are five bytes, "C0 00 00 <high byte> <low byte>"
+HEADER = b"\xC0\x00\x00"
+FRAME_SIZE = 5
+
+# Single byte responses to "initialize" and "set fan voltage" requests
+RESPONSE_INIT = 0x21
+RESPONSE_ACK = 0x01
+
+
+class ResponseParser:
+    """Parses the responses to a sequence of pipelined requests.
+
+    Usage:
+        - Register the expected responses, in request order, with expect_frames() and expect_byte()
+        - Add received data with feed(), decoded responses are available in "results" as they become complete
+        - Call finish() when no more data will arrive, responses still missing are reported as errors
+
+    Results are (high byte, low byte) tuples for data frames, the received byte for single byte responses,
+    and None for responses that were missing or corrupt. "errors" holds a message for each problem found.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+
+        # Expected responses, "None" for a data frame or the expected value of a single byte response
+        self.expected = []
+
+        self.results = []
+        self.errors = []
+
+    def expect_frames(self, count):
+        """Expect "count" five byte data frames."""
+
+        self.expected.extend([None] * count)
+
+    def expect_byte(self, value, count=1):
+        """Expect "count" single byte responses with "value"."""
+
+        self.expected.extend([value] * count)
+
+    def bytes_needed(self):
+        """Return the number of bytes still needed to complete all expected responses."""
+
+        needed = -(len(self.buffer) - self.position)
+        for expected in self.expected[len(self.results):]:
+            needed += FRAME_SIZE if expected is None else 1
+        return max(0, needed)
+
+    def feed(self, data):
+        """Add received data to the buffer and decode all complete responses."""
+
+        self.buffer += data
+        self._parse(final=False)
+
+    def finish(self):
+        """Decode remaining data, all expected responses not received are reported as missing.
+
+        Returns:
+            - The list of results, one per expected response
+        """
+
+        self._parse(final=True)
+
+        while len(self.results) < len(self.expected):
+            self.errors.append("Response " + str(len(self.results) + 1) + " missing")
+            self.results.append(None)
+
+        return self.results
+
+    def _parse(self, final):
+        """State machine decoding responses from the current position of the buffer."""
+
+        view = memoryview(self.buffer)
+
+        try:
+            while len(self.results) < len(self.expected):
+                expected = self.expected[len(self.results)]
+                available = len(self.buffer) - self.position
+
+                # Single byte response
+                if expected is not None:
+                    if available < 1:
+                        break
+                    value = view[self.position]
+                    if value != expected:
+                        self.errors.append("Response " + str(len(self.results) + 1) + ": expected " + hex(expected) +
+                                           ", got " + hex(value))
+                        value = None
+                    self.results.append(value)
+                    self.position += 1
+                    continue
+
+                # Data frame, wait for the complete frame
+                if available < FRAME_SIZE and not final:
+                    break
+
+                # The frame ends at the next header, or at the end of the data for the last frame
+                more_frames = self._more_frames_expected()
+                end = self.buffer.find(HEADER, self.position + 1)
+                if end == -1:
+                    if more_frames and not final:
+                        # Wait for the next header, the last bytes may be the start of a header
+                        break
+                    end = len(self.buffer)
+
+                length = end - self.position
+                if view[self.position:self.position + 3] == HEADER and self._frame_complete(length, more_frames):
+                    self.results.append((view[self.position + 3], view[self.position + 4]))
+                    self.position += FRAME_SIZE
+                    continue
+
+                if not length:
+                    break
+
+                # Stray bytes before the first response (e.g. a late response to an earlier request) are skipped,
+                # unless they start like a frame or are one byte short of a frame (a frame that lost a header byte)
+                if (not self.results and length < FRAME_SIZE - 1 and view[self.position] != HEADER[0] and
+                        end < len(self.buffer)):
+                    self.errors.append("Skipped " + str(length) + " stray byte(s)")
+                    self.position = end
+                    continue
+
+                # Frames that lost bytes, the data up to the next header holds one or more frames
+                # All of them are recorded as corrupt, so the following responses keep their positions
+                lost = min(-(-length // FRAME_SIZE), len(self.expected) - len(self.results))
+                for _ in range(lost):
+                    self.errors.append("Response " + str(len(self.results) + 1) + ": corrupt frame")
+                    self.results.append(None)
+                self.position = end
+
+        finally:
+            view.release()
+
+    def _frame_complete(self, length, more_frames):
+        """Return True if the frame at the current position (starting with a header) is complete.
+
+        "length" is the number of bytes up to the next header. A frame followed by more frames is complete if
+        the next header follows right after it, or the bytes after it are a header that lost one byte
+        ("00 00" or "C0 00"). Otherwise a byte of the frame is lost, and the frame would be decoded with a byte
+        of the following frame.
+        """
+
+        if length == FRAME_SIZE or (not more_frames and length >= FRAME_SIZE):
+            return True
+
+        following = self.position + FRAME_SIZE
+        return (length > FRAME_SIZE and
+                self.buffer[following:following + 2] in (HEADER[1:], HEADER[:2]))
+
+    def _more_frames_expected(self):
+        """Return True if the current response is followed by another expected data frame."""
+
+        following = len(self.results) + 1
+        return following < len(self.expected) and self.expected[following] is None
@@ -0,0 +1,255 @@
+"""
+    rollup.py
+    ---------
+    Implements multi-resolution rollups of the polled values for long-term history.
+
+    The minimum, maximum, mean and number of values of each column (temperatures, fan rpm and voltage)
+    are kept per time bucket at several resolutions (10 s, 1 min, 1 h and 1 day).
+    Each sample updates the current bucket of the finest resolution only, a finished bucket is merged
+    into the current bucket of the next coarser resolution, so the cost per sample is constant.
+    Buckets are aligned to the clock (time.time()), e.g. 1 h buckets start at the full hour, 1 day buckets at midnight UTC.
+"""
+
+import array
+import math
+import threading
+
+import history
+
+# Resolutions (s), finest first, each a multiple of the previous one, and number of buckets kept of each
+RESOLUTIONS = ((10, 8640),          # 1 day
+               (60, 10080),         # 1 week
+               (3600, 2160),        # 90 days
+               (86400, 1830))       # 5 years
+
+# Columns, as in history.COLUMNS (without "time")
+COLUMNS = history.COLUMNS[1:]
+
+
+class Bucket:
+    """Statistics of the values of each column in one time bucket."""
+
+    __slots__ = ("start", "minimum", "maximum", "total", "count")
+
+    def __init__(self, start):
+        """Constructor for an empty bucket starting at "start"."""
+
+        self.start = start
+        self.minimum = [math.inf] * len(COLUMNS)
+        self.maximum = [-math.inf] * len(COLUMNS)
+        self.total = [0.0] * len(COLUMNS)
+        self.count = [0] * len(COLUMNS)
+
+    def add(self, values):
+        """Add the values of a sample (one per column, None for missing values)."""
+
+        for column, value in enumerate(values):
+            if value is not None:
+                if value < self.minimum[column]:
+                    self.minimum[column] = value
+                if value > self.maximum[column]:
+                    self.maximum[column] = value
+                self.total[column] += value
+                self.count[column] += 1
+
+    def merge(self, bucket):
+        """Add the values of a finer bucket."""
+
+        for column in range(len(COLUMNS)):
+            if bucket.count[column]:
+                self.minimum[column] = min(self.minimum[column], bucket.minimum[column])
+                self.maximum[column] = max(self.maximum[column], bucket.maximum[column])
+                self.total[column] += bucket.total[column]
+                self.count[column] += bucket.count[column]
+
+    def statistics(self, column):
+        """Return (start, minimum, maximum, mean, count) of a column, None for minimum/maximum/mean without values."""
+
+        count = self.count[column]
+        if not count:
+            return self.start, None, None, None, 0
+        return self.start, self.minimum[column], self.maximum[column], self.total[column] / count, count
+
+
+class RollupLevel:
+    """Finished buckets of one resolution in a ring buffer, and the current bucket."""
+
+    def __init__(self, resolution, capacity, parent=None):
+        """Constructor for a level, finished buckets are merged into "parent" (the next coarser level)."""
+
+        self.resolution = resolution
+        self.capacity = capacity
+        self.parent = parent
+
+        # Ring buffer, start time of each bucket and statistics of each column
+        self.starts = array.array("d", [0.0]) * capacity
+        self.minimum = [array.array("f", [0.0]) * capacity for _ in COLUMNS]
+        self.maximum = [array.array("f", [0.0]) * capacity for _ in COLUMNS]
+        self.mean = [array.array("f", [0.0]) * capacity for _ in COLUMNS]
+        self.counts = [array.array("I", [0]) * capacity for _ in COLUMNS]
+        self.position = 0
+        self.count = 0
+
+        self.current = None
+
+    def bucket_start(self, timestamp):
+        """Return the start of the bucket holding "timestamp"."""
+
+        return timestamp - timestamp % self.resolution
+
+    def add(self, timestamp, values):
+        """Add the values of a sample taken at "timestamp"."""
+
+        start = self.bucket_start(timestamp)
+        if self.current is None or self.current.start != start:
+            self.close()
+            self.current = Bucket(start)
+        self.current.add(values)
+
+    def merge(self, bucket):
+        """Add a finished bucket of a finer level."""
+
+        start = self.bucket_start(bucket.start)
+        if self.current is None or self.current.start != start:
+            self.close()
+            self.current = Bucket(start)
+        self.current.merge(bucket)
+
+    def close(self):
+        """Store the current bucket, and merge it into the parent level."""
+
+        bucket = self.current
+        if bucket is None:
+            return
+
+        position = self.position
+        self.starts[position] = bucket.start
+        for column in range(len(COLUMNS)):
+            count = bucket.count[column]
+            self.counts[column][position] = count
+            if count:
+                self.minimum[column][position] = bucket.minimum[column]
+                self.maximum[column][position] = bucket.maximum[column]
+                self.mean[column][position] = bucket.total[column] / count
+
+        self.position = (position + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self.current = None
+
+        if self.parent is not None:
+            self.parent.merge(bucket)
+
+    def oldest(self):
+        """Return the start of the oldest bucket kept (including the current bucket), None if there is none."""
+
+        if self.count:
+            return self.starts[(self.position - self.count) % self.capacity]
+        return self.current.start if self.current is not None else None
+
+    def stored(self, column, start, end):
+        """Return the statistics of the finished buckets starting from "start" to "end", oldest first."""
+
+        oldest = self.position - self.count
+
+        # Binary search for the first bucket at or after "start", on the bucket order (oldest first)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.starts[(oldest + middle) % self.capacity] < start:
+                low = middle + 1
+            else:
+                high = middle
+
+        buckets = []
+        for index in range(low, self.count):
+            position = (oldest + index) % self.capacity
+            bucket_start = self.starts[position]
+            if bucket_start > end:
+                break
+
+            count = self.counts[column][position]
+            if count:
+                buckets.append((bucket_start, self.minimum[column][position], self.maximum[column][position],
+                                self.mean[column][position], count))
+            else:
+                buckets.append((bucket_start, None, None, None, 0))
+        return buckets
+
+
+class Rollups:
+    """Rollups of the polled values at all RESOLUTIONS."""
+
+    def __init__(self, resolutions=RESOLUTIONS):
+        """Constructor for the rollups."""
+
+        # Levels, finest first, each one merging its finished buckets into the next one
+        self.levels = []
+        parent = None
+        for resolution, capacity in reversed(resolutions):
+            parent = RollupLevel(resolution, capacity, parent)
+            self.levels.insert(0, parent)
+
+        # Timestamps are kept in increasing order, a sample taken after the clock has been set back
+        # gets the timestamp of the previous sample
+        self.last_timestamp = 0.0
+
+        # Samples are appended by the polling thread, queries come from the UI
+        self.lock = threading.Lock()
+
+    def append(self, timestamp, cpu_temp, gpu_temp, fans_rpm, fans_voltage):
+        """Add a sample taken at "timestamp" (time.time()), "fans_rpm" and "fans_voltage" are lists for fans 1 - 6,
+        None for missing values."""
+
+        with self.lock:
+            timestamp = max(timestamp, self.last_timestamp)
+            self.last_timestamp = timestamp
+
+            self.levels[0].add(timestamp, (cpu_temp, gpu_temp, *fans_rpm, *fans_voltage))
+
+    def select_level(self, start, end, points):
+        """Return the coarsest level with at least "points" buckets from "start" to "end", the finest level if none.
+
+        A coarser level is returned if buckets of that level from the range have already been overwritten,
+        so the whole range is covered when possible. A level that has not wrapped around holds all samples
+        since the rollups were created, coarser levels hold no older samples.
+        """
+
+        selected = 0
+        for index, level in enumerate(self.levels):
+            if (end - start) / level.resolution >= points:
+                selected = index
+
+        for level in self.levels[selected:]:
+            if level.count < level.capacity or level.oldest() <= start:
+                return level
+        return self.levels[-1]
+
+    def query(self, name, start, end, points):
+        """Return the statistics of a column from "start" to "end" (time.time()), with at least "points" buckets
+        if the finest resolution allows it.
+
+        Returns:
+            - A tuple (resolution (s), list of (bucket start, minimum, maximum, mean, count)), oldest first,
+              None for minimum/maximum/mean of buckets without values
+        """
+
+        column = COLUMNS.index(name)
+
+        with self.lock:
+            level = self.select_level(start, end, points)
+            buckets = level.stored(column, level.bucket_start(start), end)
+
+            # The current buckets of this level and of the finer levels are not stored yet,
+            # the finer ones may already belong to a following bucket of this level
+            current = []
+            for finer in reversed(self.levels[:self.levels.index(level) + 1]):
+                if finer.current is not None:
+                    bucket_start = level.bucket_start(finer.current.start)
+                    if not current or current[-1].start != bucket_start:
+                        current.append(Bucket(bucket_start))
+                    current[-1].merge(finer.current)
+
+            buckets.extend(bucket.statistics(column) for bucket in current
+                           if level.bucket_start(start) <= bucket.start <= end)
+
+            return level.resolution, buckets
@@ -0,0 +1,288 @@
+"""
+    scheduler.py
+    ------------
+    Implements a drift-free periodic scheduler for the polling loop.
+    Polls start at absolute deadlines (time.monotonic()), so the time spent polling does not add to the period.
+    A poll that takes longer than the period is an overrun, handled according to the selected policy.
+    The wait for the next poll is interrupted at once when the scheduler is stopped or the period is changed.
+
+    Also implements the adaptive polling rate, polling slower while temperatures and fan rpm are stable.
+"""
+
+import math
+import threading
+import time
+
+# Overrun policies
+# "skip":     Drop the missed polls, the next poll starts at the next deadline on the original schedule
+# "catch-up": Start the missed polls immediately, one after the other, to keep the average polling rate
+# "stretch":  Start the next poll immediately and restart the schedule from there
+POLICY_SKIP = "skip"
+POLICY_CATCH_UP = "catch-up"
+POLICY_STRETCH = "stretch"
+POLICIES = (POLICY_SKIP, POLICY_CATCH_UP, POLICY_STRETCH)
+
+# Maximum number of missed polls started back to back with the "catch-up" policy, older polls are dropped
+MAX_CATCH_UP = 3
+
+# Adaptive polling, the polling intervals are multiplied by a factor from 1 (fastest) to ADAPTIVE_MAX_FACTOR
+# The factor grows by ADAPTIVE_GROWTH for each temperature poll while stable, and is reset to 1 for a change
+ADAPTIVE_MAX_FACTOR = 4
+ADAPTIVE_GROWTH = 1.25
+
+# Temperature slope (degrees/s) starting fast polling, measured over at least ADAPTIVE_SLOPE_WINDOW (s)
+# so that a change of one degree (the resolution of the temperatures) between two fast polls is not a slope
+ADAPTIVE_SLOPE_THRESHOLD = 1.0
+ADAPTIVE_SLOPE_WINDOW = 2.0
+
+# Distance (degrees) to a fan curve breakpoint starting fast polling, when a temperature comes this close
+ADAPTIVE_BREAKPOINT_MARGIN = 2
+
+# Change of fan rpm starting fast polling, relative (e.g. 0.05 = 5 %) but at least ADAPTIVE_RPM_MIN_CHANGE
+ADAPTIVE_RPM_THRESHOLD = 0.05
+ADAPTIVE_RPM_MIN_CHANGE = 50
+
+
+class DeadlineScheduler:
+    """Schedules polls at a fixed period and measures the achieved period and jitter.
+
+    Usage:
+        - Call start() before the first poll
+        - Call wait() after each poll, it returns when the next poll should start
+        - Call stop() from another thread to end the wait at once
+
+    Jitter is the delay of the actual poll start after its deadline.
+    """
+
+    def __init__(self, period, policy=POLICY_SKIP):
+        """Constructor for the scheduler, "period" is in seconds."""
+
+        if policy not in POLICIES:
+            raise ValueError("Unknown overrun policy: " + str(policy))
+
+        self.period = period
+        self.policy = policy
+
+        self.deadline = None
+        self.reset_statistics()
+
+        # Set to interrupt wait(), when stopped or when the period is changed
+        self.wakeup = threading.Event()
+        self.stopped = False
+
+    def reset_statistics(self):
+        """Clear the period and jitter statistics."""
+
+        self.last_start = None
+        self.polls = 0
+        self.period_sum = 0.0
+        self.period_square_sum = 0.0
+        self.jitter_sum = 0.0
+        self.jitter_max = 0.0
+        self.overruns = 0
+        self.skipped = 0
+
+    def set_period(self, period, reset_statistics=True):
+        """Change the period (s), the next poll is due one new period after the start of the last poll."""
+
+        self.period = period
+        if reset_statistics:
+            self.reset_statistics()
+        self.wakeup.set()
+
+    def start(self):
+        """Start the schedule, the first deadline is now."""
+
+        self.stopped = False
+        self.wakeup.clear()
+
+        self.reset_statistics()
+        self.deadline = time.monotonic()
+        self._record(self.deadline)
+
+    def stop(self):
+        """Stop the schedule, a wait() in progress returns at once."""
+
+        self.stopped = True
+        self.wakeup.set()
+
+    def wait(self):
+        """Sleep until the deadline of the next poll.
+
+        Returns:
+            - True when the next poll should start
+            - False if the scheduler has been stopped
+        """
+
+        now = time.monotonic()
+        deadline = self.deadline + self.period
+
+        # Overrun, the deadline has already passed
+        if now > deadline:
+            self.overruns += 1
+            missed = int(math.floor((now - self.deadline) / self.period))
+
+            if self.policy == POLICY_SKIP:
+                # Next deadline on the original schedule
+                deadline = self.deadline + (missed + 1) * self.period
+                self.skipped += missed
+
+            elif self.policy == POLICY_CATCH_UP:
+                # Polls more than MAX_CATCH_UP periods late are dropped
+                if missed > MAX_CATCH_UP:
+                    deadline = self.deadline + (missed - MAX_CATCH_UP) * self.period
+                    self.skipped += missed - MAX_CATCH_UP
+
+            else:
+                deadline = now
+
+        while not self.stopped and now < deadline:
+            # Timeout, the deadline has been reached
+            if not self.wakeup.wait(deadline - now):
+                break
+            self.wakeup.clear()
+
+            # The period has been changed, the deadline is recalculated from the last deadline
+            now = time.monotonic()
+            deadline = max(now, self.deadline + self.period)
+
+        if self.stopped:
+            return False
+
+        self.deadline = deadline
+        self._record(time.monotonic())
+        return True
+
+    def _record(self, start):
+        """Update the statistics with the actual start time of a poll."""
+
+        if self.last_start is not None:
+            period = start - self.last_start
+            self.polls += 1
+            self.period_sum += period
+            self.period_square_sum += period * period
+
+            jitter = max(0.0, start - self.deadline)
+            self.jitter_sum += jitter
+            self.jitter_max = max(self.jitter_max, jitter)
+
+        self.last_start = start
+
+    def statistics(self):
+        """Return the achieved polling statistics since start() or the last period change.
+
+        Returns:
+            - A dictionary with "period" (mean period), "period_stdev", "jitter" (mean), "jitter_max" (all in s),
+              "polls", "overruns" and "skipped" (missed polls dropped), None for values not yet available
+        """
+
+        period = period_stdev = jitter = None
+        if self.polls:
+            period = self.period_sum / self.polls
+            period_stdev = math.sqrt(max(0.0, self.period_square_sum / self.polls - period * period))
+            jitter = self.jitter_sum / self.polls
+
+        return {"period": period,
+                "period_stdev": period_stdev,
+                "jitter": jitter,
+                "jitter_max": self.jitter_max,
+                "polls": self.polls,
+                "overruns": self.overruns,
+                "skipped": self.skipped}
+
+
+class AdaptiveRate:
+    """Calculates the factor for the polling intervals from the polled temperatures and fan rpm.
+
+    Polling is fast (factor 1) when:
+        - A temperature changes faster than ADAPTIVE_SLOPE_THRESHOLD
+        - A temperature comes within ADAPTIVE_BREAKPOINT_MARGIN of a fan curve breakpoint
+        - A fan rpm changes more than ADAPTIVE_RPM_THRESHOLD (e.g. a fan is still settling after a voltage change)
+    Otherwise the factor grows with each temperature poll, up to ADAPTIVE_MAX_FACTOR.
+    """
+
+    def __init__(self):
+        """Constructor for the adaptive rate, starting at the fastest rate."""
+
+        # Temperature and rpm updates come from different threads
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Return to the fastest rate, e.g. after the fan control settings have changed."""
+
+        with self.lock:
+            self.factor = 1.0
+
+            # Temperatures at the start of the slope measurement, and time (time.monotonic()) of the measurement
+            self.reference_temperatures = None
+            self.reference_time = None
+
+            # Temperatures and fan rpm at the last poll
+            self.temperatures = None
+            self.rpm = None
+
+    def update_temperatures(self, temperatures, breakpoints):
+        """Update the factor with new temperatures.
+
+        "temperatures" is a sequence of temperatures (e.g. CPU and GPU), "breakpoints" holds a sequence of
+        fan curve breakpoint temperatures for each temperature.
+
+        Returns:
+            - True if the factor has changed
+        """
+
+        now = time.monotonic()
+
+        with self.lock:
+            changed = False
+
+            if self.temperatures is not None:
+                elapsed = max(now - self.reference_time, ADAPTIVE_SLOPE_WINDOW)
+
+                for temperature, previous, reference, points in zip(temperatures, self.temperatures,
+                                                                    self.reference_temperatures, breakpoints):
+                    if abs(temperature - reference) / elapsed >= ADAPTIVE_SLOPE_THRESHOLD:
+                        changed = True
+
+                    # The temperature has come close to a breakpoint, where the fan speed changes more
+                    for point in points:
+                        if abs(temperature - point) <= ADAPTIVE_BREAKPOINT_MARGIN < abs(previous - point):
+                            changed = True
+
+            # Start a new slope measurement after each slope window
+            if self.reference_time is None or now - self.reference_time >= ADAPTIVE_SLOPE_WINDOW:
+                self.reference_temperatures = list(temperatures)
+                self.reference_time = now
+
+            self.temperatures = list(temperatures)
+            return self._update_factor(changed, grow=True)
+
+    def update_rpm(self, fans_rpm):
+        """Update the factor with new fan rpm (a sequence, None for rpm not available).
+
+        Returns:
+            - True if the factor has changed
+        """
+
+        with self.lock:
+            changed = False
+
+            if self.rpm is not None:
+                for rpm, previous in zip(fans_rpm, self.rpm):
+                    if rpm is not None and previous is not None:
+                        if abs(rpm - previous) > max(ADAPTIVE_RPM_THRESHOLD * previous, ADAPTIVE_RPM_MIN_CHANGE):
+                            changed = True
+
+            self.rpm = list(fans_rpm)
+            return self._update_factor(changed, grow=False)
+
+    def _update_factor(self, changed, grow):
+        """Reset the factor for a change, otherwise grow it if "grow" is True. The lock must be held."""
+
+        previous = self.factor
+        if changed:
+            self.factor = 1.0
+        elif grow:
+            self.factor = min(ADAPTIVE_MAX_FACTOR, self.factor * ADAPTIVE_GROWTH)
+        return self.factor != previous
@@ -0,0 +1,453 @@
+"""
+    sensors.py
+    ----------
+    Implements the temperature sensor sources and the registry of source types.
+
+    A sensor source (e.g. OpenHardwareMonitor over WMI, or the Linux hwmon sysfs interface) discovers its sensors
+    and reads their values as a plain dictionary {identifier: temperature}. Backend objects (e.g. WMI COM objects)
+    never leave the source.
+
+    Several sources are read in parallel in each poll, each source in its own worker thread
+    (WMI objects can only be used in the thread that created them).
+"""
+
+import concurrent.futures
+import importlib
+import os
+import stat
+import sys
+import threading
+import time
+
+# Source types by name, see register()
+SOURCES = {}
+
+# Modules registering the built-in source types, imported when the source type is first used,
+# so optional dependencies (e.g. "wmi") are only needed for the sources in use
+BUILTIN_SOURCES = {"openhardwaremonitor": "openhwmon",
+                   "hwmon": "linuxhwmon"}
+
+# Sources used when none are configured
+DEFAULT_SOURCES = ["hwmon"] if sys.platform.startswith("linux") else ["openhardwaremonitor"]
+
+# Time (s) after which the sensor catalog is discovered again at the next lookup
+CATALOG_TTL = 300
+
+
+class SourceError(Exception):
+    """A sensor source is not available, e.g. OpenHardwareMonitor is not installed."""
+
+
+class HardwareInfo:
+    """Hardware node, "parent" is the identifier of the parent node, "" for a top node."""
+
+    __slots__ = ("identifier", "name", "parent")
+
+    def __init__(self, identifier, name, parent=""):
+        self.identifier = identifier
+        self.name = name
+        self.parent = parent
+
+
+class SensorInfo:
+    """Sensor, "parent" is the identifier of its hardware node, "type" the sensor type (e.g. "Temperature")."""
+
+    __slots__ = ("identifier", "name", "parent", "type")
+
+    def __init__(self, identifier, name, parent, type="Temperature"):
+        self.identifier = identifier
+        self.name = name
+        self.parent = parent
+        self.type = type
+
+
+class SensorSource:
+    """Base class of the sensor sources.
+
+    All methods of a source are called from the same thread, open() first and close() last.
+    """
+
+    # Description of the argument of the source ("name:argument"), None if the argument is optional
+    required_argument = None
+
+    def open(self):
+        """Connect to the backend.
+
+        Raises:
+            - SourceError if the backend is not available
+        """
+
+    def close(self):
+        """Disconnect from the backend."""
+
+    def discover(self):
+        """Find the available temperature sensors, returns the number of sensors found."""
+
+        return 0
+
+    def metadata(self):
+        """Return the hardware nodes and sensors found by the last discover(), as a tuple of two lists
+        (HardwareInfo, SensorInfo)."""
+
+        return [], []
+
+    def read_batch(self, identifiers=None):
+        """Return the current values of the sensors, as a dictionary {identifier: temperature (float)}.
+
+        "identifiers" is a list of the sensors needed, None for all sensors. Sources may return other sensors too.
+        """
+
+        return {}
+
+
+def register(name):
+    """Class decorator registering a sensor source type under "name"."""
+
+    def decorator(cls):
+        SOURCES[name] = cls
+        return cls
+
+    return decorator
+
+def create_source(spec):
+    """Create a sensor source from a specification "name" or "name:argument" (e.g. "file:/run/temperatures").
+
+    Raises:
+        - SourceError for an unknown source type, or a missing or invalid argument
+    """
+
+    name, _, argument = spec.partition(":")
+
+    if name not in SOURCES and name in BUILTIN_SOURCES:
+        importlib.import_module(BUILTIN_SOURCES[name])
+    if name not in SOURCES:
+        raise SourceError("Unknown sensor source: " + name)
+
+    source_type = SOURCES[name]
+    if not argument and source_type.required_argument is not None:
+        raise SourceError("Sensor source " + name + " needs an argument: " + name + ":<" +
+                          source_type.required_argument + ">")
+
+    return source_type(argument) if argument else source_type()
+
+
+class SensorGroup:
+    """Sensor sources read together, each source in its own worker thread."""
+
+    def __init__(self, specs):
+        """Constructor for the group, "specs" is a list of source specifications (see create_source())."""
+
+        self.specs = list(specs)
+        self.sources = []
+        self.executors = []
+
+        # Specification of each source, and the sources failing in the last call (see call())
+        self.names = []
+        self.failing = set()
+
+        # Hardware nodes and sensors of the last discovery, shared by the UI and the polling thread
+        self.catalog = SensorCatalog(self)
+
+    def start(self):
+        """Create and open the sources, sources that are not available are left out.
+
+        Returns:
+            - A list of error messages, one for each source that is not available
+        """
+
+        errors = []
+        for spec in self.specs:
+            try:
+                source = create_source(spec)
+            except SourceError as e:
+                errors.append(str(e))
+                continue
+            except Exception as e:
+                errors.append("Could not create sensor source " + spec + ": " + str(e))
+                continue
+
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+            try:
+                executor.submit(source.open).result()
+            except Exception as e:
+                errors.append(str(e) if isinstance(e, SourceError) else
+                              "Could not open sensor source " + spec + ": " + str(e))
+                executor.shutdown()
+                continue
+
+            self.sources.append(source)
+            self.executors.append(executor)
+            self.names.append(spec)
+
+        return errors
+
+    def stop(self):
+        """Close the sources and stop the worker threads."""
+
+        for source, executor in zip(self.sources, self.executors):
+            executor.submit(source.close)
+            executor.shutdown()
+        self.sources = []
+        self.executors = []
+        self.names = []
+        self.failing = set()
+        self.catalog.invalidate()
+
+    def call(self, method, *args):
+        """Call a method of all sources in parallel, returns the results in the order of the sources.
+
+        A source failing does not affect the other sources, its result is None.
+        The error is printed when the source starts failing, and a message when it works again.
+        """
+
+        futures = [executor.submit(getattr(source, method), *args)
+                   for source, executor in zip(self.sources, self.executors)]
+
+        results = []
+        for name, future in zip(self.names, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(None)
+                if name not in self.failing:
+                    self.failing.add(name)
+                    print("Sensor source " + name + " failed: " + str(e))
+            else:
+                if name in self.failing:
+                    self.failing.discard(name)
+                    print("Sensor source " + name + " available again")
+        return results
+
+    def discover(self):
+        """Find the sensors of all sources.
+
+        Returns:
+            - A tuple of two lists, all hardware nodes (HardwareInfo) and all sensors (SensorInfo)
+        """
+
+        self.call("discover")
+
+        hardware, sensors = [], []
+        for metadata in self.call("metadata"):
+            if metadata is not None:
+                hardware.extend(metadata[0])
+                sensors.extend(metadata[1])
+        return hardware, sensors
+
+    def read(self, identifiers=None):
+        """Return the current values of the sensors of all sources, as a dictionary {identifier: temperature}.
+
+        "identifiers" is a list of the sensors needed, None for all sensors.
+        The sensors of a source that cannot be read are missing.
+        """
+
+        values = {}
+        for batch in self.call("read_batch", identifiers):
+            if batch is not None:
+                values.update(batch)
+        return values
+
+
+class SensorCatalog:
+    """Hardware nodes and sensors of a sensor group by identifier, filled by one discovery of all sources.
+
+    The catalog is discovered again at the first lookup after "ttl" (s), or after invalidate().
+    """
+
+    def __init__(self, group, ttl=CATALOG_TTL):
+        """Constructor for the catalog of the sensor group "group"."""
+
+        self.group = group
+        self.ttl = ttl
+
+        # {identifier: HardwareInfo} and {identifier: SensorInfo}, in the order discovered
+        self.hardware = {}
+        self.sensors = {}
+
+        # Time (time.monotonic()) of the last discovery, None if the catalog must be discovered
+        self.updated = None
+
+        # Lookups come from the UI, the polling thread may invalidate the catalog
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        """Discover the sensors again at the next lookup, e.g. when a selected sensor is no longer available."""
+
+        with self.lock:
+            self.updated = None
+
+    def refresh(self):
+        """Discover the hardware nodes and sensors of all sources now."""
+
+        hardware, sensors = self.group.discover()
+
+        with self.lock:
+            self.hardware = {node.identifier: node for node in hardware}
+            self.sensors = {sensor.identifier: sensor for sensor in sensors}
+            self.updated = time.monotonic()
+
+    def is_stale(self):
+        """Return True if the catalog must be discovered again."""
+
+        with self.lock:
+            return self.updated is None or time.monotonic() - self.updated > self.ttl
+
+    def entries(self):
+        """Return all hardware nodes and sensors, as a tuple of two lists (HardwareInfo, SensorInfo)."""
+
+        if self.is_stale():
+            self.refresh()
+        with self.lock:
+            return list(self.hardware.values()), list(self.sensors.values())
+
+    def sensor(self, identifier):
+        """Return the SensorInfo of a sensor, None if not found."""
+
+        if self.is_stale():
+            self.refresh()
+        with self.lock:
+            return self.sensors.get(identifier)
+
+    def name(self, identifier, default=None):
+        """Return the name of a sensor, "default" if not found."""
+
+        sensor = self.sensor(identifier)
+        return sensor.name if sensor is not None else default
+
+    def hardware_of(self, identifier):
+        """Return the HardwareInfo of the hardware node of a sensor, None if not found."""
+
+        sensor = self.sensor(identifier)
+        with self.lock:
+            return self.hardware.get(sensor.parent) if sensor is not None else None
+
+
+def parse_line(line):
+    """Parse a line "<identifier> <value> [<name>]" of a sensor feed.
+
+    Returns:
+        - A tuple (identifier, value, name), the name is the identifier if not given
+        - None for empty lines, comments (starting with "#") and invalid lines
+    """
+
+    parts = line.split(None, 2)
+    if len(parts) < 2 or parts[0].startswith("#"):
+        return None
+    try:
+        value = float(parts[1])
+    except ValueError:
+        return None
+    return parts[0], value, parts[2].strip() if len(parts) == 3 else parts[0]
+
+
+@register("file")
+class FileSource(SensorSource):
+    """Sensor values from a text file or a named pipe (FIFO), one sensor per line: "<identifier> <value> [<name>]".
+
+    A file is read completely at each poll, e.g. rewritten by a script.
+    A pipe is read without blocking, the last value written for each sensor is kept.
+    """
+
+    required_argument = "path"
+
+    def __init__(self, path):
+        """Constructor for the source, reading "path"."""
+
+        self.path = path
+        self.fd = None
+        self.is_pipe = False
+
+        # Last value and name of each sensor, and the incomplete line at the end of the pipe data
+        self.values = {}
+        self.names = {}
+        self.partial = b""
+
+    def open(self):
+        try:
+            self.is_pipe = stat.S_ISFIFO(os.stat(self.path).st_mode)
+            self.fd = os.open(self.path, os.O_RDONLY | (getattr(os, "O_NONBLOCK", 0) if self.is_pipe else 0))
+        except OSError as e:
+            raise SourceError("Sensor feed " + self.path + " not available: " + str(e))
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def read_lines(self):
+        """Return the complete lines read since the last call (pipe) or the whole file (file)."""
+
+        if not self.is_pipe:
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            chunks = []
+            while True:
+                chunk = os.read(self.fd, 65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            return b"".join(chunks).decode(errors="replace").splitlines()
+
+        data = self.partial
+        while True:
+            try:
+                chunk = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            data += chunk
+
+        lines, _, self.partial = data.rpartition(b"\n")
+        return lines.decode(errors="replace").splitlines()
+
+    def discover(self):
+        self.read_batch()
+        return len(self.values)
+
+    def metadata(self):
+        parent = "/file/" + os.path.basename(self.path)
+        return ([HardwareInfo(parent, self.path)],
+                [SensorInfo(identifier, self.names[identifier], parent) for identifier in self.values])
+
+    def read_batch(self, identifiers=None):
+        # The values of a file are replaced at each read, the values of a pipe are kept until updated
+        if not self.is_pipe:
+            self.values = {}
+
+        for line in self.read_lines():
+            parsed = parse_line(line)
+            if parsed is not None:
+                identifier, value, name = parsed
+                self.values[identifier] = value
+                self.names[identifier] = name
+
+        return dict(self.values)
+
+
+@register("static")
+class StaticSource(SensorSource):
+    """Fixed sensor values, e.g. for testing without sensor hardware.
+
+    The argument is a list "<identifier>=<value>,...", by default one CPU and one GPU sensor.
+    """
+
+    def __init__(self, argument="/static/cpu/temperature/0=40,/static/gpu/temperature/0=50"):
+        """Constructor for the source."""
+
+        self.values = {}
+        for item in argument.split(","):
+            identifier, _, value = item.partition("=")
+            try:
+                self.values[identifier.strip()] = float(value)
+            except ValueError:
+                raise SourceError("Invalid static sensor value, \"<identifier>=<value>\" expected: " + item)
+
+    def discover(self):
+        return len(self.values)
+
+    def metadata(self):
+        return ([HardwareInfo("/static", "Static sensors")],
+                [SensorInfo(identifier, identifier, "/static") for identifier in self.values])
+
+    def read_batch(self, identifiers=None):
+        return dict(self.values)
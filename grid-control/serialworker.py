@@ -0,0 +1,322 @@
+"""
+    serialworker.py
+    ---------------
+    Implements a QThread owning the serial port of the Grid.
+    Grid commands are executed one at a time from a priority queue, fan voltage writes preempt telemetry reads.
+
+    Several Grid units are supported, each on its own serial port with its own worker thread.
+    Fans on several units are addressed as (device, fan), where "device" is the index of the unit.
+"""
+
+import itertools
+import queue
+import sys
+import threading
+from concurrent.futures import Future
+
+import serial
+from PyQt5 import QtCore
+
+import grid
+import helper
+
+# Command priorities, lower value is executed first
+PRIORITY_WRITE = 0
+PRIORITY_READ = 1
+PRIORITY_STOP = 2
+
+# Number of fans read per telemetry command, queued fan voltage writes are executed between the commands
+TELEMETRY_CHUNK = 2
+
+
+class SerialWorker(QtCore.QThread):
+    """QThread, executes queued Grid commands and returns the results as futures."""
+
+    # Signal handling exceptions from commands, e.g. a serial port that was disconnected
+    exception_signal = QtCore.pyqtSignal(str)
+
+    def __init__(self, ser, lock):
+        """Constructor for the serial worker thread."""
+
+        super().__init__()
+
+        # Serial device
+        self.ser = ser
+
+        # Lock, still needed for opening/closing the serial port from the UI
+        self.lock = lock
+
+        # Queue of (priority, sequence number, future, function, arguments)
+        # The sequence number keeps commands with the same priority in order
+        self.commands = queue.PriorityQueue()
+        self.sequence = itertools.count()
+
+    def __del__(self):
+        self.wait()
+
+    def submit(self, priority, function, *args):
+        """Queue "function(*args)" for execution in the worker thread.
+
+        Returns:
+            - A future holding the result of the function
+        """
+
+        future = Future()
+        self.commands.put((priority, next(self.sequence), future, function, args))
+        return future
+
+    def set_fan(self, fan, voltage):
+        """Queue a fan voltage write, preempting queued telemetry reads."""
+
+        return self.submit(PRIORITY_WRITE, grid.set_fan, self.ser, fan, voltage, self.lock)
+
+    def set_all_fans(self, voltages):
+        """Queue a voltage write to several fans ({fan: voltage}) in one transaction."""
+
+        return self.submit(PRIORITY_WRITE, grid.set_all_fans, self.ser, voltages, self.lock)
+
+    def read_all_telemetry(self, read_voltage=True, fans=grid.FANS):
+        """Queue a telemetry read, the result is a tuple (rpm list, voltage list), see grid.read_all_telemetry()."""
+
+        return self.submit(PRIORITY_READ, grid.read_all_telemetry, self.ser, self.lock, read_voltage, fans)
+
+    def flush(self):
+        """Wait until all queued commands have been executed."""
+
+        self.submit(PRIORITY_STOP, lambda: None).result()
+
+    def stop(self):
+        """Stop the worker thread gracefully, after all queued commands have been executed."""
+
+        self.submit(PRIORITY_STOP, None)
+        self.wait()
+
+    def run(self):
+        """Main thread processing loop, executes queued commands until stopped."""
+
+        while True:
+            priority, _, future, function, args = self.commands.get()
+
+            # "None" is queued by stop()
+            if function is None:
+                future.set_result(None)
+                break
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                result = function(*args)
+
+            # Report every failure to the main application, which shows the error message (writes are not waited for)
+            # The signal is emitted before the future is completed, so it is received before any signal
+            # emitted by a thread waiting for the result
+            except grid.GridError as e:
+                self.exception_signal.emit(str(e))
+                future.set_exception(e)
+
+            except Exception as e:
+                (type, value, traceback) = sys.exc_info()
+                self.exception_signal.emit(helper.exception_message_qthread(type, value, traceback))
+                future.set_exception(e)
+
+            else:
+                future.set_result(result)
+
+
+class SetFanCoalescer:
+    """Coalesces fan voltage writes before they are queued in the serial worker.
+
+    - Writes that do not change the last voltage written to a fan are dropped
+    - While a write to a fan is in progress, only the newest voltage for that fan is kept and written afterwards
+    """
+
+    def __init__(self, worker):
+        """Constructor for the write coalescer."""
+
+        self.worker = worker
+
+        # Reentrant, a done callback runs directly if the write has already finished
+        self.lock = threading.RLock()
+
+        # Last voltage written to each fan, voltage being written and newest voltage waiting to be written
+        self.committed = {}
+        self.in_flight = {}
+        self.pending = {}
+
+        # Number of set voltage frames sent to the Grid and frames avoided by coalescing
+        self.frames_sent = 0
+        self.frames_avoided = 0
+
+    def reset(self):
+        """Forget the last written voltages, e.g. after the Grid has been initialized."""
+
+        with self.lock:
+            self.committed.clear()
+
+    def set_fan(self, fan, voltage):
+        """Request "voltage" for "fan", the serial frame is only sent if it changes the fan voltage."""
+
+        with self.lock:
+            if fan in self.in_flight:
+                # An older pending voltage is replaced (or dropped if the voltage being written is requested again)
+                if self.pending.pop(fan, None) is not None:
+                    self.frames_avoided += 1
+
+                if voltage == self.in_flight[fan]:
+                    self.frames_avoided += 1
+                else:
+                    self.pending[fan] = voltage
+
+            elif self.committed.get(fan) == voltage:
+                self.frames_avoided += 1
+
+            else:
+                self._write({fan: voltage})
+
+    def set_fans(self, voltages):
+        """Request voltages ({fan: voltage}) for several fans, changed voltages are written in one transaction."""
+
+        with self.lock:
+            changed = {}
+            for fan, voltage in voltages.items():
+                # Fans with a write in progress are handled the same way as in set_fan()
+                if fan in self.in_flight or self.committed.get(fan) == voltage:
+                    self.set_fan(fan, voltage)
+                else:
+                    changed[fan] = voltage
+
+            if changed:
+                self._write(changed)
+
+    def _write(self, voltages):
+        """Queue the write in the serial worker, the lock must be held."""
+
+        self.in_flight.update(voltages)
+        self.frames_sent += len(voltages)
+
+        if len(voltages) == 1:
+            (fan, voltage), = voltages.items()
+            future = self.worker.set_fan(fan, voltage)
+        else:
+            future = self.worker.set_all_fans(voltages)
+
+        future.add_done_callback(lambda future: self._write_done(voltages, future))
+
+    def _write_done(self, voltages, future):
+        """Called (in the serial worker thread) when a write has finished."""
+
+        with self.lock:
+            # An unsuccessful write leaves the fan voltages unknown
+            # "set_all_fans" returns False if not all fans acknowledged the new voltage
+            successful = future.exception() is None and future.result() is not False
+
+            newest = {}
+            for fan in voltages:
+                voltage = self.in_flight.pop(fan)
+                if successful:
+                    self.committed[fan] = voltage
+                else:
+                    self.committed.pop(fan, None)
+
+                # Write the newest voltage requested while this write was in progress
+                if fan in self.pending:
+                    voltage = self.pending.pop(fan)
+                    if self.committed.get(fan) == voltage:
+                        self.frames_avoided += 1
+                    else:
+                        newest[fan] = voltage
+
+            if newest:
+                self._write(newest)
+
+
+class GridDevice:
+    """A Grid unit on one serial port, with its own serial worker thread and write coalescer."""
+
+    def __init__(self):
+        """Constructor for the Grid unit, starts the serial worker thread."""
+
+        # Object for locking the serial port while sending/receiving data
+        self.lock = threading.Lock()
+
+        # Serial communication object
+        self.ser = serial.Serial()
+
+        # QThread object that owns the serial port and executes all Grid commands
+        self.worker = SerialWorker(ser=self.ser, lock=self.lock)
+        self.worker.start()
+
+        # Drops fan voltage writes that would not change the voltage, e.g. while dragging a slider
+        self.coalescer = SetFanCoalescer(self.worker)
+
+    def open(self, port):
+        """Setup and open the serial port, then initialize the Grid.
+
+        Returns:
+            - True for successful initialization
+
+        Raises:
+            - GridError if the serial port cannot be opened, or the Grid cannot be initialized
+        """
+
+        grid.setup_serial(self.ser, port, self.lock)
+        grid.open_serial(self.ser, self.lock)
+        return grid.initialize_grid(self.ser, self.lock)
+
+    def close(self):
+        """Close the serial port, after queued fan updates have been written."""
+
+        self.worker.flush()
+
+        with self.lock:
+            if self.ser.isOpen():
+                self.ser.close()
+
+    def stop(self):
+        """Close the serial port and stop the serial worker thread."""
+
+        self.close()
+        self.worker.stop()
+
+
+def set_fans(devices, voltages):
+    """Request voltages ({(device, fan): voltage}) for fans on several Grid units.
+
+    Changed voltages are written in one transaction per unit.
+    """
+
+    device_voltages = {}
+    for (device, fan), voltage in voltages.items():
+        device_voltages.setdefault(device, {})[fan] = voltage
+
+    for device, fan_voltages in device_voltages.items():
+        devices[device].coalescer.set_fans(fan_voltages)
+
+def read_all_telemetry(devices, read_voltage=True):
+    """Reads the current rpm and voltage of all fans on all Grid units.
+
+    The units are read concurrently, each by its own serial worker thread.
+    Each unit is read in commands of TELEMETRY_CHUNK fans, so a fan voltage write waits for at most one
+    command instead of the complete read.
+    If "read_voltage" is False, only rpm is read and all voltages are None.
+
+    Returns:
+        - A dictionary with (device, fan) as key and a tuple (rpm, voltage) as value, None if not available
+    """
+
+    chunks = [grid.FANS[i:i + TELEMETRY_CHUNK] for i in range(0, len(grid.FANS), TELEMETRY_CHUNK)]
+
+    # Queue the reads in all workers before waiting for any of them
+    futures = [(device, fans, devices[device].worker.read_all_telemetry(read_voltage, fans))
+               for device in range(len(devices)) for fans in chunks]
+
+    snapshot = {}
+    for device, fans, future in futures:
+        fans_rpm, fans_voltage = future.result()
+        if fans_voltage is None:
+            fans_voltage = [None] * len(fans)
+        for fan, rpm, voltage in zip(fans, fans_rpm, fans_voltage):
+            snapshot[(device, fan)] = (rpm, voltage)
+
+    return snapshot
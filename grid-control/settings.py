@@ -6,10 +6,8 @@
 
 from PyQt5 import QtCore, QtWidgets, QtGui
 
-import openhwmon
 
-
-def read_settings(config, ui, hwmon):
+def read_settings(config, ui, sensor_sources):
     """Read configuration from the OS repository (Registry in Windows, ini-file in Linux).
 
     Uses default values if no settings are found.
@@ -55,16 +53,14 @@ def read_settings(config, ui, hwmon):
     # "Sensor Config" tab
     # ------------------------
 
-    # Get all available temperature sensors
-    sensors = openhwmon.get_temperature_sensors(hwmon)
+    # Names of the available temperature sensors, from the catalog of the sensor sources (sensors.SensorGroup)
+    catalog = sensor_sources.catalog
 
     # Selected CPU sensors
     parent = ui.treeWidgetSelectedCPUSensors
     for id in config.value("cpu_sensor_ids", type=str):
         item = QtWidgets.QTreeWidgetItem(parent)
-        for sensor in sensors:
-            if sensor.Identifier == id:
-                item.setText(0, sensor.Name)
+        item.setText(0, catalog.name(id, ""))
         item.setText(1, id)
         item.setForeground(0, QtGui.QBrush(QtCore.Qt.blue))  # Text color blue
 
@@ -72,9 +68,7 @@ def read_settings(config, ui, hwmon):
     parent = ui.treeWidgetSelectedGPUSensors
     for id in config.value("gpu_sensor_ids", type=str):
         item = QtWidgets.QTreeWidgetItem(parent)
-        for sensor in sensors:
-            if sensor.Identifier == id:
-                item.setText(0, sensor.Name)
+        item.setText(0, catalog.name(id, ""))
         item.setText(1, id)
         item.setForeground(0, QtGui.QBrush(QtCore.Qt.blue))  # Text color blue
 
@@ -0,0 +1,168 @@
+"""
+    telemetry.py
+    ------------
+    Implements a store for the latest acquired values (temperatures, fan rpm and voltage).
+    Acquisition stages running at different rates write to the store, readers always get the newest value
+    together with the time it was acquired.
+
+    Also implements the sample of all polled values sent to the UI, with a mask of the values that changed.
+"""
+
+import threading
+import time
+
+# Bits of the "changed" mask of a sample
+CHANGED_CPU_TEMP = 1 << 0
+CHANGED_GPU_TEMP = 1 << 1
+CHANGED_HWMON_STATUS = 1 << 2
+CHANGED_TELEMETRY = 1 << 3
+CHANGED_STATISTICS = 1 << 4
+
+
+# Bits for the rpm, voltage, status and automatic control speed of each fan, indexed by fan - 1
+CHANGED_RPM = tuple(1 << (5 + index) for index in range(6))
+CHANGED_VOLTAGE = tuple(1 << (11 + index) for index in range(6))
+CHANGED_STATUS = tuple(1 << (17 + index) for index in range(6))
+CHANGED_SPEED = tuple(1 << (23 + index) for index in range(6))
+
+# All values, for the first sample
+CHANGED_ALL = (1 << 29) - 1
+
+
+def average(values):
+    """Return the average of a non-empty list of values."""
+
+    return sum(values) / len(values)
+
+# Functions aggregating the temperatures of the selected sensors, by the name used in the UI ("Max" or "Avg")
+AGGREGATES = {"Max": max,
+              "Avg": average}
+
+
+def aggregate_temperature(sensor_values, sensor_ids, calc):
+    """Return the temperature for the sensors "sensor_ids", aggregated with AGGREGATES[calc].
+
+    "sensor_values" is a dictionary {sensor identifier: value}, see sensors.SensorGroup.read().
+    Returns 0 if no sensors are selected or no values are available.
+    """
+
+    temperatures = [float(sensor_values[id]) for id in sensor_ids if id in sensor_values]
+    if not temperatures:
+        return 0
+    return AGGREGATES[calc](temperatures)
+
+
+class LatestValueStore:
+    """Thread safe store of the latest value of each named quantity.
+
+    Values are replaced as a whole, e.g. "rpm" holds the dictionary {(device, fan): rpm} of the last sweep.
+    """
+
+    def __init__(self):
+        """Constructor for the store."""
+
+        self.lock = threading.Lock()
+
+        # Latest value and acquisition time (time.monotonic()) of each quantity
+        self.values = {}
+        self.timestamps = {}
+
+    def clear(self):
+        """Remove all values, e.g. when polling is restarted."""
+
+        with self.lock:
+            self.values.clear()
+            self.timestamps.clear()
+
+    def update(self, name, value):
+        """Store the latest value of a quantity."""
+
+        with self.lock:
+            self.values[name] = value
+            self.timestamps[name] = time.monotonic()
+
+    def get(self, name, default=None):
+        """Return the latest value of a quantity, "default" if not acquired yet."""
+
+        with self.lock:
+            return self.values.get(name, default)
+
+    def age(self, name):
+        """Return the time (s) since a quantity was acquired, None if not acquired yet."""
+
+        with self.lock:
+            timestamp = self.timestamps.get(name)
+        return None if timestamp is None else time.monotonic() - timestamp
+
+    def snapshot(self):
+        """Return a copy of all latest values, as a dictionary {name: value}."""
+
+        with self.lock:
+            return dict(self.values)
+
+
+class Sample:
+    """All polled values at one point in time.
+
+    "cpu_temp" and "gpu_temp" are the polled temperatures, not rounded (the UI shows whole degrees).
+    "rpm", "voltage" and "status" (True if the fan is running) are lists with one item per fan of the first Grid unit,
+    "speed" holds the fan speeds (percent) set by the automatic fan control, None in manual mode.
+    "telemetry" holds {(device, fan): (rpm, voltage)} for all Grid units.
+    "changed" is a mask of CHANGED_* bits for the values that differ from the previous sample.
+    """
+
+    __slots__ = ("cpu_temp", "gpu_temp", "hwmon_connected", "rpm", "voltage", "status", "speed", "telemetry",
+                 "statistics", "changed")
+
+    def __init__(self):
+        """Constructor for an empty sample (temperatures 0, no fan data)."""
+
+        self.cpu_temp = 0
+        self.gpu_temp = 0
+        self.hwmon_connected = False
+        self.rpm = [None] * 6
+        self.voltage = [None] * 6
+        self.status = [False] * 6
+        self.speed = [None] * 6
+        self.telemetry = {}
+        self.statistics = None
+        self.changed = 0
+
+    def copy(self):
+        """Return a copy of the sample, values are replaced (not modified) in the copy."""
+
+        sample = Sample.__new__(Sample)
+        for name in self.__slots__:
+            setattr(sample, name, getattr(self, name))
+        return sample
+
+    def diff(self, previous):
+        """Return the mask of values that differ from "previous", CHANGED_ALL if there is no previous sample."""
+
+        if previous is None:
+            return CHANGED_ALL
+
+        # Temperatures are compared in whole degrees, as shown in the UI
+        changed = 0
+        if round(self.cpu_temp) != round(previous.cpu_temp):
+            changed |= CHANGED_CPU_TEMP
+        if round(self.gpu_temp) != round(previous.gpu_temp):
+            changed |= CHANGED_GPU_TEMP
+        if self.hwmon_connected != previous.hwmon_connected:
+            changed |= CHANGED_HWMON_STATUS
+        if self.telemetry != previous.telemetry:
+            changed |= CHANGED_TELEMETRY
+        if self.statistics != previous.statistics:
+            changed |= CHANGED_STATISTICS
+
+        for index in range(6):
+            if self.rpm[index] != previous.rpm[index]:
+                changed |= CHANGED_RPM[index]
+            if self.voltage[index] != previous.voltage[index]:
+                changed |= CHANGED_VOLTAGE[index]
+            if self.status[index] != previous.status[index]:
+                changed |= CHANGED_STATUS[index]
+            if self.speed[index] != previous.speed[index]:
+                changed |= CHANGED_SPEED[index]
+
+        return changed
@@ -0,0 +1,28 @@
+"""
+    conftest.py
+    -----------
+    Makes the Grid Control modules importable by the tests, the modules are imported by name (e.g. "import grid").
+    Provides the "grid_emulator" fixture, a Grid emulator on a pseudo-terminal.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def grid_emulator():
+    """A Grid emulator on a pseudo-terminal, without response latency or fan inertia."""
+
+    if not hasattr(os, "openpty"):
+        pytest.skip("the Grid emulator needs a pseudo-terminal")
+
+    import emulator
+
+    grid_emulator = emulator.GridEmulator(latency=0.001, inertia=0)
+    grid_emulator.start()
+    yield grid_emulator
+    grid_emulator.stop()
@@ -0,0 +1,88 @@
+"""
+    test_grid.py
+    ------------
+    Tests of the Grid commands against the Grid emulator.
+"""
+
+import os
+import threading
+
+import pytest
+import serial
+
+import grid
+
+
+@pytest.fixture
+def grid_serial(grid_emulator):
+    """An open serial port connected to the emulator, with the Grid initialized."""
+
+    ser = serial.Serial()
+    lock = threading.Lock()
+    grid.setup_serial(ser, grid_emulator.port, lock)
+    grid.open_serial(ser, lock)
+    assert grid.initialize_grid(ser, lock)
+    yield ser, lock
+    ser.close()
+
+
+def test_set_fan(grid_emulator, grid_serial):
+    ser, lock = grid_serial
+
+    assert grid.set_fan(ser, 3, 7.5, lock)
+    assert grid_emulator.fans[3].voltage == 7.5
+
+    fans_rpm, fans_voltage = grid.read_all_telemetry(ser, lock)
+    assert fans_rpm == [0, 0, round(1500 * 7.5 / 12), 0, 0, 0]
+    assert fans_voltage == [0.0, 0.0, 7.5, 0.0, 0.0, 0.0]
+
+
+def test_set_all_fans(grid_emulator, grid_serial):
+    ser, lock = grid_serial
+    voltages = {1: 4.0, 2: 5.0, 3: 6.5, 4: 8.0, 5: 10.5, 6: 12.0}
+
+    assert grid.set_all_fans(ser, voltages, lock)
+
+    fans_rpm, fans_voltage = grid.read_all_telemetry(ser, lock)
+    assert fans_rpm == [round(1500 * voltage / 12) for voltage in voltages.values()]
+    assert fans_voltage == list(voltages.values())
+
+
+def test_read_telemetry_of_some_fans(grid_emulator, grid_serial):
+    ser, lock = grid_serial
+    grid_emulator.fans[6].set_voltage(12.0)
+
+    assert grid.read_all_telemetry(ser, lock, read_voltage=False, fans=[5, 6]) == ([0, 1500], None)
+    assert grid.read_all_telemetry(ser, lock, fans=[6]) == ([1500], [12.0])
+
+
+@pytest.mark.skipif(not hasattr(os, "openpty"), reason="needs a pseudo-terminal")
+def test_initialize_grid_without_response():
+    # A pseudo-terminal without an emulator, nothing is answered
+    master, slave = os.openpty()
+    ser = serial.Serial()
+    lock = threading.Lock()
+    try:
+        grid.setup_serial(ser, os.ttyname(slave), lock)
+        grid.open_serial(ser, lock)
+        with pytest.raises(grid.GridError, match="no response"):
+            grid.initialize_grid(ser, lock)
+    finally:
+        ser.close()
+        os.close(master)
+        os.close(slave)
+
+
+def test_open_serial_error():
+    ser = serial.Serial()
+    lock = threading.Lock()
+    grid.setup_serial(ser, "/nonexistent/serial/port", lock)
+
+    with pytest.raises(grid.GridError):
+        grid.open_serial(ser, lock)
+
+
+@pytest.mark.parametrize("percent, voltage", [(0, 0), (32, 0), (33, 4.0), (100, 12.0), (150, 12.0),
+                                              (float("nan"), 12.0), (float("-inf"), 0)])
+def test_calculate_voltage(percent, voltage):
+    assert grid.calculate_voltage(percent) == voltage
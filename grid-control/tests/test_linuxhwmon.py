@@ -0,0 +1,70 @@
+"""
+    test_linuxhwmon.py
+    ------------------
+    Tests of the Linux hwmon sensor source, on a directory tree like /sys/class/hwmon.
+"""
+
+import os
+
+import pytest
+
+import linuxhwmon
+import sensors
+
+
+@pytest.fixture
+def hwmon_root(tmp_path):
+    """Two hwmon devices, "coretemp" with two labelled temperature inputs and "nvme" with one input."""
+
+    for name, driver, inputs in [("hwmon0", "coretemp", {1: ("45000", "Package id 0"), 2: ("43500", "Core 0")}),
+                                 ("hwmon1", "nvme", {1: ("38850", None)})]:
+        path = tmp_path / name
+        path.mkdir()
+        (path / "name").write_text(driver + "\n")
+        for index, (value, label) in inputs.items():
+            (path / ("temp%d_input" % index)).write_text(value + "\n")
+            if label is not None:
+                (path / ("temp%d_label" % index)).write_text(label + "\n")
+    return tmp_path
+
+
+def test_metadata(hwmon_root):
+    source = linuxhwmon.HwmonSource(str(hwmon_root))
+    source.open()
+    try:
+        hardware, sensor_infos = source.metadata()
+    finally:
+        source.close()
+
+    assert all(isinstance(item, sensors.HardwareInfo) for item in hardware)
+    assert all(isinstance(item, sensors.SensorInfo) for item in sensor_infos)
+    assert [(item.identifier, item.name, item.parent) for item in hardware] == [("/hwmon/coretemp", "coretemp", ""),
+                                                                                  ("/hwmon/nvme", "nvme", "")]
+    assert [(item.identifier, item.name, item.parent) for item in sensor_infos] == [
+        ("/hwmon/coretemp/temperature/1", "Package id 0", "/hwmon/coretemp"),
+        ("/hwmon/coretemp/temperature/2", "Core 0", "/hwmon/coretemp"),
+        ("/hwmon/nvme/temperature/1", "Temperature 1", "/hwmon/nvme")]
+
+
+def test_read(hwmon_root):
+    source = linuxhwmon.HwmonSource(str(hwmon_root))
+    source.open()
+    try:
+        assert source.read_batch() == {"/hwmon/coretemp/temperature/1": 45.0,
+                                       "/hwmon/coretemp/temperature/2": 43.5,
+                                       "/hwmon/nvme/temperature/1": 38.85}
+
+        # The open inputs are re-read, a sensor that can not be read is left out
+        (hwmon_root / "hwmon0" / "temp1_input").write_text("46000\n")
+        (hwmon_root / "hwmon1" / "temp1_input").write_text("")
+        assert source.read_batch() == {"/hwmon/coretemp/temperature/1": 46.0,
+                                       "/hwmon/coretemp/temperature/2": 43.5}
+    finally:
+        source.close()
+
+
+def test_missing_root(tmp_path):
+    source = linuxhwmon.HwmonSource(os.path.join(str(tmp_path), "missing"))
+
+    with pytest.raises(sensors.SourceError):
+        source.open()
@@ -0,0 +1,100 @@
+"""
+    test_polling.py
+    ---------------
+    Tests of the polling thread, with the Grid emulator and static sensor values.
+"""
+
+import threading
+
+import pytest
+
+pytest.importorskip("PyQt5")
+
+from PyQt5 import QtCore
+
+import control
+import grid
+import polling
+import sensors
+import serialworker
+
+
+@pytest.fixture
+def device(grid_emulator):
+    """A Grid unit connected to the emulator."""
+
+    device = serialworker.GridDevice()
+    assert device.open(grid_emulator.port)
+    yield device
+    device.stop()
+
+
+@pytest.fixture
+def sensor_sources():
+    """Static CPU and GPU temperatures."""
+
+    sensor_sources = sensors.SensorGroup(["static:/cpu=61.6,/gpu=40.2"])
+    assert not sensor_sources.start()
+    yield sensor_sources
+    sensor_sources.stop()
+
+
+def poll(thread, condition, timeout=5):
+    """Run the polling thread until an emitted sample fulfills "condition", return all emitted samples."""
+
+    samples = []
+    done = threading.Event()
+
+    def received(sample):
+        samples.append(sample)
+        if condition(sample):
+            done.set()
+
+    # The test has no event loop, the samples are received in the polling thread
+    thread.snapshot_signal.connect(received, QtCore.Qt.DirectConnection)
+    thread.start()
+    try:
+        assert done.wait(timeout)
+    finally:
+        thread.stop()
+    return samples
+
+
+def test_manual_polling(grid_emulator, device, sensor_sources):
+    grid_emulator.fans[2].set_voltage(6.0)
+    thread = polling.PollingThread(polling_interval=100, devices=[device], sensor_sources=sensor_sources,
+                                   cpu_sensor_ids=["/cpu"], gpu_sensor_ids=["/gpu"], cpu_calc="Max", gpu_calc="Max",
+                                   control_config=control.ControlConfig(automatic=False, curves={}))
+
+    # The temperatures do not change, only the first temperature poll is emitted
+    samples = poll(thread, lambda sample: None not in sample.rpm and sample.hwmon_connected and
+                   len(thread.history) >= 10)
+    sample = samples[-1]
+
+    assert sample.rpm == [0, 750, 0, 0, 0, 0]
+    assert sample.voltage == [0.0, 6.0, 0.0, 0.0, 0.0, 0.0]
+    assert sample.status == [False, True, False, False, False, False]
+    assert sample.speed == [None] * 6
+    assert (sample.cpu_temp, sample.gpu_temp) == pytest.approx((61.6, 40.2))
+
+    # Polls without changed values are kept in the history, but not emitted
+    assert all(sample.changed for sample in samples)
+    assert len(thread.history) > len(samples)
+
+
+def test_automatic_control(grid_emulator, device, sensor_sources):
+    # Fans 1 - 3 follow the CPU temperature, fans 4 - 6 the GPU temperature, 33 % at 40 degrees and 100 % at 80 degrees
+    curves = {fan: control.FanCurve(min_speed=33, start_temp=40, intermediate_speed=66, intermediate_temp=60,
+                                    max_speed=100, max_temp=80, use_cpu=fan <= 3) for fan in range(1, 7)}
+    thread = polling.PollingThread(polling_interval=100, devices=[device], sensor_sources=sensor_sources,
+                                   cpu_sensor_ids=["/cpu"], gpu_sensor_ids=["/gpu"], cpu_calc="Max", gpu_calc="Max",
+                                   control_config=control.ControlConfig(automatic=True, curves=curves))
+
+    sample = poll(thread, lambda sample: None not in sample.voltage and all(sample.voltage))[-1]
+
+    # The temperatures are not rounded for fan control
+    speeds = [round(curves[fan].speed(61.6 if fan <= 3 else 40.2)) for fan in range(1, 7)]
+    voltages = [grid.calculate_voltage(speed) for speed in speeds]
+    assert sample.speed == speeds
+    assert [grid_emulator.fans[fan].voltage for fan in range(1, 7)] == voltages
+    assert sample.voltage == voltages
@@ -0,0 +1,122 @@
+"""
+    test_protocol.py
+    ----------------
+    Tests of the Grid response parser, with lost bytes in pipelined responses.
+"""
+
+import contextlib
+import io
+import os
+import threading
+
+import pytest
+
+import grid
+import protocol
+import transport
+
+# Data of twelve frames, as in a telemetry sweep, including zero values
+DATA = [(0x03, fan) for fan in range(1, 7)] + [(0x00, 0x00), (0x07, 0x50), (0x0C, 0x00), (0x00, 0x00), (0x04, 0x00),
+                                                (0x0B, 0x01)]
+
+
+def frames(data):
+    """Return the responses to a sweep, one five byte frame per item of "data"."""
+
+    return b"".join(protocol.HEADER + bytes(item) for item in data)
+
+def parse(stream, count):
+    """Parse "stream" as the responses to "count" data frame requests, the data is fed in small chunks."""
+
+    parser = protocol.ResponseParser()
+    parser.expect_frames(count)
+    for position in range(0, len(stream), 7):
+        parser.feed(stream[position:position + 7])
+    return parser.finish(), parser.errors
+
+
+def test_complete_frames():
+    results, errors = parse(frames(DATA), len(DATA))
+
+    assert results == DATA
+    assert errors == []
+
+@pytest.mark.parametrize("frame", range(len(DATA)))
+@pytest.mark.parametrize("byte", range(protocol.FRAME_SIZE))
+def test_lost_byte_costs_one_response(frame, byte):
+    stream = bytearray(frames(DATA))
+    del stream[frame * protocol.FRAME_SIZE + byte]
+
+    results, errors = parse(bytes(stream), len(DATA))
+
+    # The frame that lost a byte is missing, all other responses keep their positions
+    assert results == [None if index == frame else item for index, item in enumerate(DATA)]
+    assert errors
+
+@pytest.mark.parametrize("first, second", [(first, second) for first in range(protocol.FRAME_SIZE)
+                                           for second in range(protocol.FRAME_SIZE)])
+def test_lost_bytes_in_adjacent_frames(first, second):
+    stream = bytearray(frames(DATA))
+    del stream[4 * protocol.FRAME_SIZE + second]
+    del stream[3 * protocol.FRAME_SIZE + first]
+
+    results, errors = parse(bytes(stream), len(DATA))
+
+    # Responses are never shifted, at most the two frames that lost a byte are missing
+    assert all(result in (None, item) for result, item in zip(results, DATA))
+    assert all(result == item for result, item in zip(results[:3] + results[5:], DATA[:3] + DATA[5:]))
+
+def test_stray_bytes_before_first_frame():
+    stream = b"\x55\x13" + frames(DATA)
+
+    results, errors = parse(stream, len(DATA))
+
+    assert results == DATA
+    assert len(errors) == 1
+
+def test_acknowledgements():
+    parser = protocol.ResponseParser()
+    parser.expect_byte(protocol.RESPONSE_ACK, count=3)
+    parser.feed(bytes([protocol.RESPONSE_ACK, 0x7F, protocol.RESPONSE_ACK]))
+
+    assert parser.finish() == [protocol.RESPONSE_ACK, None, protocol.RESPONSE_ACK]
+    assert len(parser.errors) == 1
+
+
+@pytest.mark.skipif(not hasattr(os, "openpty"), reason="the Grid emulator needs a pseudo-terminal")
+def test_telemetry_with_lost_bytes():
+    import emulator
+    import serial
+
+    # Each fan has its own voltage (and rpm), a value read for the wrong fan would not match
+    voltages = {1: 4.0, 2: 5.0, 3: 6.5, 4: 8.0, 5: 10.5, 6: 12.0}
+
+    grid_emulator = emulator.GridEmulator(latency=0.001, drop_rate=0.02, inertia=0, seed=1)
+    grid_emulator.start()
+    ser = serial.Serial()
+    lock = threading.Lock()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            grid.setup_serial(ser, grid_emulator.port, lock)
+            grid.open_serial(ser, lock)
+
+            # Lost responses double the response timeout, limit it to keep the test short
+            transport.get_estimator(ser).maximum = 0.05
+
+            for fan, voltage in voltages.items():
+                grid_emulator.fans[fan].set_voltage(voltage)
+
+            missing = 0
+            for _ in range(40):
+                fans_rpm, fans_voltage = grid.read_all_telemetry(ser, lock)
+                for fan, rpm, voltage in zip(grid.FANS, fans_rpm, fans_voltage):
+                    assert rpm in (None, round(1500 * voltages[fan] / 12))
+                    assert voltage in (None, voltages[fan])
+                    missing += (rpm is None) + (voltage is None)
+    finally:
+        ser.close()
+        grid_emulator.stop()
+
+    # Lost bytes only cost the affected values
+    assert grid_emulator.dropped
+    assert 0 < missing <= grid_emulator.dropped
@@ -0,0 +1,135 @@
+"""
+    transport.py
+    ------------
+    Implements response driven serial transactions with the Grid.
+    A transaction writes a request and returns as soon as the expected number of response bytes has arrived,
+    or when an adaptive deadline (based on the measured Grid response time) has passed.
+"""
+
+import os
+import select
+import time
+import weakref
+
+# Initial, minimum and maximum allowed Grid response delay (s), excluding the time on the wire
+INITIAL_RTO = 0.04
+MIN_RTO = 0.01
+MAX_RTO = 0.5
+
+# Estimators for each serial device, created at first use
+_estimators = weakref.WeakKeyDictionary()
+
+
+class RtoEstimator:
+    """Estimates the Grid response delay the same way as a TCP retransmission timeout (RFC 6298).
+
+    A smoothed round-trip time (srtt) and its variation (rttvar) are updated for each successful transaction,
+    the timeout is srtt + 4 * rttvar. The timeout is doubled (up to MAX_RTO) when a transaction times out.
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+
+    def __init__(self, initial=INITIAL_RTO, minimum=MIN_RTO, maximum=MAX_RTO):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.srtt = None
+        self.rttvar = None
+        self.timeout = initial
+
+    def update(self, sample):
+        """Update the estimate with a measured response delay (s)."""
+
+        if self.srtt is None:
+            self.srtt = sample
+            self.rttvar = sample / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - sample)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * sample
+
+        self.timeout = min(self.maximum, max(self.minimum, self.srtt + self.K * self.rttvar))
+
+    def backoff(self):
+        """Double the timeout after a transaction timed out."""
+
+        self.timeout = min(self.maximum, self.timeout * 2)
+
+
+def get_estimator(ser):
+    """Return the response delay estimator for a serial device."""
+
+    estimator = _estimators.get(ser)
+    if estimator is None:
+        estimator = _estimators[ser] = RtoEstimator()
+    return estimator
+
+def byte_time(ser):
+    """Return the time (s) needed to transfer one byte (start bit + 8 data bits + stop bit)."""
+
+    return 10 / ser.baudrate
+
+def read_bytes(ser, size, deadline):
+    """Read "size" bytes from the serial device, or as many as received before "deadline" (time.monotonic()).
+
+    Uses select() on the file descriptor of the serial device when available (POSIX),
+    otherwise the number of waiting bytes is polled once per byte time.
+    """
+
+    response = bytearray()
+
+    try:
+        fd = ser.fileno()
+    except (AttributeError, OSError):
+        fd = None
+
+    while len(response) < size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+
+        if fd is not None:
+            # Block until data is available or the deadline has passed
+            readable, _, _ = select.select([fd], [], [], remaining)
+            if not readable:
+                break
+            response += os.read(fd, size - len(response))
+        else:
+            waiting = ser.in_waiting
+            if waiting:
+                response += ser.read(size=min(waiting, size - len(response)))
+            else:
+                time.sleep(min(remaining, byte_time(ser)))
+
+    return bytes(response)
+
+def transaction(ser, request, response_size, requests=1):
+    """Write "request" to the serial device and read the response.
+
+    "requests" is the number of pipelined requests in "request", the Grid handles them one at a time.
+    The caller must hold the serial lock.
+
+    Returns:
+        - The response, "response_size" bytes if successful, fewer bytes (possibly none) at timeout
+    """
+
+    estimator = get_estimator(ser)
+
+    # Time on the wire for both the request and the response
+    wire_time = (len(request) + response_size) * byte_time(ser)
+
+    start = time.monotonic()
+    ser.write(request)
+    response = read_bytes(ser, response_size, start + wire_time + requests * estimator.timeout)
+
+    if len(response) == response_size:
+        estimator.update(max(0.0, time.monotonic() - start - wire_time) / requests)
+    else:
+        estimator.backoff()
+
+    return response
+
+def read_more(ser, size):
+    """Read "size" additional response bytes, e.g. after stray bytes pushed a response out of a transaction."""
+
+    return read_bytes(ser, size, time.monotonic() + size * byte_time(ser) + get_estimator(ser).timeout)